@@ -0,0 +1,128 @@
+import logging
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import salesforce_api
+from main import DEFAULT_MAX_API_USAGE, log_write_results
+from pipeline import chunked
+from plan import read_plan
+
+"""Write a plan saved by `main.py --plan` to Salesforce.
+
+The plan is streamed into the writer, which sends each batch of changes as soon
+as it fills. Once a plan proves large, the writer buffers up to `--bulk-threshold`
+changes at a time for each Bulk API job instead, so that bounds memory.
+
+Before writing, each batch of contacts is queried again. Contacts whose fields no
+longer hold the values that the plan replaces are skipped rather than overwritten,
+unless `--force` is given, and contacts that already hold the new values are
+skipped since an earlier attempt saved them."""
+
+logger = logging.getLogger(__name__)
+
+# How many contacts' current values to query at once, which keeps the query well
+# within SOQL's length limit.
+CHECK_BATCH_SIZE = 200
+
+
+class ApplyResult(NamedTuple):
+    failed_writes: int
+    # Contacts skipped because they changed since the plan was saved.
+    stale: int
+
+
+def apply(
+    path: Path, writer: salesforce_api.ContactWriter, *, force: bool = False
+) -> ApplyResult:
+    """Write every change in the plan whose contact still has the original values
+    that the plan recorded, or every change if `force`."""
+    failed_writes = 0
+    stale = 0
+    for batch in chunked(read_plan(path), CHECK_BATCH_SIZE):
+        current = (
+            {}
+            if force
+            else salesforce_api.current_values(
+                writer.client,
+                [change.uid for change in batch],
+                {field for change in batch for field in change.changes},
+            )
+        )
+        for change in batch:
+            if not force:
+                values = current.get(change.uid)
+                if values is not None and _holds(values, change.changes):
+                    # Saved by an earlier attempt to apply the plan.
+                    continue
+                if values is None or not _holds(values, change.original):
+                    logger.warning(
+                        f"Skipping {change.uid}, which changed since the plan was saved"
+                    )
+                    stale += 1
+                    continue
+            failed_writes += log_write_results(writer.add(change.uid, change.changes))
+    return ApplyResult(failed_writes + log_write_results(writer.flush()), stale)
+
+
+def _holds(values: dict[str, Any], expected: dict[str, Any]) -> bool:
+    return all(values.get(field) == value for field, value in expected.items())
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser()
+    parser.add_argument("plan", type=Path, help="File saved with main.py --plan")
+    parser.add_argument(
+        "--bulk-threshold",
+        type=int,
+        default=10_000,
+        help="Write plans with at least this many changes through the Bulk API",
+    )
+    parser.add_argument(
+        "--max-api-usage",
+        type=float,
+        default=DEFAULT_MAX_API_USAGE,
+        help="Stop once the org has used this fraction of its daily API requests",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=(
+            "Write every change, even to contacts whose fields changed since the "
+            "plan was saved"
+        ),
+    )
+    return parser
+
+
+def main() -> None:
+    args = create_parser().parse_args()
+    client = salesforce_api.init_client()
+    api_usage = salesforce_api.ApiUsage()
+    client.session.hooks["response"].append(api_usage.response_hook)
+    writer = salesforce_api.ContactWriter(
+        client,
+        bulk_threshold=args.bulk_threshold,
+        api_usage=api_usage,
+        max_api_usage=args.max_api_usage,
+    )
+    try:
+        failed_writes, stale = apply(args.plan, writer, force=args.force)
+    except salesforce_api.ApiLimitReached as e:
+        logger.error(
+            f"{e}. Apply the plan again later: changes that were already saved are "
+            "skipped."
+        )
+        raise SystemExit(1)
+    if stale:
+        logger.warning(
+            f"Skipped {stale} contacts that changed since the plan was saved. Save a "
+            "new plan for them, or apply this one with --force to overwrite them."
+        )
+    if failed_writes:
+        logger.error(f"Failed to write {failed_writes} records")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
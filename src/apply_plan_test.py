@@ -0,0 +1,70 @@
+from pathlib import Path
+
+from simple_salesforce import Salesforce
+
+from apply_plan import ApplyResult, apply
+from conftest import FakeSalesforce
+from plan import PlannedChange, PlanWriter
+from salesforce_api import ContactWriter
+
+
+def test_apply(
+    tmp_path: Path, salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    fake_salesforce.invalid_ids.add("3")
+    path = tmp_path / "plan.jsonl.gz"
+    writer = PlanWriter(path)
+    for uid in ("1", "2", "3"):
+        writer.add(PlannedChange(uid, {"MailingCity": f"City {uid}"}, {}))
+    writer.close()
+
+    result = apply(
+        path,
+        ContactWriter(salesforce_client, bulk_threshold=2, bulk_poll_seconds=0),
+        force=True,
+    )
+    assert result == ApplyResult(failed_writes=1, stale=0)
+    assert fake_salesforce.updates == {
+        "1": {"MailingCity": "City 1"},
+        "2": {"MailingCity": "City 2"},
+    }
+    # Forced plans don't query the contacts.
+    assert fake_salesforce.queries == []
+
+
+def test_apply_skips_contacts_changed_since_the_plan(
+    tmp_path: Path, salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    fake_salesforce.contacts = [
+        {"Id": "1", "MailingCity": "Old 1", "MailingState": None},
+        {"Id": "2", "MailingCity": "Edited", "MailingState": None},
+        {"Id": "3", "MailingCity": "Old 3", "MailingState": None},
+    ]
+    path = tmp_path / "plan.jsonl"
+    writer = PlanWriter(path)
+    for uid in ("1", "2", "3", "deleted"):
+        writer.add(
+            PlannedChange(
+                uid,
+                {"MailingCity": f"New {uid}", "MailingState": "MN"},
+                {"MailingCity": f"Old {uid}", "MailingState": None},
+            )
+        )
+    writer.close()
+
+    result = apply(path, ContactWriter(salesforce_client))
+    assert result == ApplyResult(failed_writes=0, stale=2)
+    assert set(fake_salesforce.updates) == {"1", "3"}
+    assert "Id IN ('1', '2', '3', 'deleted')" in fake_salesforce.queries[-1]
+
+    # Contacts that an earlier attempt saved are skipped too.
+    for contact in fake_salesforce.contacts:
+        contact.update(fake_salesforce.updates.get(contact["Id"], {}))
+    fake_salesforce.updates = {}
+    result = apply(path, ContactWriter(salesforce_client))
+    assert result == ApplyResult(failed_writes=0, stale=2)
+    assert fake_salesforce.updates == {}
+
+    result = apply(path, ContactWriter(salesforce_client), force=True)
+    assert result == ApplyResult(failed_writes=0, stale=0)
+    assert set(fake_salesforce.updates) == {"1", "2", "3", "deleted"}
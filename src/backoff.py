@@ -0,0 +1,37 @@
+import logging
+import time
+from typing import Callable, TypeVar
+
+"""Retry requests to external services that fail transiently, doubling the delay
+after each attempt so that an overloaded service gets time to recover."""
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def with_backoff(
+    call: Callable[[], T],
+    *,
+    service: str,
+    retryable: Callable[[Exception], bool],
+    retries: int = 5,
+    base_delay: float = 1.0,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    """Retry `call` on connection errors and errors that `retryable` accepts."""
+    from requests.exceptions import ConnectionError, Timeout
+
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            if attempt == retries or not (
+                isinstance(e, (ConnectionError, Timeout)) or retryable(e)
+            ):
+                raise
+            delay = base_delay * 2**attempt
+            logger.warning(f"Retrying {service} request in {delay:.0f}s after: {e}")
+            sleep(delay)
+            attempt += 1
@@ -0,0 +1,282 @@
+import json
+import random
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+from pydantic import BaseModel
+
+import salesforce_api
+from city_matcher import DEFAULT_MAX_DISTANCE, FuzzyCityMetro
+from pipeline import (
+    DEFAULT_ADDRESS_MEMO_SIZE,
+    STAGES,
+    EnrichmentMemo,
+    ReferenceData,
+    compute_diffs,
+    enrich_address,
+    normalize,
+    populate_via_reference_data,
+)
+from salesforce_entry import SalesforceEntry
+from state_codes import US_STATES_TO_CODES
+from uszipcode_db import ZipcodeRow
+from zip_index import ZipIndex
+
+"""Measure the throughput of each pipeline stage on synthetic contacts.
+
+Salesforce is replaced by `StubSalesforce` and the reference data is generated
+alongside the contacts, so this needs neither network access nor credentials. Each
+run can be compared against a saved baseline to catch regressions between commits.
+"""
+
+DEFAULT_RECORDS = 50_000
+BASELINE_PATH = Path(".cache/benchmark.json")
+
+# A stage is a regression if its throughput drops by more than this fraction.
+DEFAULT_TOLERANCE = 0.2
+
+US_COUNTRY_SPELLINGS = ["US", "us", "USA", "United States"]
+OTHER_COUNTRY_SPELLINGS = ["MX", "CA", "Canada", "GBR", "DE"]
+CITY_NAMES = ["Springfield", "Fairview", "Riverside", "Franklin", "Madison", "Salem"]
+
+
+def synthetic_reference(zipcodes: int = 2000, seed: int = 0) -> ReferenceData:
+    rng = random.Random(seed)
+    states = list(US_STATES_TO_CODES.values())
+    rows = [
+        ZipcodeRow(
+            zipcode=f"{10_000 + i * 7:05}",
+            state=rng.choice(states),
+            major_city=rng.choice(CITY_NAMES),
+            latitude=None,
+            longitude=None,
+            bounds_west=None,
+            bounds_east=None,
+            bounds_north=None,
+            bounds_south=None,
+        )
+        for i in range(zipcodes)
+    ]
+    us_zip_to_metro = {
+        row.zipcode: f"{row.major_city} Metro" for row in rows if rng.random() < 0.8
+    }
+    us_city_and_state_to_metro = {
+        (row.major_city, row.state): f"{row.major_city} Metro"
+        for row in rows
+        if row.major_city and row.state
+    }
+    return ReferenceData(
+        coordinates_by_email={},
+        reverse_geocode=None,
+        zip_index=ZipIndex.from_rows(rows),
+        us_zip_to_metro=us_zip_to_metro,
+        us_city_and_state_to_metro=FuzzyCityMetro(
+            us_city_and_state_to_metro, max_distance=DEFAULT_MAX_DISTANCE
+        ),
+        # Geocoding needs Mailchimp and Nominatim.
+        stages=frozenset(STAGES) - {"coordinates"},
+    )
+
+
+def synthetic_records(
+    count: int, reference: ReferenceData, seed: int = 0
+) -> list[dict[str, Any]]:
+    """Contacts resembling production data, keyed by their Salesforce names."""
+    rng = random.Random(seed)
+    zipcodes = list(reference.zip_index.zipcodes.items())
+    state_names = {code: name for name, code in US_STATES_TO_CODES.items()}
+    records = []
+    for i in range(count):
+        record: dict[str, Any] = {
+            "Id": f"003{i:015}",
+            "Email": f"contact{i}@example.org" if rng.random() < 0.9 else None,
+            "MailingCity": None,
+            "MailingCountry": None,
+            "MailingLatitude": None,
+            "MailingLongitude": None,
+            "MailingPostalCode": None,
+            "MailingState": None,
+            "MailingStreet": None,
+            "Metro_Area__c": None,
+        }
+        kind = rng.random()
+        if kind < 0.6:
+            zipcode, info = rng.choice(zipcodes)
+            record["MailingCountry"] = rng.choice(US_COUNTRY_SPELLINGS)
+            if rng.random() < 0.3:
+                zipcode = f"{zipcode}-{rng.randrange(10_000):04}"
+            if rng.random() < 0.9:
+                record["MailingPostalCode"] = zipcode
+            if info.state and rng.random() < 0.5:
+                record["MailingState"] = (
+                    state_names[info.state] if rng.random() < 0.3 else info.state
+                )
+            if info.major_city and rng.random() < 0.5:
+                record["MailingCity"] = (
+                    info.major_city.upper() if rng.random() < 0.2 else info.major_city
+                )
+            record["MailingStreet"] = f"{rng.randrange(1, 9999)} Main St"
+        elif kind < 0.8:
+            record["MailingCountry"] = rng.choice(OTHER_COUNTRY_SPELLINGS)
+            record["MailingCity"] = rng.choice(CITY_NAMES).upper()
+        # Otherwise the contact has no address at all.
+        records.append(record)
+    return records
+
+
+class StubSalesforce:
+    """Returns `records` for every query and accepts every write."""
+
+    def __init__(self, records: list[dict[str, Any]]) -> None:
+        self.records = records
+
+    def query_all_iter(self, query: str) -> Iterator[dict[str, Any]]:
+        return iter(self.records)
+
+    def restful(self, path: str, method: str, json: dict[str, Any]) -> list[Any]:
+        return [{"success": True, "errors": []} for _ in json["records"]]
+
+
+def run(records: list[dict[str, Any]], reference: ReferenceData) -> dict[str, float]:
+    """Time each stage over every record, returning records per second by stage.
+
+    The enrichment stages run without the address memo, so that each stage's own
+    cost shows. The memo is timed separately, enriching fresh copies of the
+    contacts end to end.
+    """
+    client: Any = StubSalesforce(records)
+    rates = {}
+
+    @contextmanager
+    def stage(name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        yield
+        rates[name] = len(records) / max(time.perf_counter() - start, 1e-9)
+
+    with stage("load_data"):
+        entries = list(salesforce_api.load_data(client))
+    with stage("normalize"):
+        for entry in entries:
+            normalize(entry, reference)
+    zipcode_reference = reference._replace(stages=frozenset({"zipcode"}))
+    with stage("zipcode"):
+        for entry in entries:
+            populate_via_reference_data(entry, zipcode_reference)
+    metro_reference = reference._replace(stages=frozenset({"metro"}))
+    with stage("metro"):
+        for entry in entries:
+            populate_via_reference_data(entry, metro_reference)
+    with stage("compute_changes"):
+        diffs = [(entry.uid, entry.compute_changes()) for entry in entries]
+    memo_entries = list(salesforce_api.load_data(client))
+    with stage("address_memo"):
+        memo = EnrichmentMemo(DEFAULT_ADDRESS_MEMO_SIZE)
+        for _ in compute_diffs(memo_entries, reference, memo=memo):
+            pass
+    with stage("write"):
+        writer = salesforce_api.ContactWriter(client, bulk_threshold=len(records) + 1)
+        for uid, changes in diffs:
+            if changes:
+                writer.add(uid, changes)
+        writer.flush()
+    return rates
+
+
+class UntrackedEntry(SalesforceEntry):
+    """Assigns fields without tracking them, like before `compute_changes` used
+    change tracking rather than comparing dumps from before and after enrichment."""
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        BaseModel.__setattr__(self, name, value)
+
+
+def compare_change_tracking(
+    records: list[dict[str, Any]], reference: ReferenceData
+) -> dict[str, float]:
+    """Records per second enriching contacts and computing their changes, with
+    change tracking and by comparing model dumps."""
+    rates = {}
+    for name, model in (("tracked", SalesforceEntry), ("dumps", UntrackedEntry)):
+        entries = [model(**record) for record in records]
+        start = time.perf_counter()
+        for entry in entries:
+            if model is UntrackedEntry:
+                original = entry.model_dump(by_alias=True)
+            enrich_address(entry, reference)
+            if model is UntrackedEntry:
+                dump = entry.model_dump(by_alias=True)
+                {key: value for key, value in dump.items() if value != original[key]}
+            else:
+                entry.compute_changes()
+        rates[name] = len(records) / max(time.perf_counter() - start, 1e-9)
+    return rates
+
+
+def find_regressions(
+    rates: dict[str, float], baseline: dict[str, float], tolerance: float
+) -> list[str]:
+    return [
+        f"{name}: {rate:,.0f} records/s, down from {baseline[name]:,.0f}"
+        for name, rate in rates.items()
+        if name in baseline and rate < baseline[name] * (1 - tolerance)
+    ]
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser()
+    parser.add_argument("--records", type=int, default=DEFAULT_RECORDS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=BASELINE_PATH,
+        help="JSON file of records per second by stage to compare against",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Save this run's results as the new baseline",
+    )
+    parser.add_argument(
+        "--compare-change-tracking",
+        action="store_true",
+        help="Compare change tracking with comparing model dumps, then exit",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Fail if a stage is slower than the baseline by more than this fraction",
+    )
+    return parser
+
+
+def main() -> None:
+    args = create_parser().parse_args()
+    reference = synthetic_reference(seed=args.seed)
+    records = synthetic_records(args.records, reference, args.seed)
+    if args.compare_change_tracking:
+        for name, rate in compare_change_tracking(records, reference).items():
+            print(f"{name:>24}: {rate:>12,.0f} records/s")
+        return
+    rates = run(records, reference)
+    for name, rate in rates.items():
+        print(f"{name:>24}: {rate:>12,.0f} records/s")
+
+    regressions = []
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        regressions = find_regressions(rates, baseline, args.tolerance)
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(rates, indent=2))
+    if regressions:
+        print("Regressions:", *regressions, sep="\n  ")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
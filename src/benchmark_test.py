@@ -0,0 +1,45 @@
+import benchmark
+from salesforce_entry import SalesforceEntry
+
+
+def test_synthetic_records_are_valid() -> None:
+    reference = benchmark.synthetic_reference(zipcodes=50)
+    records = benchmark.synthetic_records(500, reference)
+    for record in records:
+        entry = SalesforceEntry(**record)
+        entry.normalize()
+    assert any(
+        (record["MailingPostalCode"] or "").count("-") == 1 for record in records
+    )
+    assert any((record["MailingCity"] or "").isupper() for record in records)
+
+
+def test_run_times_every_stage() -> None:
+    reference = benchmark.synthetic_reference(zipcodes=50)
+    rates = benchmark.run(benchmark.synthetic_records(200, reference), reference)
+    assert list(rates) == [
+        "load_data",
+        "normalize",
+        "zipcode",
+        "metro",
+        "compute_changes",
+        "address_memo",
+        "write",
+    ]
+    assert all(rate > 0 for rate in rates.values())
+
+
+def test_compare_change_tracking() -> None:
+    reference = benchmark.synthetic_reference(zipcodes=50)
+    records = benchmark.synthetic_records(200, reference)
+    rates = benchmark.compare_change_tracking(records, reference)
+    assert list(rates) == ["tracked", "dumps"]
+    assert all(rate > 0 for rate in rates.values())
+
+
+def test_find_regressions() -> None:
+    baseline = {"normalize": 1000.0, "write": 1000.0}
+    rates = {"normalize": 850.0, "write": 700.0, "load_data": 10.0}
+    assert benchmark.find_regressions(rates, baseline, tolerance=0.2) == [
+        "write: 700 records/s, down from 1,000"
+    ]
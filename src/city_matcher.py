@@ -0,0 +1,156 @@
+import logging
+import re
+from collections import OrderedDict, defaultdict
+from typing import Iterable, Iterator, Mapping
+
+from Levenshtein import distance
+
+"""Match misspelled or differently abbreviated US cities to the metro table.
+
+Exact lookups miss cities like "St. Paul" vs "Saint Paul" or "Minneapolis " with
+stray whitespace. `FuzzyCityMetro` first compares canonical spellings, then
+searches a BK-tree of the state's cities for the closest name within an edit
+distance, which only visits a small part of the tree per query."""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_DISTANCE = 2
+
+# How many distinct misspellings `FuzzyCityMetro` remembers the match for.
+DEFAULT_MEMO_SIZE = 10_000
+
+_ABBREVIATIONS = {"st": "saint", "ste": "sainte", "ft": "fort", "mt": "mount"}
+
+
+def canonical_city(city: str) -> str:
+    words = re.sub(r"[^\w\s]", " ", city.casefold()).split()
+    return " ".join(_ABBREVIATIONS.get(word, word) for word in words)
+
+
+class _Node:
+    __slots__ = ("word", "children")
+
+    def __init__(self, word: str) -> None:
+        self.word = word
+        self.children: dict[int, _Node] = {}
+
+
+class BKTree:
+    """Words indexed by Levenshtein distance, so that a search only descends into
+    subtrees whose distance from the root can be within the threshold."""
+
+    def __init__(self, words: Iterable[str] = ()) -> None:
+        self.root: _Node | None = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str) -> None:
+        if self.root is None:
+            self.root = _Node(word)
+            return
+        node = self.root
+        while True:
+            d = distance(word, node.word)
+            if d == 0:
+                return
+            if d not in node.children:
+                node.children[d] = _Node(word)
+                return
+            node = node.children[d]
+
+    def search(self, word: str, max_distance: int) -> list[tuple[int, str]]:
+        """Return (distance, word) pairs within `max_distance`, closest first."""
+        matches = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            d = distance(word, node.word)
+            if d <= max_distance:
+                matches.append((d, node.word))
+            for child_distance, child in node.children.items():
+                # By the triangle inequality, no closer words are in other subtrees.
+                if d - max_distance <= child_distance <= d + max_distance:
+                    stack.append(child)
+        return sorted(matches)
+
+
+class FuzzyCityMetro(Mapping[tuple[str, str], str]):
+    """A drop-in for the `(city, state)` to metro dict that also matches cities
+    within `max_distance` edits of a known city in the same state.
+
+    Names shorter than four letters per allowed edit are only matched exactly, and
+    ties between different metros are treated as misses, as are canonical spellings
+    shared by cities in different metros. The results for the `memo_size` most
+    recently used misspellings are memoized, since they recur across contacts.
+    """
+
+    def __init__(
+        self,
+        metros: dict[tuple[str, str], str],
+        *,
+        max_distance: int = DEFAULT_MAX_DISTANCE,
+        memo_size: int = DEFAULT_MEMO_SIZE,
+    ) -> None:
+        self.metros = metros
+        self.max_distance = max_distance
+        self.memo_size = memo_size
+        metros_by_key: dict[tuple[str, str], set[str]] = defaultdict(set)
+        cities_by_state: dict[str, list[str]] = defaultdict(list)
+        for (city, state), metro in metros.items():
+            key = canonical_city(city)
+            metros_by_key[(key, state)].add(metro)
+            cities_by_state[state].append(key)
+        self.canonical: dict[tuple[str, str], str] = {}
+        for (key, state), candidates in metros_by_key.items():
+            if len(candidates) == 1:
+                self.canonical[(key, state)] = candidates.pop()
+            else:
+                logger.warning(
+                    f"Cities spelled like '{key}', {state} are in different metros "
+                    f"{sorted(candidates)}, so only their exact spellings match"
+                )
+        self.trees = {
+            state: BKTree(cities) for state, cities in cities_by_state.items()
+        }
+        self.memo: OrderedDict[tuple[str, str], str | None] = OrderedDict()
+        self.searches = 0
+        self.fuzzy_hits = 0
+
+    def __getitem__(self, key: tuple[str, str]) -> str:
+        if (metro := self.metros.get(key)) is not None:
+            return metro
+        if key in self.memo:
+            self.memo.move_to_end(key)
+            metro = self.memo[key]
+        else:
+            self.searches += 1
+            metro = self.memo[key] = self._match(*key)
+            if len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+        if metro is None:
+            raise KeyError(key)
+        self.fuzzy_hits += 1
+        return metro
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        return iter(self.metros)
+
+    def __len__(self) -> int:
+        return len(self.metros)
+
+    def _match(self, city: str, state: str) -> str | None:
+        key = canonical_city(city)
+        if (metro := self.canonical.get((key, state))) is not None:
+            return metro
+        tree = self.trees.get(state)
+        max_distance = min(self.max_distance, len(key) // 4)
+        if tree is None or max_distance == 0:
+            return None
+        matches = tree.search(key, max_distance)
+        if not matches:
+            return None
+        best = matches[0][0]
+        metros = {
+            self.canonical.get((match, state)) for d, match in matches if d == best
+        }
+        return metros.pop() if len(metros) == 1 else None
@@ -0,0 +1,123 @@
+import random
+import string
+
+import pytest
+from Levenshtein import distance
+
+from city_matcher import BKTree, FuzzyCityMetro, canonical_city
+
+
+@pytest.mark.parametrize(
+    "city,expected",
+    [
+        ("St. Paul", "saint paul"),
+        ("  Minneapolis ", "minneapolis"),
+        ("Ft. Worth", "fort worth"),
+        ("Winston-Salem", "winston salem"),
+        ("Stillwater", "stillwater"),
+    ],
+)
+def test_canonical_city(city: str, expected: str) -> None:
+    assert canonical_city(city) == expected
+
+
+def test_bk_tree_search_matches_brute_force() -> None:
+    rng = random.Random(0)
+    words = [
+        "".join(rng.choices(string.ascii_lowercase[:6], k=rng.randrange(3, 9)))
+        for _ in range(500)
+    ]
+    tree = BKTree(words)
+    for query in words[:50] + ["abc", "fedcba", "aaaaaaaa"]:
+        for max_distance in range(3):
+            expected = sorted(
+                (d, word)
+                for word in set(words)
+                if (d := distance(query, word)) <= max_distance
+            )
+            assert tree.search(query, max_distance) == expected
+
+
+METROS = {
+    ("Saint Paul", "MN"): "Minneapolis-St. Paul",
+    ("Minneapolis", "MN"): "Minneapolis-St. Paul",
+    ("Duluth", "MN"): "Duluth",
+    ("Fort Worth", "TX"): "Dallas-Fort Worth",
+    ("Austin", "TX"): "Austin",
+    ("Austin", "MN"): "Austin MN",
+    ("Houston", "TX"): "Houston",
+    ("Bryan", "TX"): "College Station-Bryan",
+    ("Ely", "MN"): "Ely",
+    ("Dayton", "TX"): "Houston",
+    ("Clayton", "TX"): "Clayton",
+}
+
+
+@pytest.mark.parametrize(
+    "city,state,expected",
+    [
+        ("Duluth", "MN", "Duluth"),
+        ("St. Paul", "MN", "Minneapolis-St. Paul"),
+        ("ST PAUL", "MN", "Minneapolis-St. Paul"),
+        ("Minneapolos", "MN", "Minneapolis-St. Paul"),
+        ("Ft Worth", "TX", "Dallas-Fort Worth"),
+        ("Huston", "TX", "Houston"),
+        ("Austin", "MN", "Austin MN"),
+        # Too short for a typo to be matched.
+        ("Elk", "MN", None),
+        ("Brian", "TX", "College Station-Bryan"),
+        # Equally close to cities in different metros.
+        ("Cayton", "TX", None),
+        # Only cities in the same state are considered.
+        ("Duluht", "WI", None),
+        ("Springfield", "MN", None),
+    ],
+)
+def test_fuzzy_city_metro(city: str, state: str, expected: str | None) -> None:
+    metros = FuzzyCityMetro(METROS)
+    assert metros.get((city, state)) == expected
+
+
+def test_fuzzy_city_metro_max_distance() -> None:
+    metros = FuzzyCityMetro(METROS, max_distance=0)
+    assert metros.get(("St. Paul", "MN")) == "Minneapolis-St. Paul"
+    assert metros.get(("Minneapolos", "MN")) is None
+
+
+def test_fuzzy_city_metro_memoizes_misses() -> None:
+    metros = FuzzyCityMetro(METROS)
+    for _ in range(3):
+        assert metros[("Huston", "TX")] == "Houston"
+        assert ("Springfeld", "MN") not in metros
+    assert metros.memo == {("Huston", "TX"): "Houston", ("Springfeld", "MN"): None}
+    assert metros.fuzzy_hits == 3
+    assert metros.searches == 2
+    assert metros[("Houston", "TX")] == "Houston"
+    assert metros.fuzzy_hits == 3
+
+
+def test_fuzzy_city_metro_memo_is_bounded() -> None:
+    metros = FuzzyCityMetro(METROS, memo_size=1)
+    assert metros[("Huston", "TX")] == "Houston"
+    assert ("Springfeld", "MN") not in metros
+    assert list(metros.memo) == [("Springfeld", "MN")]
+    assert metros[("Huston", "TX")] == "Houston"
+    assert metros.searches == 3
+
+
+def test_fuzzy_city_metro_rejects_conflicting_spellings(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    metros = FuzzyCityMetro(
+        {
+            ("St. Charles", "MO"): "St. Louis",
+            ("Saint Charles", "MO"): "Other",
+            ("Springfield", "MO"): "Springfield",
+        }
+    )
+    assert "'saint charles', MO" in caplog.text
+    # Exact spellings still match, but nothing else can pick one of the two.
+    assert metros[("St. Charles", "MO")] == "St. Louis"
+    assert ("ST CHARLES", "MO") not in metros
+    assert ("Saint Charels", "MO") not in metros
+    assert metros[("Sprngfield", "MO")] == "Springfield"
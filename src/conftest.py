@@ -0,0 +1,219 @@
+import csv
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from typing import Any, Iterator
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from cryptography.fernet import Fernet
+from requests.adapters import HTTPAdapter
+from simple_salesforce import Salesforce
+
+# The caches under .cache are encrypted with this key.
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+
+
+class FakeSalesforce:
+    """The parts of the Salesforce REST and Bulk 2.0 APIs that we use, backed by
+    in-memory state."""
+
+    def __init__(self) -> None:
+        self.contacts: list[dict[str, Any]] = []
+        self.page_size = 2000
+        self.queries: list[str] = []
+        self.updates: dict[str, dict[str, Any]] = {}
+        self.invalid_ids: set[str] = set()
+        self.requests: list[tuple[str, str]] = []
+        self.api_limit = 15_000
+        # Seconds that each request takes, to simulate round trips.
+        self.latency = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._results: list[list[dict[str, Any]]] = []
+        # How many of the next requests fail as if Salesforce were unavailable.
+        self.unavailable = 0
+        # How many results to leave off the end of each collection response.
+        self.dropped_results = 0
+        self._jobs: dict[str, dict[str, Any]] = {}
+
+    def handle(
+        self, method: str, path: str, query: dict[str, list[str]], body: bytes
+    ) -> tuple[int, str, str]:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            return self._handle(method, path, query, body)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _handle(
+        self, method: str, path: str, query: dict[str, list[str]], body: bytes
+    ) -> tuple[int, str, str]:
+        self.requests.append((method, path))
+        if self.unavailable:
+            self.unavailable -= 1
+            return 503, "application/json", json.dumps([{"message": "Unavailable"}])
+        path = re.sub(r"^/services/data/v[\d.]+/", "", path)
+        if method == "GET" and path == "query/":
+            self.queries.append(query["q"][0])
+            with self._lock:
+                self._results.append(self._select(query["q"][0]))
+                locator = len(self._results) - 1
+            return 200, "application/json", json.dumps(self._query_page(locator, 0))
+        if method == "GET" and (match := re.fullmatch(r"query/(\d+)-(\d+)", path)):
+            page = self._query_page(int(match[1]), int(match[2]))
+            return 200, "application/json", json.dumps(page)
+        if method == "PATCH" and path == "composite/sobjects":
+            return 200, "application/json", json.dumps(self._update_collection(body))
+        if match := re.fullmatch(r"jobs/ingest(?:/(\w+))?(?:/(\w+))?", path):
+            return self._bulk_ingest(method, match[1], match[2], body)
+        return 404, "application/json", json.dumps([{"message": path}])
+
+    def _select(self, soql: str) -> list[dict[str, Any]]:
+        """Apply the query's Id conditions, ordering and limit, ignoring any other
+        conditions."""
+        contacts = self.contacts
+        for operator, value in re.findall(r"\bId (>=|<) '(\w+)'", soql):
+            contacts = [c for c in contacts if (c["Id"] >= value) == (operator == ">=")]
+        if match := re.search(r"ORDER BY Id (ASC|DESC)", soql):
+            contacts = sorted(
+                contacts, key=lambda c: c["Id"], reverse=match[1] == "DESC"
+            )
+        if match := re.search(r"LIMIT (\d+)", soql):
+            contacts = contacts[: int(match[1])]
+        return contacts
+
+    def _query_page(self, locator: int, offset: int) -> dict[str, Any]:
+        results = self._results[locator]
+        end = offset + self.page_size
+        page: dict[str, Any] = {
+            "totalSize": len(results),
+            "done": end >= len(results),
+            "records": results[offset:end],
+        }
+        if not page["done"]:
+            page["nextRecordsUrl"] = f"/services/data/v59.0/query/{locator}-{end}"
+        return page
+
+    def _update(self, uid: str, changes: dict[str, Any]) -> str | None:
+        if uid in self.invalid_ids:
+            return f"Invalid record {uid}"
+        self.updates.setdefault(uid, {}).update(changes)
+        return None
+
+    def _update_collection(self, body: bytes) -> list[dict[str, Any]]:
+        results = []
+        for record in json.loads(body)["records"]:
+            uid = record.pop("id")
+            del record["attributes"]
+            error = self._update(uid, record)
+            results.append(
+                {
+                    "id": uid,
+                    "success": error is None,
+                    "errors": [{"message": error}] if error else [],
+                }
+            )
+        return results[: len(results) - self.dropped_results]
+
+    def _bulk_ingest(
+        self, method: str, job_id: str | None, resource: str | None, body: bytes
+    ) -> tuple[int, str, str]:
+        if method == "POST":
+            job_id = f"job{len(self._jobs)}"
+            self._jobs[job_id] = {"state": "Open", "failed": []}
+            return 200, "application/json", json.dumps({"id": job_id, "state": "Open"})
+        assert job_id is not None
+        job = self._jobs[job_id]
+        if method == "PUT":
+            rows = list(csv.DictReader(StringIO(body.decode())))
+            for row in rows:
+                uid = row.pop("Id")
+                changes = {
+                    k: None if v == "#N/A" else v for k, v in row.items() if v != ""
+                }
+                if error := self._update(uid, changes):
+                    job["failed"].append({"sf__Id": uid, "sf__Error": error, "Id": uid})
+            job["total"] = len(rows)
+            return 201, "application/json", ""
+        if method == "PATCH":
+            job["state"] = "JobComplete"
+            return 200, "application/json", json.dumps({"id": job_id})
+        if resource == "failedResults":
+            out = StringIO()
+            writer = csv.DictWriter(out, ["sf__Id", "sf__Error", "Id"])
+            writer.writeheader()
+            writer.writerows(job["failed"])
+            return 200, "text/csv", out.getvalue()
+        if resource == "unprocessedRecords":
+            return 200, "text/csv", "Id\n"
+        return (
+            200,
+            "application/json",
+            json.dumps(
+                {
+                    "id": job_id,
+                    "state": job["state"],
+                    "numberRecordsFailed": len(job["failed"]),
+                    "numberRecordsProcessed": job.get("total", 0),
+                }
+            ),
+        )
+
+
+class _PlainHttpAdapter(HTTPAdapter):
+    """simple-salesforce always builds https URLs, but the fake server is plain
+    HTTP."""
+
+    def send(self, request, *args, **kwargs):  # type: ignore[no-untyped-def]
+        request.url = request.url.replace("https://", "http://", 1)
+        return super().send(request, *args, **kwargs)
+
+
+@pytest.fixture
+def fake_salesforce() -> Iterator[FakeSalesforce]:
+    yield FakeSalesforce()
+
+
+@pytest.fixture
+def salesforce_client(fake_salesforce: FakeSalesforce) -> Iterator[Salesforce]:
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self) -> None:
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            status, content_type, payload = fake_salesforce.handle(
+                self.command, url.path, parse_qs(url.query), body
+            )
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header(
+                "Sforce-Limit-Info",
+                f"api-usage={len(fake_salesforce.requests)}/{fake_salesforce.api_limit}",
+            )
+            self.send_header("Content-Length", str(len(payload.encode())))
+            self.end_headers()
+            self.wfile.write(payload.encode())
+
+        do_GET = do_POST = do_PUT = do_PATCH = _respond
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    instance_url = f"https://127.0.0.1:{server.server_port}"
+    client = Salesforce(instance_url=instance_url, session_id="fake-session")
+    client.session.mount(instance_url, _PlainHttpAdapter())
+    yield client
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,180 @@
+"""A compact alternative to a list of `SalesforceEntry` models for large loads.
+
+Each field is stored in its own list, with repeated strings like countries and
+cities interned so that they share memory. Records skip pydantic validation, and
+`ContactRow` views give the enrichment logic attribute access to a single row.
+"""
+
+import sys
+from itertools import compress
+from typing import Any, Callable, Iterable, Iterator
+
+from country_codes import COUNTRY_CODES_TWO_LETTER_TO_THREE, COUNTRY_NAMES_TO_THREE
+from salesforce_entry import EnrichableContact, SalesforceEntry
+from state_codes import US_STATES_TO_CODES
+
+FIELD_ALIASES = {
+    name: info.alias or name for name, info in SalesforceEntry.model_fields.items()
+}
+FROZEN_FIELDS = frozenset(
+    name for name, info in SalesforceEntry.model_fields.items() if info.frozen
+)
+FLOAT_FIELDS = frozenset({"latitude", "longitude"})
+
+
+class ContactStore:
+    def __init__(self, columns: dict[str, list[Any]]) -> None:
+        self.columns = columns
+        # Like `SalesforceEntry._original_values`, but only for rows that changed.
+        self.original_values: dict[int, dict[str, Any]] = {}
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict[str, Any]]) -> "ContactStore":
+        """Build a store from Salesforce query results, keyed by field alias."""
+        columns: dict[str, list[Any]] = {name: [] for name in FIELD_ALIASES}
+        appends = [
+            (columns[name].append, alias, name in FLOAT_FIELDS)
+            for name, alias in FIELD_ALIASES.items()
+        ]
+        for record in records:
+            for append, alias, is_float in appends:
+                value = record[alias]
+                if value is not None:
+                    value = float(value) if is_float else sys.intern(value)
+                append(value)
+        return cls(columns)
+
+    def __len__(self) -> int:
+        return len(self.columns["uid"])
+
+    def __getitem__(self, index: int) -> "ContactRow":
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return ContactRow(self, index)
+
+    def __iter__(self) -> Iterator["ContactRow"]:
+        return (ContactRow(self, index) for index in range(len(self)))
+
+    def set_value(self, index: int, name: str, value: Any) -> None:
+        column = self.columns[name]
+        self.original_values.setdefault(index, {}).setdefault(name, column[index])
+        column[index] = value
+
+    def normalize(self) -> list[bool]:
+        """Normalize every row like `EnrichableContact.normalize`, a column at a time.
+
+        Each rule is computed once per distinct value in the column. Rather than
+        raising on invalid data, this returns a mask of the rows that failed, which
+        are left unchanged.
+        """
+        countries = _map_distinct(_normalize_country, self.columns["country"])
+        is_us = [country == "USA" for country in countries]
+        normalized = {
+            "country": countries,
+            "state": _map_distinct(_normalize_us_state, self.columns["state"], is_us),
+            "city": _map_distinct(_normalize_city, self.columns["city"]),
+            "zipcode": _map_distinct(
+                _normalize_us_zipcode, self.columns["zipcode"], is_us
+            ),
+        }
+        failed = [
+            any(value is _INVALID for value in row) for row in zip(*normalized.values())
+        ]
+        for name, values in normalized.items():
+            column = self.columns[name]
+            for index, value in enumerate(values):
+                if not failed[index] and value != column[index]:
+                    self.set_value(index, name, value)
+        return failed
+
+    def compute_changes(self, index: int) -> dict[str, Any]:
+        return {
+            FIELD_ALIASES[name]: value
+            for name, original in self.original_values.get(index, {}).items()
+            if (value := self.columns[name][index]) != original
+        }
+
+    def compute_original_values(self, index: int) -> dict[str, Any]:
+        return {
+            FIELD_ALIASES[name]: original
+            for name, original in self.original_values.get(index, {}).items()
+            if self.columns[name][index] != original
+        }
+
+
+_INVALID = object()
+
+
+def _map_distinct(
+    normalize: Callable[[Any], Any], values: list[Any], where: list[bool] | None = None
+) -> list[Any]:
+    """Apply `normalize` to the values where `where` is true, calling it only once
+    per distinct value."""
+    selected = values if where is None else compress(values, where)
+    results = {value: normalize(value) for value in set(selected)}
+    if where is None:
+        return [results[value] for value in values]
+    return [results[value] if w else value for value, w in zip(values, where)]
+
+
+def _normalize_country(country: str | None) -> Any:
+    if not country:
+        return country
+    if len(country) == 2:
+        return COUNTRY_CODES_TWO_LETTER_TO_THREE.get(country.upper(), _INVALID)
+    if len(country) > 3:
+        return COUNTRY_NAMES_TO_THREE.get(country, _INVALID)
+    return country
+
+
+def _normalize_us_state(state: str | None) -> Any:
+    if state and len(state) > 2:
+        return US_STATES_TO_CODES.get(state, _INVALID)
+    return state
+
+
+def _normalize_city(city: str | None) -> str | None:
+    return city.title() if city and city.isupper() else city
+
+
+def _normalize_us_zipcode(zipcode: str | None) -> Any:
+    if zipcode and len(zipcode) > 5:
+        return zipcode[:5] if zipcode[5] == "-" else _INVALID
+    return zipcode
+
+
+class _Column:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __get__(self, row: "ContactRow | None", owner: type | None = None) -> Any:
+        if row is None:
+            return self
+        return row.store.columns[self.name][row.index]
+
+    def __set__(self, row: "ContactRow", value: Any) -> None:
+        if self.name in FROZEN_FIELDS:
+            raise AttributeError(f"{self.name} cannot be changed")
+        row.store.set_value(row.index, self.name, value)
+
+
+class ContactRow(EnrichableContact):
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: ContactStore, index: int) -> None:
+        self.store = store
+        self.index = index
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in FIELD_ALIASES)
+        return f"ContactRow({fields})"
+
+    def compute_changes(self) -> dict[str, str]:
+        return self.store.compute_changes(self.index)
+
+    def compute_original_values(self) -> dict[str, Any]:
+        return self.store.compute_original_values(self.index)
+
+
+for _name in FIELD_ALIASES:
+    setattr(ContactRow, _name, _Column(_name))
@@ -0,0 +1,64 @@
+import pytest
+
+from contact_store import ContactStore
+from salesforce_entry import SalesforceEntry
+
+
+def make_store(*entries: SalesforceEntry) -> ContactStore:
+    return ContactStore.from_records(
+        entry.model_dump(by_alias=True) for entry in entries
+    )
+
+
+def test_rows_match_entries() -> None:
+    entries = [
+        SalesforceEntry.mock(country="US", state="Arizona", city="TEMPE"),
+        SalesforceEntry.mock(country="USA", zipcode="11370-2314"),
+        SalesforceEntry.mock(country="MEX", city="Tijuana", latitude=32.5),
+    ]
+    store = make_store(*entries)
+    assert len(store) == 3
+
+    for entry, row in zip(entries, store):
+        for contact in (entry, row):
+            contact.normalize()
+            contact.populate_metro_area(
+                {"11370": "New York"}, {("Tempe", "AZ"): "Phoenix"}
+            )
+        assert row.compute_changes() == entry.compute_changes()
+        assert row.compute_original_values() == entry.compute_original_values()
+        assert {
+            name: getattr(row, name) for name in SalesforceEntry.model_fields
+        } == entry.model_dump()
+
+    assert store[0].compute_changes() == {
+        "MailingCity": "Tempe",
+        "MailingCountry": "USA",
+        "MailingState": "AZ",
+        "Metro_Area__c": "Phoenix",
+    }
+    assert store[0].compute_original_values() == {
+        "MailingCity": "TEMPE",
+        "MailingCountry": "US",
+        "MailingState": "Arizona",
+        "Metro_Area__c": None,
+    }
+    assert store[2].compute_changes() == {}
+
+
+def test_rows_are_compact() -> None:
+    store = make_store(SalesforceEntry.mock(country="USA"))
+    row = store[0]
+    assert not hasattr(row, "__dict__")
+    with pytest.raises(AttributeError):
+        row.uid = "other"
+    with pytest.raises(IndexError):
+        store[1]
+
+
+def test_strings_are_interned() -> None:
+    store = ContactStore.from_records(
+        {**SalesforceEntry.mock().model_dump(by_alias=True), "MailingCity": city}
+        for city in ("".join(["Tem", "pe"]), "".join(["Te", "mpe"]))
+    )
+    assert store[0].city is store[1].city
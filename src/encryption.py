@@ -0,0 +1,64 @@
+import logging
+import os
+import sqlite3
+import tempfile
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
+"""Files that hold contact data or licensed data are encrypted with `ENCRYPTION_KEY`,
+so that the scheduled workflow can keep them in its cache, which GitHub shares with
+pull request workflows in public repos."""
+
+logger = logging.getLogger(__name__)
+
+
+@cache
+def cipher() -> "Fernet":
+    """Read `ENCRYPTION_KEY` on first use, so that runs that don't need encrypted
+    files neither need the key nor import `cryptography`."""
+    from cryptography.fernet import Fernet
+
+    return Fernet(os.environ.pop("ENCRYPTION_KEY"))
+
+
+def read(path: Path) -> bytes | None:
+    """Decrypt a file written by `write`, or return None if it doesn't exist or was
+    encrypted with another key."""
+    from cryptography.fernet import InvalidToken
+
+    if not path.exists():
+        return None
+    try:
+        return cipher().decrypt(path.read_bytes())
+    except InvalidToken:
+        logger.warning(f"Ignoring {path}, which was encrypted with another key")
+        return None
+
+
+def write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f"{path.name}.tmp")
+    partial.write_bytes(cipher().encrypt(data))
+    partial.replace(path)
+
+
+class EncryptedDatabase:
+    """A SQLite database stored encrypted at `path`, and decrypted into a temporary
+    file while open. Changes are only saved to `path` by `close`."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._directory = tempfile.TemporaryDirectory()
+        self._working_path = Path(self._directory.name) / path.name
+        if (data := read(path)) is not None:
+            self._working_path.write_bytes(data)
+        self.connection = sqlite3.connect(self._working_path)
+
+    def close(self) -> None:
+        self.connection.close()
+        write(self.path, self._working_path.read_bytes())
+        self._directory.cleanup()
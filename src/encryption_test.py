@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import pytest
+from cryptography.fernet import Fernet
+
+import encryption
+from encryption import EncryptedDatabase
+
+
+def test_database_round_trips_encrypted(tmp_path: Path) -> None:
+    path = tmp_path / "cache.encrypted.sqlite3"
+    database = EncryptedDatabase(path)
+    with database.connection:
+        database.connection.execute("CREATE TABLE contacts (email TEXT)")
+        database.connection.execute("INSERT INTO contacts VALUES ('a@example.org')")
+    database.close()
+    assert b"a@example.org" not in path.read_bytes()
+
+    database = EncryptedDatabase(path)
+    assert database.connection.execute("SELECT email FROM contacts").fetchall() == [
+        ("a@example.org",)
+    ]
+    database.close()
+
+
+def test_files_encrypted_with_another_key_are_ignored(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = tmp_path / "snapshot.encrypted.json"
+    encryption.write(path, b"{}")
+    assert encryption.read(path) == b"{}"
+
+    other = Fernet(Fernet.generate_key())
+    monkeypatch.setattr(encryption, "cipher", lambda: other)
+    assert encryption.read(path) is None
+    assert encryption.read(tmp_path / "missing") is None
@@ -0,0 +1,142 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import metro_csvs
+import uszipcode_db
+from contact_store import FIELD_ALIASES
+from encryption import EncryptedDatabase
+from mailchimp_coordinates import Coordinates
+from salesforce_entry import EnrichableContact
+
+"""Remember the state of each contact after it was last enriched, so that later
+runs can skip contacts that would come out the same.
+
+A contact's fingerprint hashes its Salesforce fields and, if it needs them, its
+Mailchimp coordinates. The store is cleared whenever the reference data or the
+selected stages change, since those can change the result for any contact.
+
+Fingerprints are looked up and saved in batches rather than held in memory, so
+that memory stays constant regardless of the number of contacts. The store is
+encrypted, since it lists contacts' Ids."""
+
+DEFAULT_PATH = Path(".cache/fingerprints.encrypted.sqlite3")
+
+# Bump this whenever the enrichment logic changes.
+LOGIC_VERSION = 3
+
+# Below SQLite's limit of 999 variables per query in older versions.
+DEFAULT_BATCH_SIZE = 500
+
+
+def reference_version(
+    stages: frozenset[str], *, fuzzy_city_max_distance: int = 0
+) -> str:
+    parts = [str(LOGIC_VERSION), ",".join(sorted(stages))]
+    if stages & {"coordinates", "zipcode"}:
+        parts.append(uszipcode_db.version())
+    if "metro" in stages:
+        parts.append(metro_csvs.version())
+        parts.append(f"fuzzy={fuzzy_city_max_distance}")
+    return "/".join(parts)
+
+
+def fingerprint(entry: EnrichableContact, coordinates: Coordinates | None) -> str:
+    values = [getattr(entry, name) for name in FIELD_ALIASES]
+    data = json.dumps([values, coordinates], separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+
+class FingerprintStore:
+    def __init__(
+        self,
+        reference_version: str,
+        path: Path = DEFAULT_PATH,
+        *,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        self.batch_size = batch_size
+        self.database = EncryptedDatabase(path)
+        self.connection = self.database.connection
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints "
+            "(uid TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        row = self.connection.execute(
+            "SELECT value FROM metadata WHERE key = 'reference_version'"
+        ).fetchone()
+        if row is None or row[0] != reference_version:
+            with self.connection:
+                self.connection.execute("DELETE FROM fingerprints")
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO metadata VALUES ('reference_version', ?)",
+                    (reference_version,),
+                )
+        self.skipped = 0
+        self._updates: dict[str, str] = {}
+        # Fingerprints of contacts whose changes have not been saved yet.
+        self._pending: dict[str, str] = {}
+
+    def unchanged(
+        self, contacts: Sequence[tuple[EnrichableContact, Coordinates | None]]
+    ) -> list[bool]:
+        """Whether each contact, with the coordinates it needs, is the same as when
+        it was last enriched."""
+        unchanged: list[bool] = []
+        for start in range(0, len(contacts), self.batch_size):
+            batch = contacts[start : start + self.batch_size]
+            uids = [entry.uid for entry, _ in batch]
+            stored = dict(
+                self.connection.execute(
+                    "SELECT uid, fingerprint FROM fingerprints "
+                    f"WHERE uid IN ({', '.join('?' * len(uids))})",
+                    uids,
+                )
+            )
+            unchanged.extend(
+                stored.get(entry.uid) == fingerprint(entry, coordinates)
+                for entry, coordinates in batch
+            )
+        self.skipped += sum(unchanged)
+        return unchanged
+
+    def add(
+        self,
+        entry: EnrichableContact,
+        coordinates: Coordinates | None,
+        *,
+        pending: bool = False,
+    ) -> None:
+        """Record an enriched contact. If `pending`, its changes still have to be
+        saved, and it is only recorded once passed to `confirm`."""
+        value = fingerprint(entry, coordinates)
+        if pending:
+            self._pending[entry.uid] = value
+        else:
+            self._update(entry.uid, value)
+
+    def confirm(self, uids: Iterable[str]) -> None:
+        for uid in uids:
+            if (value := self._pending.pop(uid, None)) is not None:
+                self._update(uid, value)
+
+    def close(self) -> None:
+        self._save()
+        self.database.close()
+
+    def _update(self, uid: str, value: str) -> None:
+        self._updates[uid] = value
+        if len(self._updates) >= self.batch_size:
+            self._save()
+
+    def _save(self) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?)",
+                self._updates.items(),
+            )
+        self._updates = {}
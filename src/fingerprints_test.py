@@ -0,0 +1,78 @@
+from pathlib import Path
+
+from fingerprints import FingerprintStore
+from mailchimp_coordinates import Coordinates
+from salesforce_entry import SalesforceEntry
+
+
+def test_unchanged(tmp_path: Path) -> None:
+    path = tmp_path / "fingerprints.sqlite3"
+    entry = SalesforceEntry.mock(country="USA", zipcode="11370")
+    store = FingerprintStore("v1", path)
+    assert store.unchanged([(entry, None)]) == [False]
+    store.add(entry, None)
+    store.close()
+
+    store = FingerprintStore("v1", path)
+    assert store.unchanged(
+        [
+            (entry, None),
+            (entry, Coordinates(1, 2)),
+            (SalesforceEntry.mock(country="USA"), None),
+        ]
+    ) == [True, False, False]
+    assert store.skipped == 1
+    store.close()
+
+
+def test_reference_version_change_clears_store(tmp_path: Path) -> None:
+    path = tmp_path / "fingerprints.sqlite3"
+    entry = SalesforceEntry.mock(country="USA", zipcode="11370")
+    store = FingerprintStore("v1", path)
+    store.add(entry, None)
+    store.close()
+
+    store = FingerprintStore("v2", path)
+    assert store.unchanged([(entry, None)]) == [False]
+    store.close()
+    assert FingerprintStore("v1", path).unchanged([(entry, None)]) == [False]
+
+
+def test_pending_until_confirmed(tmp_path: Path) -> None:
+    path = tmp_path / "fingerprints.sqlite3"
+    saved = SalesforceEntry(
+        **{**SalesforceEntry.mock().model_dump(by_alias=True), "Id": "saved"}
+    )
+    failed = SalesforceEntry(
+        **{**SalesforceEntry.mock().model_dump(by_alias=True), "Id": "failed"}
+    )
+    store = FingerprintStore("v1", path)
+    store.add(saved, None, pending=True)
+    store.add(failed, None, pending=True)
+    store.confirm(["saved"])
+    store.close()
+
+    store = FingerprintStore("v1", path)
+    assert store.unchanged([(saved, None), (failed, None)]) == [True, False]
+
+
+def test_saves_in_batches(tmp_path: Path) -> None:
+    path = tmp_path / "fingerprints.sqlite3"
+    entries = [
+        SalesforceEntry(
+            **{**SalesforceEntry.mock().model_dump(by_alias=True), "Id": str(uid)}
+        )
+        for uid in range(5)
+    ]
+    store = FingerprintStore("v1", path, batch_size=2)
+    for entry in entries:
+        store.add(entry, None)
+    # Saved to the database before closing, except for the last partial batch.
+    assert store.unchanged([(entry, None) for entry in entries]) == [
+        True,
+        True,
+        True,
+        True,
+        False,
+    ]
+    store.close()
@@ -0,0 +1,161 @@
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterable, NamedTuple
+
+from country_codes import COUNTRY_CODES_TWO_LETTER_TO_THREE
+from encryption import EncryptedDatabase
+from salesforce_entry import EnrichableContact
+
+"""Nominatim is rate limited to one call per second, so we persist its results
+between runs. Entries are keyed by the coordinates rounded to `precision` decimal
+places; 4 places is roughly 11 meters. Contacts' coordinates are personal data, so
+the cache is encrypted."""
+
+DEFAULT_PATH = Path(".cache/geocode.encrypted.sqlite3")
+DEFAULT_PRECISION = 4
+DEFAULT_TTL_DAYS = 180
+DEFAULT_MAX_ENTRIES = 100_000
+
+_COUNTRY_CODES_THREE_TO_TWO = {
+    three: two for two, three in COUNTRY_CODES_TWO_LETTER_TO_THREE.items()
+}
+
+
+class CachedLocation(NamedTuple):
+    """Mirrors the part of `geopy.Location` that `populate_via_coordinates` reads."""
+
+    raw: dict[str, Any]
+
+
+class GeocodeCache:
+    def __init__(
+        self,
+        reverse_geocode: Callable,
+        path: Path = DEFAULT_PATH,
+        *,
+        precision: int = DEFAULT_PRECISION,
+        ttl_days: float = DEFAULT_TTL_DAYS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.reverse_geocode = reverse_geocode
+        self.precision = precision
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.database = EncryptedDatabase(path)
+        self.connection = self.database.connection
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS locations (
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                address TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (latitude, longitude)
+            )"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS locations_accessed_at "
+            "ON locations (accessed_at)"
+        )
+        self._evict()
+
+    def __call__(self, query: str) -> Any:
+        key = self._key(query)
+        now = time.time()
+        row = self.connection.execute(
+            "SELECT address FROM locations "
+            "WHERE latitude = ? AND longitude = ? AND created_at > ?",
+            (*key, now - self.ttl_seconds),
+        ).fetchone()
+        if row is not None:
+            self.hits += 1
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE locations SET accessed_at = ? "
+                    "WHERE latitude = ? AND longitude = ?",
+                    (now, *key),
+                )
+            return CachedLocation({"address": json.loads(row[0])})
+
+        self.misses += 1
+        result = self.reverse_geocode(query)
+        if result is not None:
+            self._store([(key, result.raw["address"])], replace=True)
+        return result
+
+    def seed(self, entries: Iterable[EnrichableContact]) -> None:
+        """Record the address of every contact that already has coordinates and a
+        zip code, without overwriting prior geocoder results.
+
+        Seed with normalized contacts, since their addresses are copied into other
+        contacts at the same coordinates. Contacts whose country isn't an ISO code
+        are skipped, since `normalize` would reject it once copied.
+        """
+        known = [
+            (
+                self._round(entry.latitude, entry.longitude),
+                {
+                    "postcode": entry.zipcode,
+                    "country_code": country_code,
+                    "state": entry.state,
+                    "city": entry.city,
+                },
+            )
+            for entry in entries
+            if entry.latitude is not None
+            and entry.longitude is not None
+            and entry.zipcode
+            and (country_code := _country_code(entry.country))
+        ]
+        self._store(known, replace=False)
+
+    def close(self) -> None:
+        self._evict()
+        self.database.close()
+
+    def _key(self, query: str) -> tuple[float, float]:
+        latitude, longitude = (float(part) for part in query.split(","))
+        return self._round(latitude, longitude)
+
+    def _round(self, latitude: float, longitude: float) -> tuple[float, float]:
+        return round(latitude, self.precision), round(longitude, self.precision)
+
+    def _store(
+        self, items: list[tuple[tuple[float, float], dict[str, Any]]], *, replace: bool
+    ) -> None:
+        now = time.time()
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self.connection:
+            self.connection.executemany(
+                f"{verb} INTO locations VALUES (?, ?, ?, ?, ?)",
+                [(*key, json.dumps(address), now, now) for key, address in items],
+            )
+
+    def _evict(self) -> None:
+        """Drop expired entries, then the least recently used beyond `max_entries`."""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM locations WHERE created_at <= ?",
+                (time.time() - self.ttl_seconds,),
+            )
+            self.connection.execute(
+                "DELETE FROM locations WHERE rowid IN ("
+                "SELECT rowid FROM locations ORDER BY accessed_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+def _country_code(country: str | None) -> str | None:
+    """The two letter code that Nominatim would return for a country code."""
+    if not country:
+        return None
+    country = country.upper()
+    if country in COUNTRY_CODES_TWO_LETTER_TO_THREE:
+        return country.lower()
+    two = _COUNTRY_CODES_THREE_TO_TWO.get(country)
+    return two.lower() if two else None
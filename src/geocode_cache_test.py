@@ -0,0 +1,100 @@
+from pathlib import Path
+from unittest.mock import Mock
+
+from geocode_cache import GeocodeCache
+from mailchimp_coordinates import Coordinates
+from salesforce_entry import SalesforceEntry
+
+
+def make_reverse_geocode() -> Mock:
+    reverse_fn = Mock()
+    reverse_fn.return_value.raw = {"address": {"postcode": "11370", "city": "NYC"}}
+    return reverse_fn
+
+
+def test_repeat_lookups_hit_cache(tmp_path: Path) -> None:
+    reverse_fn = make_reverse_geocode()
+    cache = GeocodeCache(reverse_fn, tmp_path / "cache.sqlite3", precision=3)
+
+    first = cache("40.76512, -73.8912")
+    second = cache("40.76498, -73.8908")
+    assert first.raw["address"] == second.raw["address"]
+    assert reverse_fn.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+    reopened = GeocodeCache(reverse_fn, tmp_path / "cache.sqlite3", precision=3)
+    assert reopened("40.765, -73.891").raw["address"]["postcode"] == "11370"
+    assert reverse_fn.call_count == 1
+
+
+def test_expired_entries_are_refetched(tmp_path: Path) -> None:
+    reverse_fn = make_reverse_geocode()
+    cache = GeocodeCache(reverse_fn, tmp_path / "cache.sqlite3", ttl_days=0)
+    cache("1.1, 4.2")
+    cache("1.1, 4.2")
+    assert reverse_fn.call_count == 2
+
+
+def test_evicts_least_recently_used(tmp_path: Path) -> None:
+    reverse_fn = make_reverse_geocode()
+    cache = GeocodeCache(reverse_fn, tmp_path / "cache.sqlite3", max_entries=2)
+    for query in ("1, 1", "2, 2", "3, 3", "1, 1"):
+        cache(query)
+    cache.close()
+
+    reopened = GeocodeCache(reverse_fn, tmp_path / "cache.sqlite3", max_entries=2)
+    reopened("1, 1")
+    reopened("3, 3")
+    assert reverse_fn.call_count == 3
+    reopened("2, 2")
+    assert reverse_fn.call_count == 4
+
+
+def test_seed(tmp_path: Path) -> None:
+    reverse_fn = make_reverse_geocode()
+    cache = GeocodeCache(reverse_fn, tmp_path / "cache.sqlite3")
+    cache.seed(
+        [
+            SalesforceEntry.mock(
+                latitude=1.1,
+                longitude=4.2,
+                zipcode="85281",
+                city="Tempe",
+                state="AZ",
+                country="USA",
+            ),
+            SalesforceEntry.mock(latitude=5.0, longitude=5.0),
+        ]
+    )
+    assert cache("1.1, 4.2").raw["address"]["postcode"] == "85281"
+    cache("5.0, 5.0")
+    assert reverse_fn.call_count == 1
+
+
+def test_seeded_addresses_normalize(tmp_path: Path) -> None:
+    reverse_fn = make_reverse_geocode()
+    cache = GeocodeCache(reverse_fn, tmp_path / "cache.sqlite3")
+    cache.seed(
+        [
+            SalesforceEntry.mock(
+                latitude=1.0, longitude=1.0, zipcode="K1A 0A6", country="Canada"
+            ),
+            SalesforceEntry.mock(
+                latitude=2.0, longitude=2.0, zipcode="01000", country="MEX"
+            ),
+        ]
+    )
+
+    # Not an ISO code, so it isn't copied into other contacts.
+    entry = SalesforceEntry.mock()
+    entry.populate_via_coordinates(Coordinates(1.0, 1.0), cache)
+    entry.normalize()
+    assert reverse_fn.call_count == 1
+    assert entry.zipcode == "11370"
+
+    entry = SalesforceEntry.mock()
+    entry.populate_via_coordinates(Coordinates(2.0, 2.0), cache)
+    entry.normalize()
+    assert reverse_fn.call_count == 1
+    assert (entry.zipcode, entry.country) == ("01000", "MEX")
@@ -0,0 +1,72 @@
+import json
+from pathlib import Path
+from typing import Any, Iterable
+
+from salesforce_api import WriteResult
+
+"""An append-only log of the changes computed for each contact and whether they
+were saved, so that a run that dies partway through can be resumed.
+
+Each line is a JSON object: `{"uid": ..., "changes": {...}}` once a contact's
+changes are computed, then `{"uid": ..., "errors": [...]}` once they are written,
+with no errors on success. Contacts without changes aren't logged, so the journal
+grows with the changes rather than the org.
+
+Lines are flushed along with each batch of write results, since until a batch is
+sent there is nothing saved that the journal has to account for. A resumed run
+skips every contact in the journal and re-sends the changes that weren't saved.
+Other contacts are enriched again, which only repeats the changes that were never
+logged."""
+
+DEFAULT_PATH = Path(".cache/journal.jsonl")
+
+
+class Journal:
+    def __init__(self, path: Path = DEFAULT_PATH, *, resume: bool = False) -> None:
+        self.path = path
+        # Contacts whose changes the run being resumed computed.
+        self.changed: set[str] = set()
+        # Their changes that still have to be saved.
+        self.unsaved: dict[str, dict[str, Any]] = {}
+        partial_line = False
+        if resume and path.exists():
+            partial_line = self._read()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = path.open("a" if resume else "w", encoding="utf-8")
+        if partial_line:
+            self.file.write("\n")
+
+    def changed_contact(self, uid: str, changes: dict[str, Any]) -> None:
+        self._write({"uid": uid, "changes": changes})
+
+    def write_results(self, results: Iterable[WriteResult]) -> None:
+        for result in results:
+            self._write({"uid": result.uid, "errors": result.errors})
+        self.file.flush()
+
+    def close(self, *, complete: bool) -> None:
+        """Close the journal, deleting it if the run saved every change."""
+        self.file.close()
+        if complete:
+            self.path.unlink()
+
+    def _write(self, record: dict[str, Any]) -> None:
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def _read(self) -> bool:
+        """Read the journal, returning whether it ends with a partial line."""
+        line = ""
+        with self.path.open(encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may be partial if the run was killed mid-write.
+                    continue
+                uid = record["uid"]
+                if "changes" in record:
+                    self.changed.add(uid)
+                    self.unsaved[uid] = record["changes"]
+                elif not record["errors"]:
+                    self.unsaved.pop(uid, None)
+        return bool(line) and not line.endswith("\n")
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+from journal import Journal
+from salesforce_api import WriteResult
+
+
+def test_resume(tmp_path: Path) -> None:
+    path = tmp_path / "journal.jsonl"
+    run = Journal(path)
+    run.changed_contact("1", {"MailingCity": "Tempe"})
+    run.changed_contact("3", {"MailingCity": "Mesa"})
+    run.changed_contact("4", {"MailingState": "AZ"})
+    run.write_results(
+        [
+            WriteResult("1", {"MailingCity": "Tempe"}, []),
+            WriteResult("3", {"MailingCity": "Mesa"}, ["Invalid record 3"]),
+        ]
+    )
+    # Simulate being killed partway through a line.
+    run.file.write('{"uid": "5", "chan')
+    run.file.close()
+
+    resumed = Journal(path, resume=True)
+    assert resumed.changed == {"1", "3", "4"}
+    assert resumed.unsaved == {
+        "3": {"MailingCity": "Mesa"},
+        "4": {"MailingState": "AZ"},
+    }
+    resumed.write_results([WriteResult("4", {"MailingState": "AZ"}, [])])
+    resumed.close(complete=False)
+
+    resumed = Journal(path, resume=True)
+    assert resumed.unsaved == {"3": {"MailingCity": "Mesa"}}
+    resumed.close(complete=True)
+    assert not path.exists()
+
+
+def test_new_run_discards_journal(tmp_path: Path) -> None:
+    path = tmp_path / "journal.jsonl"
+    run = Journal(path)
+    run.changed_contact("1", {"MailingCity": "Tempe"})
+    run.close(complete=False)
+
+    run = Journal(path)
+    assert run.changed == set()
+    run.close(complete=False)
+    assert Journal(path, resume=True).changed == set()
+
+
+def test_flushes_with_write_results(tmp_path: Path) -> None:
+    path = tmp_path / "journal.jsonl"
+    run = Journal(path)
+    run.changed_contact("1", {"MailingCity": "Tempe"})
+    assert path.read_text() == ""
+    run.write_results([WriteResult("1", {"MailingCity": "Tempe"}, [])])
+    assert len(path.read_text().splitlines()) == 2
+    run.close(complete=False)
@@ -1,11 +1,50 @@
+import hashlib
+import json
 import logging
+import math
 import os
-from typing import Any, NamedTuple
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Protocol,
+)
 
-from mailchimp3 import MailChimp
+import encryption
+from backoff import with_backoff
 
+if TYPE_CHECKING:
+    from mailchimp3 import MailChimp
+
+logger = logging.getLogger(__name__)
 logging.getLogger("mailchimp3.client").setLevel(logging.CRITICAL)
 
+PAGE_SIZE = 1000
+DEFAULT_WORKERS = 4
+SNAPSHOT_PATH = Path(".cache/mailchimp-coordinates.encrypted.json")
+
+# Members deleted from the audience never show up as changed, so periodically
+# download the whole audience again.
+FULL_REFRESH_INTERVAL = timedelta(days=7)
+
+# Overlap consecutive fetches in case of clock skew with Mailchimp.
+LAST_CHANGED_OVERLAP = timedelta(minutes=10)
+
+MEMBER_FIELDS = (
+    "members.email_address,members.location.latitude,members.location.longitude"
+)
+
+# A page of members takes roughly as long to download as this many single-member
+# lookups, which decides when `CoordinatesLookup` switches to downloading pages.
+LOOKUPS_PER_PAGE = 5
+
 
 class Coordinates(NamedTuple):
     latitude: float
@@ -18,17 +57,285 @@ class Coordinates(NamedTuple):
         return cls(lat, long) if lat and long else None
 
 
-def get_coordinates_by_email() -> dict[str, Coordinates | None]:
+class CoordinatesSource(Protocol):
+    """Either a dict of every member's coordinates or a `CoordinatesLookup`.
+
+    Mailchimp matches emails regardless of case, so both are keyed by lowercase
+    emails.
+    """
+
+    def get(self, email: str) -> Coordinates | None: ...
+
+
+class CoordinatesSnapshot(NamedTuple):
+    """The coordinates from the last fetch, so that later fetches only need to
+    download members changed since then. Saved encrypted, since it maps emails to
+    locations."""
+
+    last_changed: datetime | None
+    last_full_refresh: datetime | None
+    coordinates: dict[str, Coordinates]
+
+    @classmethod
+    def read(cls, path: Path = SNAPSHOT_PATH) -> "CoordinatesSnapshot":
+        if (encrypted_data := encryption.read(path)) is None:
+            return cls(None, None, {})
+        data = json.loads(encrypted_data)
+        return cls(
+            datetime.fromisoformat(data["last_changed"]),
+            datetime.fromisoformat(data["last_full_refresh"]),
+            {
+                email.lower(): Coordinates(*coords)
+                for email, coords in data["coordinates"].items()
+            },
+        )
+
+    def since_last_changed(self, now: datetime) -> datetime | None:
+        """When to fetch changes from, or None if the whole audience is due."""
+        if (
+            self.last_changed is None
+            or self.last_full_refresh is None
+            or now - self.last_full_refresh >= FULL_REFRESH_INTERVAL
+        ):
+            return None
+        return self.last_changed - LAST_CHANGED_OVERLAP
+
+    def write(self, path: Path = SNAPSHOT_PATH) -> None:
+        assert self.last_changed and self.last_full_refresh
+        encryption.write(
+            path,
+            json.dumps(
+                {
+                    "last_changed": self.last_changed.isoformat(),
+                    "last_full_refresh": self.last_full_refresh.isoformat(),
+                    "coordinates": self.coordinates,
+                }
+            ).encode("utf-8"),
+        )
+
+
+def init_client() -> tuple["MailChimp", str]:
+    from mailchimp3 import MailChimp
+
     key = os.environ.pop("MAILCHIMP_KEY")
     list_id = os.environ.pop("MAILCHIMP_LIST_ID")
-    client = MailChimp(mc_api=key)
-    result = client.lists.members.all(
-        list_id=list_id,
-        fields="members.email_address,members.location.latitude,members.location.longitude",
-        get_all=True,
-    )["members"]
-    return {
-        entry["email_address"]: coords
-        for entry in result
-        if (coords := Coordinates.from_mailchimp(entry)) is not None
-    }
+    return MailChimp(mc_api=key), list_id
+
+
+def subscriber_hash(email: str) -> str:
+    return hashlib.md5(email.lower().encode("utf-8")).hexdigest()
+
+
+def iter_member_pages(
+    client: "MailChimp",
+    list_id: str,
+    *,
+    since_last_changed: datetime | None = None,
+    workers: int = DEFAULT_WORKERS,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Iterator[list[dict[str, Any]]]:
+    """Yield pages of audience members as they arrive.
+
+    The first page tells us the audience size, and then the remaining pages are
+    requested concurrently by offset. Pages can overlap or skip members that
+    change during the fetch, which the next incremental fetch picks up. Pages that
+    are rate limited or hit a server error are retried with exponential backoff.
+    """
+    params: dict[str, Any] = {"count": PAGE_SIZE}
+    if since_last_changed is not None:
+        params["since_last_changed"] = since_last_changed.isoformat()
+
+    def fetch(offset: int) -> dict[str, Any]:
+        return with_backoff(
+            lambda: client.lists.members.all(
+                list_id=list_id,
+                fields=f"{MEMBER_FIELDS},total_items",
+                offset=offset,
+                **params,
+            ),
+            service="Mailchimp",
+            retryable=_is_retryable,
+            sleep=sleep,
+        )
+
+    first_page = fetch(0)
+    yield first_page["members"]
+    offsets = range(PAGE_SIZE, first_page["total_items"], PAGE_SIZE)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in as_completed(executor.submit(fetch, o) for o in offsets):
+            yield future.result()["members"]
+
+
+def count_members(
+    client: "MailChimp", list_id: str, *, since_last_changed: datetime | None = None
+) -> int:
+    params: dict[str, Any] = {}
+    if since_last_changed is not None:
+        params["since_last_changed"] = since_last_changed.isoformat()
+    response = with_backoff(
+        lambda: client.lists.members.all(
+            list_id=list_id, fields="total_items", offset=0, count=1, **params
+        ),
+        service="Mailchimp",
+        retryable=_is_retryable,
+    )
+    return response["total_items"]
+
+
+def fetch_member_coordinates(
+    client: "MailChimp",
+    list_id: str,
+    emails: Iterable[str],
+    *,
+    workers: int = DEFAULT_WORKERS,
+    sleep: Callable[[float], None] = time.sleep,
+) -> dict[str, Coordinates | None]:
+    """Look up each email's member by subscriber hash, concurrently.
+
+    Emails that aren't in the audience map to None. Lookups that are rate limited
+    or hit a server error are retried with exponential backoff.
+    """
+    from mailchimp3.mailchimpclient import MailChimpError
+
+    def fetch(email: str) -> Coordinates | None:
+        try:
+            entry = with_backoff(
+                lambda: client.lists.members.get(
+                    list_id=list_id,
+                    subscriber_hash=subscriber_hash(email),
+                    fields="email_address,location.latitude,location.longitude",
+                ),
+                service="Mailchimp",
+                retryable=_is_retryable,
+                sleep=sleep,
+            )
+        except MailChimpError as e:
+            if _status_code(e) == 404:
+                return None
+            raise
+        return Coordinates.from_mailchimp(entry)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {email: executor.submit(fetch, email) for email in emails}
+        return {email: future.result() for email, future in futures.items()}
+
+
+def _status_code(error: Exception) -> int:
+    return error.args[0]["response"].status_code
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether the request was rate limited or hit a server error."""
+    from mailchimp3.mailchimpclient import MailChimpError
+
+    return isinstance(error, MailChimpError) and (
+        _status_code(error) == 429 or _status_code(error) >= 500
+    )
+
+
+def get_coordinates_by_email(
+    client: "MailChimp",
+    list_id: str,
+    *,
+    workers: int = DEFAULT_WORKERS,
+    snapshot_path: Path = SNAPSHOT_PATH,
+) -> dict[str, Coordinates]:
+    started = datetime.now(timezone.utc)
+    snapshot = CoordinatesSnapshot.read(snapshot_path)
+    since_last_changed = snapshot.since_last_changed(started)
+    full_refresh = since_last_changed is None
+    coordinates = {} if full_refresh else dict(snapshot.coordinates)
+
+    for members in iter_member_pages(
+        client, list_id, since_last_changed=since_last_changed, workers=workers
+    ):
+        for entry in members:
+            email = entry["email_address"].lower()
+            coords = Coordinates.from_mailchimp(entry)
+            if coords is None:
+                coordinates.pop(email, None)
+            else:
+                coordinates[email] = coords
+
+    CoordinatesSnapshot(
+        last_changed=started,
+        last_full_refresh=started if full_refresh else snapshot.last_full_refresh,
+        coordinates=coordinates,
+    ).write(snapshot_path)
+    return coordinates
+
+
+class CoordinatesLookup:
+    """Coordinates for only the contacts that need them.
+
+    `prefetch` looks up a batch of members by subscriber hash. With `auto`, once
+    the lookups would cost more than downloading the audience (or its changes
+    since the snapshot), this downloads it with `get_coordinates_by_email` instead.
+    """
+
+    def __init__(
+        self,
+        client: "MailChimp",
+        list_id: str,
+        *,
+        auto: bool = True,
+        workers: int = DEFAULT_WORKERS,
+        snapshot_path: Path = SNAPSHOT_PATH,
+    ) -> None:
+        self.client = client
+        self.list_id = list_id
+        self.workers = workers
+        self.snapshot_path = snapshot_path
+        self.fetched: dict[str, Coordinates | None] = {}
+        self.downloaded: dict[str, Coordinates] | None = None
+        self.lookup_budget: int | None = None
+        if auto:
+            since_last_changed = CoordinatesSnapshot.read(
+                snapshot_path
+            ).since_last_changed(datetime.now(timezone.utc))
+            members = count_members(
+                client, list_id, since_last_changed=since_last_changed
+            )
+            self.lookup_budget = LOOKUPS_PER_PAGE * max(
+                1, math.ceil(members / PAGE_SIZE)
+            )
+
+    @property
+    def lookups(self) -> int:
+        return len(self.fetched)
+
+    def prefetch(self, emails: Iterable[str]) -> None:
+        if self.downloaded is not None:
+            return
+        missing = {
+            email.lower() for email in emails if email.lower() not in self.fetched
+        }
+        if not missing:
+            return
+        if (
+            self.lookup_budget is not None
+            and self.lookups + len(missing) > self.lookup_budget
+        ):
+            logger.info(
+                f"Downloading Mailchimp audience after {self.lookups} member lookups"
+            )
+            self.downloaded = get_coordinates_by_email(
+                self.client,
+                self.list_id,
+                workers=self.workers,
+                snapshot_path=self.snapshot_path,
+            )
+            return
+        self.fetched.update(
+            fetch_member_coordinates(
+                self.client, self.list_id, missing, workers=self.workers
+            )
+        )
+
+    def get(self, email: str) -> Coordinates | None:
+        email = email.lower()
+        if self.downloaded is None and email not in self.fetched:
+            self.prefetch([email])
+        if self.downloaded is not None:
+            return self.downloaded.get(email)
+        return self.fetched[email]
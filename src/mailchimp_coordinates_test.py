@@ -0,0 +1,221 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+
+import mailchimp3
+import pytest
+from mailchimp3.mailchimpclient import MailChimpError
+
+import mailchimp_coordinates
+from mailchimp_coordinates import Coordinates, CoordinatesLookup, CoordinatesSnapshot
+
+
+def member(email: str, latitude: float, longitude: float) -> dict[str, Any]:
+    return {
+        "email_address": email,
+        "location": {"latitude": latitude, "longitude": longitude},
+    }
+
+
+class FakeMembers:
+    def __init__(self, members: list[dict[str, Any]]) -> None:
+        self.members = members
+        self.calls: list[dict[str, Any]] = []
+        self.lookups: list[str] = []
+        # Status codes to fail the next lookups with.
+        self.errors: list[int] = []
+
+    def get(self, list_id: str, subscriber_hash: str, **params: Any) -> dict[str, Any]:
+        self.lookups.append(subscriber_hash)
+        self._maybe_fail()
+        for entry in self.members:
+            if mailchimp_coordinates.subscriber_hash(entry["email_address"]) == (
+                subscriber_hash
+            ):
+                return entry
+        response = type("Response", (), {"status_code": 404})
+        raise MailChimpError({"response": response, "status": 404})
+
+    def all(self, list_id: str, **params: Any) -> dict[str, Any]:
+        self.calls.append(params)
+        self._maybe_fail()
+        offset, count = params["offset"], params["count"]
+        return {
+            "members": self.members[offset : offset + count],
+            "total_items": len(self.members),
+        }
+
+    def _maybe_fail(self) -> None:
+        if self.errors:
+            status = self.errors.pop(0)
+            response = type("Response", (), {"status_code": status})
+            raise MailChimpError({"response": response, "status": status})
+
+
+@pytest.fixture
+def members(monkeypatch: pytest.MonkeyPatch) -> FakeMembers:
+    fake = FakeMembers([member(f"{i}@example.org", i, i) for i in range(1, 26)])
+    client = type("Client", (), {"lists": type("Lists", (), {"members": fake})})
+    monkeypatch.setattr(mailchimp3, "MailChimp", lambda mc_api: client)
+    monkeypatch.setattr(mailchimp_coordinates, "PAGE_SIZE", 10)
+    monkeypatch.setenv("MAILCHIMP_KEY", "key")
+    monkeypatch.setenv("MAILCHIMP_LIST_ID", "list")
+    return fake
+
+
+@pytest.fixture
+def client(members: FakeMembers) -> Any:
+    return mailchimp_coordinates.init_client()[0]
+
+
+def test_fetches_pages_concurrently(
+    members: FakeMembers, client: Any, tmp_path: Path
+) -> None:
+    members.members.append(member("none@example.org", 0, 0))
+    result = mailchimp_coordinates.get_coordinates_by_email(
+        client, "list", snapshot_path=tmp_path / "snapshot.json"
+    )
+    assert result == {f"{i}@example.org": Coordinates(i, i) for i in range(1, 26)}
+    assert sorted(call["offset"] for call in members.calls) == [0, 10, 20]
+    assert all("since_last_changed" not in call for call in members.calls)
+
+
+def test_fetches_changes_since_snapshot(
+    members: FakeMembers, client: Any, tmp_path: Path
+) -> None:
+    snapshot_path = tmp_path / "snapshot.json"
+    last_changed = datetime.now(timezone.utc) - timedelta(days=1)
+    CoordinatesSnapshot(
+        last_changed=last_changed,
+        last_full_refresh=last_changed,
+        coordinates={
+            "old@example.org": Coordinates(5, 5),
+            "moved@example.org": Coordinates(6, 6),
+        },
+    ).write(snapshot_path)
+    members.members = [
+        member("moved@example.org", 7, 7),
+        member("new@example.org", 8, 8),
+    ]
+
+    result = mailchimp_coordinates.get_coordinates_by_email(
+        client, "list", snapshot_path=snapshot_path
+    )
+    assert result == {
+        "old@example.org": Coordinates(5, 5),
+        "moved@example.org": Coordinates(7, 7),
+        "new@example.org": Coordinates(8, 8),
+    }
+    (call,) = members.calls
+    assert datetime.fromisoformat(call["since_last_changed"]) < last_changed
+
+    snapshot = CoordinatesSnapshot.read(snapshot_path)
+    assert snapshot.coordinates == result
+    assert snapshot.last_changed > last_changed  # type: ignore[operator]
+    assert snapshot.last_full_refresh == last_changed
+
+
+def test_subscriber_hash() -> None:
+    assert (
+        mailchimp_coordinates.subscriber_hash("Urist.McVankab@freddiesjokes.com")
+        == "62eeb292278cc15f5817cb78f7790b08"
+    )
+
+
+def test_lookup_fetches_only_requested_members(
+    members: FakeMembers, client: Any, tmp_path: Path
+) -> None:
+    lookup = CoordinatesLookup(
+        client, "list", auto=False, snapshot_path=tmp_path / "snapshot.json"
+    )
+    lookup.prefetch(["3@example.org", "missing@example.org"])
+    assert lookup.get("3@example.org") == Coordinates(3, 3)
+    assert lookup.get("missing@example.org") is None
+    assert lookup.get("4@example.org") == Coordinates(4, 4)
+    assert len(members.lookups) == 3
+    assert members.calls == []
+
+
+def test_lookup_downloads_audience_when_cheaper(
+    members: FakeMembers,
+    client: Any,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(mailchimp_coordinates, "LOOKUPS_PER_PAGE", 1)
+    lookup = CoordinatesLookup(client, "list", snapshot_path=tmp_path / "snapshot.json")
+    # 25 members in pages of 10 cost as much as 3 lookups.
+    assert lookup.lookup_budget == 3
+
+    lookup.prefetch(["1@example.org", "2@example.org"])
+    assert len(members.lookups) == 2
+    lookup.prefetch(["3@example.org", "4@example.org"])
+    assert len(members.lookups) == 2
+    assert lookup.get("4@example.org") == Coordinates(4, 4)
+    assert lookup.get("5@example.org") == Coordinates(5, 5)
+    assert len(members.lookups) == 2
+
+
+def test_fetch_member_coordinates_retries(members: FakeMembers, client: Any) -> None:
+    members.errors = [429, 503]
+    delays: list[float] = []
+    coordinates = mailchimp_coordinates.fetch_member_coordinates(
+        client, "list", ["3@example.org"], sleep=delays.append
+    )
+    assert coordinates == {"3@example.org": Coordinates(3, 3)}
+    assert delays == [1, 2]
+
+    members.errors = [400]
+    with pytest.raises(MailChimpError):
+        mailchimp_coordinates.fetch_member_coordinates(
+            client, "list", ["3@example.org"], sleep=delays.append
+        )
+
+
+def test_member_pages_retry(members: FakeMembers, client: Any) -> None:
+    members.errors = [503, 429]
+    delays: list[float] = []
+    pages = list(
+        mailchimp_coordinates.iter_member_pages(client, "list", sleep=delays.append)
+    )
+    assert sum(len(page) for page in pages) == 25
+    assert delays == [1, 2]
+
+    members.errors = [400]
+    with pytest.raises(MailChimpError):
+        list(mailchimp_coordinates.iter_member_pages(client, "list"))
+
+
+def test_snapshot_defaults_are_not_shared(tmp_path: Path) -> None:
+    snapshot = CoordinatesSnapshot.read(tmp_path / "missing.json")
+    snapshot.coordinates["a@example.org"] = Coordinates(1, 1)
+    assert CoordinatesSnapshot.read(tmp_path / "missing.json").coordinates == {}
+
+
+def test_emails_match_regardless_of_case(
+    members: FakeMembers,
+    client: Any,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    members.members.append(member("Mixed@Example.org", 30, 30))
+    lookup = CoordinatesLookup(
+        client, "list", auto=False, snapshot_path=tmp_path / "snapshot.json"
+    )
+    assert lookup.get("mixed@EXAMPLE.org") == Coordinates(30, 30)
+    assert lookup.get("Mixed@Example.org") == Coordinates(30, 30)
+    assert len(members.lookups) == 1
+
+    # Downloading the audience gives the same result as looking members up.
+    coordinates = mailchimp_coordinates.get_coordinates_by_email(
+        client, "list", snapshot_path=tmp_path / "snapshot.json"
+    )
+    assert coordinates["mixed@example.org"] == Coordinates(30, 30)
+    assert CoordinatesSnapshot.read(tmp_path / "snapshot.json").coordinates[
+        "mixed@example.org"
+    ] == Coordinates(30, 30)
+    monkeypatch.setattr(mailchimp_coordinates, "LOOKUPS_PER_PAGE", 0)
+    downloading = CoordinatesLookup(
+        client, "list", snapshot_path=tmp_path / "snapshot.json"
+    )
+    assert downloading.get("MIXED@example.org") == Coordinates(30, 30)
@@ -1,72 +1,816 @@
+import cProfile
 import logging
-from argparse import ArgumentParser
-
-from geopy import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
-from uszipcode import SearchEngine
+import time
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterable, NamedTuple
 
+import city_matcher
+import encryption
+import fingerprints
+import geocode_cache
+import journal
+import mailchimp_coordinates
 import metro_csvs
+import pipeline
+import plan
+import query_planner
+import replay
 import salesforce_api
-from mailchimp_coordinates import get_coordinates_by_email
+import startup
+import uszipcode_db
+from city_matcher import FuzzyCityMetro
+from contact_store import ContactStore
+from offline_geocoder import DEFAULT_MAX_DISTANCE_KM, OfflineReverseGeocoder
+from run_report import RunReport
+from salesforce_entry import EnrichableContact
+from uszipcode_db import ZipcodeRow
+from zip_index import ZipIndex
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
+# How many Salesforce records to load ahead of enrichment. This bounds memory while
+# letting page requests overlap with the rest of the pipeline.
+PREFETCH_RECORDS = 10_000
+
+# Leave some of the daily API requests for the org's other integrations.
+DEFAULT_MAX_API_USAGE = 0.9
+
 
 def create_parser() -> ArgumentParser:
     parser = ArgumentParser()
     parser.add_argument(
         "--write", action="store_true", help="Write results to Salesforce"
     )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Load every contact rather than only those modified since the last run",
+    )
+    parser.add_argument(
+        "--full-sync-interval-days",
+        type=float,
+        default=7,
+        help=(
+            "Load every contact if the last full run is older than this, so that "
+            "updates to the reference data reach unmodified contacts"
+        ),
+    )
+    parser.add_argument(
+        "--sync-state",
+        type=Path,
+        default=salesforce_api.SYNC_STATE_PATH,
+        help="JSON file that records when the last successful run started",
+    )
+    parser.add_argument(
+        "--fingerprints",
+        type=Path,
+        default=fingerprints.DEFAULT_PATH,
+        help=(
+            "Encrypted SQLite file of each contact's state after its last "
+            "enrichment, used to skip unchanged contacts. --full enriches every "
+            "contact regardless"
+        ),
+    )
+    parser.add_argument(
+        "--plan",
+        type=Path,
+        help=(
+            "Save the computed changes and the values they replace to this JSON "
+            "lines file, gzipped if it ends with .gz, to review and then write with "
+            "apply_plan.py"
+        ),
+    )
+    parser.add_argument(
+        "--journal",
+        type=Path,
+        default=journal.DEFAULT_PATH,
+        help=(
+            "Append-only log of the changes computed and saved by a --write run, "
+            "kept until the run saves every change"
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Continue an interrupted --write run from its journal: save its unsaved "
+            "changes and skip the contacts whose changes it already computed"
+        ),
+    )
+    parser.add_argument(
+        "--max-api-usage",
+        type=float,
+        default=DEFAULT_MAX_API_USAGE,
+        help=(
+            "Stop writing once the org has used this fraction of its daily "
+            "Salesforce API requests. Continue later with --resume"
+        ),
+    )
+    parser.add_argument(
+        "--salesforce-workers",
+        type=int,
+        default=1,
+        help=(
+            "Split the contacts into Id ranges and load this many ranges "
+            "concurrently. Keep this at most 10, the size of the connection pool"
+        ),
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help=(
+            "Load all contacts into compact columns before enriching, rather than "
+            "streaming them as individually validated records"
+        ),
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=pipeline.STAGES,
+        default=list(pipeline.STAGES),
+        help=(
+            "Only run these enrichment steps, e.g. `--stages normalize metro`. "
+            "Data that only skipped steps need is never loaded"
+        ),
+    )
+    parser.add_argument(
+        "--mailchimp",
+        choices=["auto", "lookup", "download"],
+        default="auto",
+        help=(
+            "Look up only the Mailchimp members of contacts that need coordinates, "
+            "download the whole audience, or pick whichever needs fewer requests"
+        ),
+    )
+    parser.add_argument(
+        "--address-memo-size",
+        type=int,
+        default=pipeline.DEFAULT_ADDRESS_MEMO_SIZE,
+        help=(
+            "Enrich each distinct address once, remembering up to this many "
+            "addresses. 0 disables the memo."
+        ),
+    )
+    parser.add_argument(
+        "--fuzzy-city-max-distance",
+        type=int,
+        default=city_matcher.DEFAULT_MAX_DISTANCE,
+        help=(
+            "Match cities without a metro to a known city in the same state within "
+            "this many edits. 0 only matches differences in case, punctuation and "
+            "abbreviations like St. and Ft."
+        ),
+    )
+    parser.add_argument(
+        "--offline-geocoder-max-distance-km",
+        type=float,
+        default=DEFAULT_MAX_DISTANCE_KM,
+        help=(
+            "Fall back to Nominatim for coordinates farther than this from the "
+            "nearest US zip code centroid"
+        ),
+    )
+    parser.add_argument(
+        "--geocode-cache",
+        type=Path,
+        default=geocode_cache.DEFAULT_PATH,
+        help=(
+            "Encrypted SQLite file that persists reverse geocoding results between runs"
+        ),
+    )
+    parser.add_argument(
+        "--geocode-cache-precision",
+        type=int,
+        default=geocode_cache.DEFAULT_PRECISION,
+        help="Decimal places that coordinates are rounded to for cache lookups",
+    )
+    parser.add_argument(
+        "--geocode-cache-ttl-days",
+        type=float,
+        default=geocode_cache.DEFAULT_TTL_DAYS,
+        help="Re-geocode cached coordinates older than this many days",
+    )
+    parser.add_argument(
+        "--geocode-cache-max-entries",
+        type=int,
+        default=geocode_cache.DEFAULT_MAX_ENTRIES,
+        help="Evict the least recently used cache entries beyond this size",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        help="Write stage timings and counters as JSON to this file",
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        type=Path,
+        help="Write stage timings and counters in the Prometheus text format",
+    )
+    parser.add_argument(
+        "--record",
+        type=Path,
+        help=(
+            "Save what Salesforce, Mailchimp and Nominatim return to this directory, "
+            "for use with --replay"
+        ),
+    )
+    parser.add_argument(
+        "--replay",
+        type=Path,
+        help=(
+            "Replay a directory saved with --record instead of calling any "
+            "service. Writes are accepted but not sent anywhere"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        help="Profile the run with cProfile and save the stats to this file",
+    )
     return parser
 
 
+def log_write_results(
+    results: list[salesforce_api.WriteResult],
+    fingerprint_store: fingerprints.FingerprintStore | None = None,
+    run_journal: journal.Journal | None = None,
+) -> int:
+    """Log each write's outcome and return the number of failures."""
+    if run_journal:
+        run_journal.write_results(results)
+    if fingerprint_store:
+        fingerprint_store.confirm(result.uid for result in results if result.success)
+    for result in results:
+        if result.success:
+            logger.info(
+                f"Changes saved to Salesforce for {result.uid}: "
+                f"{sorted(result.changes.keys())}"
+            )
+        else:
+            logger.error(f"Failed to save changes for {result.uid}: {result.errors}")
+    return sum(not result.success for result in results)
+
+
+def advances_watermark(args: Namespace) -> bool:
+    """Whether the run's saved changes cover everything that the next incremental
+    run would skip.
+
+    Runs without `--write` save nothing, and runs with only some `--stages` leave
+    the other stages' changes unsaved. Replays don't reflect Salesforce's state.
+    """
+    return args.write and not args.replay and set(args.stages) == set(pipeline.STAGES)
+
+
 def main() -> None:
-    args = create_parser().parse_args()
+    parser = create_parser()
+    args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be combined")
+    if args.plan and args.write:
+        parser.error("--plan and --write cannot be combined")
+    if args.resume and not args.write:
+        parser.error("--resume requires --write")
+    if args.resume and (args.columnar or args.replay):
+        parser.error("--resume is not supported with --columnar or --replay")
 
-    salesforce_client = salesforce_api.init_client()
-    entries = salesforce_api.load_data(salesforce_client)
-    logger.info(f"Loaded {len(entries)} Salesforce records")
+    report = RunReport()
+    replayer = None
+    if args.replay:
+        try:
+            replayer = replay.Replayer(args.replay)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+        if "coordinates" in args.stages and "coordinates" not in replayer.stages:
+            parser.error(
+                f"{args.replay} was recorded without the coordinates stage, so it "
+                "can only be replayed with --stages that leave it out"
+            )
+    recorder = replay.Recorder(args.record, args.stages) if args.record else None
+    try:
+        with report.stage("total"):
+            if args.profile:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.runcall(run, args, report, recorder, replayer)
+                finally:
+                    profiler.dump_stats(args.profile)
+                    logger.info(f"Saved profile to {args.profile}")
+            else:
+                run(args, report, recorder, replayer)
+    except salesforce_api.ApiLimitReached as e:
+        logger.error(f"{e}. Rerun with --resume to save the remaining changes.")
+        raise SystemExit(1)
+    finally:
+        if recorder:
+            recorder.close()
+        report.write(json_path=args.report, prometheus_path=args.prometheus_textfile)
 
-    coordinates_by_email = get_coordinates_by_email()
-    logger.info(f"Loaded {len(coordinates_by_email)} coordinates from Mailchimp")
 
-    us_zip_to_metro = metro_csvs.read_us_zip_to_metro()
-    us_city_and_state_to_metro = metro_csvs.read_us_city_and_state_to_metro()
-    zipcode_search_engine = SearchEngine()
-    geocoder = Nominatim(
-        user_agent="parking_reform_network_data_enrichment", timeout=10
+def load_coordinates(
+    args: Namespace, report: RunReport, replayer: replay.Replayer | None
+) -> (
+    dict[str, mailchimp_coordinates.Coordinates]
+    | mailchimp_coordinates.CoordinatesLookup
+):
+    if replayer:
+        return replayer.coordinates()
+    client, list_id = mailchimp_coordinates.init_client()
+    client.request_hooks["response"].append(report.response_hook("mailchimp"))
+    if args.mailchimp == "download":
+        coordinates = mailchimp_coordinates.get_coordinates_by_email(client, list_id)
+        logger.info(f"Loaded {len(coordinates)} coordinates from Mailchimp")
+        return coordinates
+    return mailchimp_coordinates.CoordinatesLookup(
+        client, list_id, auto=args.mailchimp == "auto"
     )
-    reverse_geocode = RateLimiter(geocoder.reverse, min_delay_seconds=1.1)
 
-    changed_records = 0
-    for entry in entries:
-        original_model_dump = entry.model_dump(by_alias=True)
 
-        # The order of operations matters.
-        if entry.email:
-            entry.populate_via_coordinates(
-                coordinates_by_email.get(entry.email), reverse_geocode
+def connect_salesforce(
+    report: RunReport,
+    api_usage: salesforce_api.ApiUsage,
+    recorder: replay.Recorder | None,
+    replayer: replay.Replayer | None,
+) -> Any:
+    if replayer:
+        return replayer.salesforce()
+    client = salesforce_api.init_client()
+    client.session.hooks["response"].extend(
+        [report.response_hook("salesforce"), api_usage.response_hook]
+    )
+    return recorder.salesforce(client) if recorder else client
+
+
+def lazy_nominatim(report: RunReport) -> Callable:
+    """Import geopy and create the rate limited Nominatim client on first use, since
+    most runs never need it."""
+    reverse: Callable | None = None
+
+    def reverse_geocode(query: str) -> Any:
+        nonlocal reverse
+        if reverse is None:
+            from geopy import Nominatim
+            from geopy.extra.rate_limiter import RateLimiter
+
+            geocoder = Nominatim(
+                user_agent="parking_reform_network_data_enrichment", timeout=10
+            )
+            # Includes the time spent waiting on the rate limit.
+            reverse = report.timed(
+                "nominatim", RateLimiter(geocoder.reverse, min_delay_seconds=1.1)
+            )
+        return reverse(query)
+
+    return reverse_geocode
+
+
+class RunSetup(NamedTuple):
+    """Everything a run loads before it enriches the first contact."""
+
+    started: datetime
+    # A `time.perf_counter()` reading taken at the same time as `started`.
+    start_time: float
+    sync_state: salesforce_api.SyncState
+    reference_version: str
+    modified_since: datetime | None
+    api_usage: salesforce_api.ApiUsage
+    salesforce_client: Any
+    # Streamed as they load, or with `--columnar`, loaded into columns up front.
+    contacts: Iterable[EnrichableContact] | ContactStore
+    reference: pipeline.ReferenceData
+    us_city_and_state_to_metro: FuzzyCityMetro
+    reverse_geocode: OfflineReverseGeocoder | None
+    nominatim_cache: geocode_cache.GeocodeCache | None
+    lookup: mailchimp_coordinates.CoordinatesLookup | None
+
+
+class RunTotals(NamedTuple):
+    """What `stream` did with the contacts."""
+
+    records: int
+    changed: int
+    failed_writes: int
+    outcomes: Counter[str]
+    memo: pipeline.EnrichmentMemo | None
+    fingerprint_store: fingerprints.FingerprintStore | None
+
+
+def run(
+    args: Namespace,
+    report: RunReport,
+    recorder: replay.Recorder | None = None,
+    replayer: replay.Replayer | None = None,
+) -> None:
+    run_setup = setup(args, report, recorder, replayer)
+    totals = stream(args, run_setup, report, replayer)
+    finish(args, run_setup, totals, report)
+
+
+def setup(
+    args: Namespace,
+    report: RunReport,
+    recorder: replay.Recorder | None,
+    replayer: replay.Replayer | None,
+) -> RunSetup:
+    """Start loading the contacts, and load the reference data that enriches them."""
+    stages = frozenset(args.stages)
+    started = datetime.now(timezone.utc)
+    start_time = time.perf_counter()
+    sync_state = salesforce_api.SyncState.read(args.sync_state)
+    reference_version = fingerprints.reference_version(
+        stages, fuzzy_city_max_distance=args.fuzzy_city_max_distance
+    )
+    modified_since = (
+        None
+        if args.full
+        else sync_state.modified_since(
+            started, timedelta(days=args.full_sync_interval_days), reference_version
+        )
+    )
+
+    # Contacts that enrichment can't change only need reloading once the reference
+    # data changes. Replays load whatever was recorded.
+    where = None
+    if (
+        modified_since is None
+        and not args.full
+        and not replayer
+        and sync_state.reference_version == reference_version
+    ):
+        where = query_planner.eligibility_condition(stages)
+        logger.info("Loading Salesforce records that enrichment might change")
+    elif modified_since is None:
+        logger.info("Loading all Salesforce records")
+    else:
+        logger.info(
+            f"Loading Salesforce records modified since {modified_since.isoformat()}"
+        )
+    api_usage = salesforce_api.ApiUsage()
+    # Replays return every recorded contact for each query, so they can't be split.
+    salesforce_workers = 1 if replayer else args.salesforce_workers
+    contacts: Iterable[EnrichableContact] | ContactStore
+    # The loads below are independent, so they overlap rather than add up.
+    with report.stage("startup"), startup.Startup(report) as tasks:
+        metro_task = None
+        if "metro" in stages:
+            # Read the key here, so that the forked process inherits the cipher.
+            encryption.cipher()
+            metro_task = tasks.in_process("metro_csvs", metro_csvs.read_metros)
+        salesforce_task = tasks.in_thread(
+            "salesforce_connect",
+            connect_salesforce,
+            report,
+            api_usage,
+            recorder,
+            replayer,
+        )
+        zipcodes_task = None
+        if stages & {"coordinates", "zipcode"}:
+            zipcodes_task = tasks.in_thread(
+                "zipcodes", lambda: list(uszipcode_db.read_zipcodes())
+            )
+        coordinates_task = None
+        if "coordinates" in stages:
+            coordinates_task = tasks.in_thread(
+                "mailchimp", load_coordinates, args, report, replayer
+            )
+
+        salesforce_client = tasks.result(salesforce_task)
+        count_task = None
+        if where:
+            count_task = tasks.in_thread(
+                "salesforce_count",
+                lambda: (
+                    salesforce_api.count_contacts(salesforce_client),
+                    salesforce_api.count_contacts(salesforce_client, where=where),
+                ),
+            )
+        if args.columnar:
+            store_task = tasks.in_thread(
+                "salesforce_load",
+                lambda: salesforce_api.load_columnar(
+                    salesforce_client,
+                    modified_since=modified_since,
+                    where=where,
+                    workers=salesforce_workers,
+                ),
             )
-        entry.normalize()
-        entry.populate_via_zipcode(zipcode_search_engine)
-        entry.populate_metro_area(us_zip_to_metro, us_city_and_state_to_metro)
-
-        changes = entry.compute_changes(original_model_dump)
-        if not changes:
-            continue
-
-        changed_records += 1
-        changed_keys = sorted(changes.keys())
-        if args.write:
-            salesforce_api.write_change(salesforce_client, entry.uid, changes)
-            logger.info(f"Changes saved to Salesforce for {entry.uid}: {changed_keys}")
         else:
+            # Loading starts now and overlaps enrichment, so only the time spent
+            # waiting on it counts.
+            contacts = report.timed_iter(
+                "salesforce_load",
+                pipeline.prefetch(
+                    salesforce_api.load_data(
+                        salesforce_client,
+                        modified_since=modified_since,
+                        where=where,
+                        workers=salesforce_workers,
+                    ),
+                    maxsize=PREFETCH_RECORDS,
+                ),
+            )
+
+        zipcodes: list[ZipcodeRow] = (
+            tasks.result(zipcodes_task) if zipcodes_task else []
+        )
+        coordinates_by_email: mailchimp_coordinates.CoordinatesSource = (
+            tasks.result(coordinates_task) if coordinates_task else {}
+        )
+        us_zip_to_metro: dict[str, str] = {}
+        us_city_and_state_to_metro = FuzzyCityMetro({}, max_distance=0)
+        if metro_task:
+            us_zip_to_metro, city_and_state_to_metro = tasks.result(metro_task)
+            with report.stage("fuzzy_city_index"):
+                us_city_and_state_to_metro = FuzzyCityMetro(
+                    city_and_state_to_metro,
+                    max_distance=args.fuzzy_city_max_distance,
+                )
+        if args.columnar:
+            contacts = tasks.result(store_task)
+        if count_task:
+            all_contacts, eligible_contacts = tasks.result(count_task)
+            report.update(
+                {
+                    "contacts_total": all_contacts,
+                    "contacts_eligible": eligible_contacts,
+                }
+            )
             logger.info(
-                f"Changes computed (but not written) for {entry.uid}: {changed_keys}"
+                f"Loading {eligible_contacts} of {all_contacts} contacts "
+                f"({1 - eligible_contacts / max(all_contacts, 1):.1%} fewer)"
+            )
+
+    reverse_geocode = None
+    nominatim_cache = None
+    if "coordinates" in stages:
+        # Replays skip the geocode cache, since the recording already includes
+        # every query that reached it.
+        if replayer:
+            fallback = replayer.reverse_geocode()
+        else:
+            nominatim_cache = geocode_cache.GeocodeCache(
+                lazy_nominatim(report),
+                args.geocode_cache,
+                precision=args.geocode_cache_precision,
+                ttl_days=args.geocode_cache_ttl_days,
+                max_entries=args.geocode_cache_max_entries,
+            )
+            fallback = (
+                recorder.reverse_geocode(nominatim_cache)
+                if recorder
+                else nominatim_cache
             )
+        reverse_geocode = OfflineReverseGeocoder(
+            zipcodes,
+            fallback=fallback,
+            max_distance_km=args.offline_geocoder_max_distance_km,
+        )
+
+    reference = pipeline.ReferenceData(
+        coordinates_by_email=(
+            recorder.coordinates(coordinates_by_email)
+            if recorder
+            else coordinates_by_email
+        ),
+        reverse_geocode=reverse_geocode,
+        zip_index=ZipIndex.from_rows(zipcodes),
+        us_zip_to_metro=us_zip_to_metro,
+        us_city_and_state_to_metro=us_city_and_state_to_metro,
+        stages=stages,
+    )
+    return RunSetup(
+        started=started,
+        start_time=start_time,
+        sync_state=sync_state,
+        reference_version=reference_version,
+        modified_since=modified_since,
+        api_usage=api_usage,
+        salesforce_client=salesforce_client,
+        contacts=contacts,
+        reference=reference,
+        us_city_and_state_to_metro=us_city_and_state_to_metro,
+        reverse_geocode=reverse_geocode,
+        nominatim_cache=nominatim_cache,
+        lookup=(
+            coordinates_by_email
+            if isinstance(coordinates_by_email, mailchimp_coordinates.CoordinatesLookup)
+            else None
+        ),
+    )
+
+
+def stream(
+    args: Namespace,
+    run_setup: RunSetup,
+    report: RunReport,
+    replayer: replay.Replayer | None,
+) -> RunTotals:
+    """Enrich the contacts as they load, and write, plan or log their changes."""
+    reference = run_setup.reference
+    nominatim_cache = run_setup.nominatim_cache
+    # Replays leave the fingerprints alone, like the other caches.
+    fingerprint_store = None
+    if args.fingerprints and not replayer:
+        fingerprint_store = fingerprints.FingerprintStore(
+            run_setup.reference_version, args.fingerprints
+        )
+    # Skipping is pointless when the user asked to recompute every contact, but the
+    # fingerprints are still recorded.
+    skip_fingerprints = fingerprint_store if not args.full else None
+
+    writer = (
+        salesforce_api.ContactWriter(
+            run_setup.salesforce_client,
+            api_usage=run_setup.api_usage,
+            max_api_usage=args.max_api_usage,
+        )
+        if args.write
+        else None
+    )
+    total_records = 0
+    changed_records = 0
+    failed_writes = 0
+    outcomes: Counter[str] = Counter()
+    memo = (
+        pipeline.EnrichmentMemo(args.address_memo_size)
+        if args.address_memo_size > 0
+        else None
+    )
+    plan_writer = plan.PlanWriter(args.plan) if args.plan else None
+    # Replays have nothing to resume, since their writes aren't sent anywhere.
+    run_journal = None
+    # The files and caches are closed even if the run stops partway, so that they
+    # keep what was computed and the journal can be resumed.
+    completed = False
+    try:
+        if writer and not replayer:
+            run_journal = journal.Journal(args.journal, resume=args.resume)
+            if run_journal.unsaved:
+                logger.info(
+                    f"Saving {len(run_journal.unsaved)} changes from the interrupted run"
+                )
+                report.count("resumed_writes", len(run_journal.unsaved))
+            for uid, changes in run_journal.unsaved.items():
+                with report.stage("salesforce_write"):
+                    results = writer.add(uid, changes)
+                failed_writes += log_write_results(
+                    results, fingerprint_store, run_journal
+                )
+        if isinstance(run_setup.contacts, ContactStore):
+            store = run_setup.contacts
+            if run_setup.lookup:
+                run_setup.lookup.prefetch(pipeline.emails_needing_coordinates(store))
+            diffs = pipeline.compute_store_diffs(
+                store, reference, outcomes, skip_fingerprints
+            )
+        else:
+            entries = run_setup.contacts
+            if run_journal and run_journal.changed:
+                changed = run_journal.changed
+                report.count("records_resumed", len(changed))
+                entries = (entry for entry in entries if entry.uid not in changed)
+            if "coordinates" in reference.stages:
+                entries = pipeline.prefetch_coordinates(
+                    entries, reference, run_setup.lookup
+                )
+            if skip_fingerprints:
+                entries = pipeline.skip_unchanged(entries, reference, skip_fingerprints)
+            diffs = pipeline.compute_diffs(entries, reference, outcomes, memo)
+        if nominatim_cache:
+            diffs = pipeline.seed_geocode_cache(diffs, nominatim_cache)
+        for entry, changes in diffs:
+            if not total_records:
+                report.gauge(
+                    "seconds_to_first_record",
+                    time.perf_counter() - run_setup.start_time,
+                )
+            total_records += 1
+            if fingerprint_store and (not changes or writer):
+                # Changed contacts are only recorded once their changes are saved.
+                fingerprint_store.add(
+                    entry,
+                    pipeline.coordinates_for(entry, reference),
+                    pending=bool(changes),
+                )
+            if not changes:
+                continue
+
+            changed_records += 1
+            if run_journal:
+                run_journal.changed_contact(entry.uid, changes)
+            if writer:
+                with report.stage("salesforce_write"):
+                    results = writer.add(entry.uid, changes)
+                failed_writes += log_write_results(
+                    results, fingerprint_store, run_journal
+                )
+            elif plan_writer:
+                plan_writer.add(
+                    plan.PlannedChange(
+                        entry.uid, changes, entry.compute_original_values()
+                    )
+                )
+            else:
+                logger.info(
+                    f"Changes computed (but not written) for {entry.uid}: "
+                    f"{sorted(changes.keys())}"
+                )
+
+        if writer:
+            with report.stage("salesforce_write"):
+                results = writer.flush()
+            failed_writes += log_write_results(results, fingerprint_store, run_journal)
+        completed = True
+    finally:
+        if plan_writer:
+            plan_writer.close()
+        if run_journal:
+            # Keep the journal if any writes failed, so that --resume can retry them.
+            run_journal.close(complete=completed and not failed_writes)
+        if fingerprint_store:
+            fingerprint_store.close()
+        if nominatim_cache:
+            nominatim_cache.close()
+    if plan_writer:
+        logger.info(f"Saved {plan_writer.changes} changes to {args.plan}")
+    return RunTotals(
+        records=total_records,
+        changed=changed_records,
+        failed_writes=failed_writes,
+        outcomes=outcomes,
+        memo=memo,
+        fingerprint_store=fingerprint_store,
+    )
+
+
+def finish(
+    args: Namespace, run_setup: RunSetup, totals: RunTotals, report: RunReport
+) -> None:
+    """Report on the run, and advance the watermark if it saved every change."""
+    api_usage = run_setup.api_usage
+    if api_usage.limit:
+        report.gauge("salesforce_api_usage", api_usage.fraction)
+
+    report.update(
+        {
+            "records_loaded": totals.records,
+            "records_changed": totals.changed,
+            "failed_writes": totals.failed_writes,
+            **totals.outcomes,
+        }
+    )
+    logger.info(f"Total records loaded: {totals.records}")
+    logger.info(f"Total records changed: {totals.changed}")
+    memo = totals.memo
+    if memo and memo.hits + memo.misses:
+        report.count("address_memo_hits", memo.hits)
+        report.count("address_memo_misses", memo.misses)
+        report.gauge("address_memo_hit_ratio", memo.hit_ratio)
+        logger.info(
+            f"Address memo: {memo.hits} hits, {memo.misses} misses "
+            f"({memo.hit_ratio:.1%} hit ratio)"
+        )
+    us_city_and_state_to_metro = run_setup.us_city_and_state_to_metro
+    if us_city_and_state_to_metro.fuzzy_hits:
+        report.count("metro_fuzzy_city_hits", us_city_and_state_to_metro.fuzzy_hits)
+        logger.info(
+            f"Fuzzy city matches: {us_city_and_state_to_metro.fuzzy_hits}, "
+            f"from {us_city_and_state_to_metro.searches} searches"
+        )
+    if fingerprint_store := totals.fingerprint_store:
+        report.count("records_unchanged", fingerprint_store.skipped)
+        logger.info(f"Unchanged records skipped: {fingerprint_store.skipped}")
+    if reverse_geocode := run_setup.reverse_geocode:
+        report.count("offline_geocoder_hits", reverse_geocode.hits)
+        report.count("offline_geocoder_fallbacks", reverse_geocode.fallbacks)
+        logger.info(
+            f"Offline geocoder: {reverse_geocode.hits} hits, "
+            f"{reverse_geocode.fallbacks} fallbacks to Nominatim"
+        )
+    if nominatim_cache := run_setup.nominatim_cache:
+        report.count("geocode_cache_hits", nominatim_cache.hits)
+        report.count("geocode_cache_misses", nominatim_cache.misses)
+        logger.info(
+            f"Geocode cache: {nominatim_cache.hits} hits, "
+            f"{nominatim_cache.misses} misses"
+        )
+    if lookup := run_setup.lookup:
+        logger.info(f"Mailchimp: {lookup.lookups} member lookups")
+        report.count("mailchimp_lookups", lookup.lookups)
+    if totals.failed_writes:
+        logger.error(f"Failed to write {totals.failed_writes} records")
+        raise SystemExit(1)
 
-    logger.info(f"Total records changed: {changed_records}")
+    if advances_watermark(args):
+        run_setup.sync_state.advance(
+            run_setup.started,
+            full_sync=run_setup.modified_since is None,
+            reference_version=run_setup.reference_version,
+        ).write(args.sync_state)
 
 
 if __name__ == "__main__":
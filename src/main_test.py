@@ -0,0 +1,277 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+from argparse import Namespace
+from pathlib import Path
+from typing import Any
+
+import pytest
+from simple_salesforce import Salesforce
+
+import main
+import metro_csvs
+import pipeline
+import replay
+import salesforce_api
+import uszipcode_db
+from conftest import FakeSalesforce
+from mailchimp_coordinates import Coordinates
+from plan import read_plan
+from run_report import RunReport
+from salesforce_entry import SalesforceEntry
+from uszipcode_db import ZipcodeRow
+
+# Generous, since CI machines vary, but well below the ~0.5s that importing every
+# service client takes.
+STARTUP_BUDGET_SECONDS = 1.0
+
+HEAVY_MODULES = [
+    "cryptography",
+    "geopy",
+    "mailchimp3",
+    "simple_salesforce",
+    "sqlalchemy",
+    "uszipcode",
+]
+
+
+def test_startup_is_lazy() -> None:
+    script = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+main.create_parser().parse_args([])
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))
+"""
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key != "ENCRYPTION_KEY" and not key.startswith(("SALESFORCE_", "MAILCHIMP_"))
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=Path(__file__).parent,
+        env=env,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    elapsed, imported = json.loads(result.stdout.splitlines()[-1])
+    assert imported == []
+    assert elapsed < STARTUP_BUDGET_SECONDS
+
+
+def test_stages() -> None:
+    args = main.create_parser().parse_args(["--stages", "normalize", "metro"])
+    assert args.stages == ["normalize", "metro"]
+    assert main.create_parser().parse_args([]).stages == [
+        "coordinates",
+        "normalize",
+        "zipcode",
+        "metro",
+    ]
+
+
+def test_advances_watermark() -> None:
+    parser = main.create_parser()
+    assert main.advances_watermark(parser.parse_args(["--write"]))
+    assert not main.advances_watermark(parser.parse_args([]))
+    assert not main.advances_watermark(
+        parser.parse_args(["--write", "--stages", "normalize"])
+    )
+    assert not main.advances_watermark(
+        parser.parse_args(["--write", "--replay", "recording"])
+    )
+
+
+ZIPCODES = [
+    ZipcodeRow(
+        "11370", "NY", "East Elmhurst", 40.765, -73.893, None, None, None, None, 2.0
+    ),
+]
+CONTACTS: list[dict[str, Any]] = [
+    # Filled in from its zip code.
+    {"Id": "1", "email": "1@example.org", "zipcode": "11370", "country": "USA"},
+    {
+        "Id": "2",
+        "email": "2@example.org",
+        "city": "TEMPE",
+        "state": "Arizona",
+        "country": "US",
+    },
+    # Located by its Mailchimp coordinates.
+    {"Id": "3", "email": "Three@Example.org"},
+    # Already enriched.
+    {
+        "Id": "4",
+        "email": "4@example.org",
+        "city": "Tempe",
+        "state": "AZ",
+        "country": "USA",
+        "metro": "Phoenix",
+    },
+]
+MAILCHIMP = [("three@example.org", 40.77, -73.88)]
+
+
+def read_metros() -> tuple[dict[str, str], dict[tuple[str, str], str]]:
+    return {"11370": "New York"}, {("Tempe", "AZ"): "Phoenix"}
+
+
+@pytest.fixture
+def reference_data(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Small stand-ins for the zip code database and the encrypted metro CSVs."""
+    monkeypatch.setattr(uszipcode_db, "read_zipcodes", lambda: iter(ZIPCODES))
+    monkeypatch.setattr(uszipcode_db, "version", lambda: "test")
+    monkeypatch.setattr(metro_csvs, "read_metros", read_metros)
+    monkeypatch.setattr(metro_csvs, "version", lambda: "test")
+
+
+def salesforce_records() -> list[dict[str, Any]]:
+    return [
+        {
+            **SalesforceEntry.mock(
+                **{k: v for k, v in contact.items() if k != "Id"}
+            ).model_dump(by_alias=True),
+            "Id": contact["Id"],
+        }
+        for contact in CONTACTS
+    ]
+
+
+@pytest.fixture
+def recording(tmp_path: Path) -> Path:
+    """A recording of a run with every stage, in the format that `--record` saves."""
+    directory = tmp_path / "recording"
+    replay.Recorder(directory, pipeline.STAGES).close()
+    files: list[tuple[str, list[Any]]] = [
+        (replay.SALESFORCE_FILE, salesforce_records()),
+        (replay.MAILCHIMP_FILE, MAILCHIMP),
+        (replay.NOMINATIM_FILE, []),
+    ]
+    for name, lines in files:
+        with gzip.open(directory / name, "wt", encoding="utf-8") as file:
+            file.writelines(json.dumps(line) + "\n" for line in lines)
+    return directory
+
+
+def parse_args(tmp_path: Path, *args: str) -> Namespace:
+    return main.create_parser().parse_args(
+        [
+            *args,
+            "--sync-state",
+            str(tmp_path / "sync.json"),
+            "--fingerprints",
+            str(tmp_path / "fingerprints.sqlite3"),
+            "--journal",
+            str(tmp_path / "journal.jsonl"),
+            "--geocode-cache",
+            str(tmp_path / "geocode.sqlite3"),
+        ]
+    )
+
+
+@pytest.mark.usefixtures("reference_data")
+def test_replay_writes_every_stage(tmp_path: Path, recording: Path) -> None:
+    args = parse_args(tmp_path, "--write", "--replay", str(recording))
+    report = RunReport()
+    main.run(args, report, replayer=replay.Replayer(recording))
+    assert report.counters["records_loaded"] == 4
+    assert report.counters["records_changed"] == 3
+    assert report.counters["failed_writes"] == 0
+    assert report.counters["offline_geocoder_hits"] == 1
+    # Replays don't touch the watermark, journal or caches.
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["recording"]
+
+
+@pytest.mark.usefixtures("reference_data")
+@pytest.mark.parametrize("columnar", [False, True])
+def test_replay_plans_a_subset_of_stages(
+    tmp_path: Path, recording: Path, columnar: bool
+) -> None:
+    args = parse_args(
+        tmp_path,
+        "--replay",
+        str(recording),
+        "--plan",
+        str(tmp_path / "plan.jsonl"),
+        "--stages",
+        "normalize",
+        "metro",
+        *(["--columnar"] if columnar else []),
+    )
+    main.run(args, RunReport(), replayer=replay.Replayer(recording))
+    planned = {change.uid: change.changes for change in read_plan(args.plan)}
+    assert planned == {
+        "1": {"Metro_Area__c": "New York"},
+        "2": {
+            "MailingCity": "Tempe",
+            "MailingState": "AZ",
+            "MailingCountry": "USA",
+            "Metro_Area__c": "Phoenix",
+        },
+    }
+
+
+@pytest.mark.usefixtures("reference_data")
+def test_watermark_only_advances_when_every_stage_ran(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    salesforce_client: Salesforce,
+    fake_salesforce: FakeSalesforce,
+) -> None:
+    monkeypatch.setattr(salesforce_api, "init_client", lambda: salesforce_client)
+    coordinates = {email: Coordinates(lat, lon) for email, lat, lon in MAILCHIMP}
+    monkeypatch.setattr(main, "load_coordinates", lambda *args: coordinates)
+    fake_salesforce.contacts = salesforce_records()
+    args = parse_args(tmp_path, "--write", "--stages", "normalize", "metro")
+    main.run(args, RunReport())
+    assert not args.sync_state.exists()
+
+    args = parse_args(tmp_path, "--write")
+    main.run(args, RunReport())
+    assert salesforce_api.SyncState.read(args.sync_state).last_sync is not None
+    assert set(fake_salesforce.updates) == {"1", "2", "3"}
+
+
+def test_interrupted_run_resumes(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    salesforce_client: Salesforce,
+    fake_salesforce: FakeSalesforce,
+) -> None:
+    monkeypatch.setattr(salesforce_api, "init_client", lambda: salesforce_client)
+    fake_salesforce.contacts = [
+        {
+            **SalesforceEntry.mock(
+                email=f"{uid}@example.org", country=country
+            ).model_dump(by_alias=True),
+            "Id": uid,
+        }
+        for uid, country in [("1", "US"), ("2", "USA"), ("3", "US")]
+    ]
+    args = parse_args(tmp_path, "--write", "--stages", "normalize")
+
+    # The writes stop once loading the contacts uses up the API limit.
+    fake_salesforce.api_limit = 1
+    with pytest.raises(salesforce_api.ApiLimitReached):
+        main.run(args, RunReport())
+    assert fake_salesforce.updates == {}
+    assert args.journal.exists()
+
+    fake_salesforce.api_limit = 15_000
+    args.resume = True
+    report = RunReport()
+    main.run(args, report)
+    assert fake_salesforce.updates == {
+        "1": {"MailingCountry": "USA"},
+        "3": {"MailingCountry": "USA"},
+    }
+    assert report.counters["resumed_writes"] == 2
+    assert report.counters["records_resumed"] == 2
+    # The unchanged contact's fingerprint was saved before the first run stopped.
+    assert report.counters["records_unchanged"] == 1
+    assert not args.journal.exists()
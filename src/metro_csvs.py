@@ -1,20 +1,48 @@
 import csv
-import os
+import hashlib
+import json
+import zlib
 from io import StringIO
 from pathlib import Path
+from typing import Callable, Hashable, TypeVar
 
-from cryptography.fernet import Fernet
+import encryption
 
 """We encrypt the CSVs from https://ziptometro.com with a symmetric key to
 avoid violating their terms of service."""
 
-_KEY = os.environ.pop("ENCRYPTION_KEY")
-CIPHER = Fernet(_KEY)
+US_ZIP_TO_METRO_PATH = Path("data/us-zip-to-metro.encrypted.csv")
+US_CITY_TO_METRO_PATH = Path("data/us-city-to-metro.encrypted.csv")
+
+"""Parsing the CSVs is slow, so the first read of each CSV writes its parsed
+mapping to a compiled file named after the CSV's hash. The compiled file is still
+encrypted, and is rebuilt whenever the CSV changes."""
+COMPILED_DIR = Path(".cache/metro")
+
+K = TypeVar("K", bound=Hashable)
 
 
 def read_us_zip_to_metro() -> dict[str, str]:
-    encrypted_data = Path("data/us-zip-to-metro.encrypted.csv").read_bytes()
-    data = CIPHER.decrypt(encrypted_data).decode("utf-8")
+    return _read_compiled(US_ZIP_TO_METRO_PATH, _parse_us_zip_to_metro)
+
+
+def read_us_city_and_state_to_metro() -> dict[tuple[str, str], str]:
+    return _read_compiled(US_CITY_TO_METRO_PATH, _parse_us_city_and_state_to_metro)
+
+
+def read_metros() -> tuple[dict[str, str], dict[tuple[str, str], str]]:
+    return read_us_zip_to_metro(), read_us_city_and_state_to_metro()
+
+
+def version() -> str:
+    """A hash of both CSVs, which changes whenever either is updated."""
+    digest = hashlib.sha256()
+    for path in (US_ZIP_TO_METRO_PATH, US_CITY_TO_METRO_PATH):
+        digest.update(hashlib.sha256(path.read_bytes()).digest())
+    return digest.hexdigest()[:16]
+
+
+def _parse_us_zip_to_metro(data: str) -> dict[str, str]:
     return {
         row["Zip Code"]: row["Primary CBSA Name"]
         for row in csv.DictReader(StringIO(data))
@@ -22,10 +50,49 @@ def read_us_zip_to_metro() -> dict[str, str]:
     }
 
 
-def read_us_city_and_state_to_metro() -> dict[tuple[str, str], str]:
-    encrypted_data = Path("data/us-city-to-metro.encrypted.csv").read_bytes()
-    data = CIPHER.decrypt(encrypted_data).decode("utf-8")
+def _parse_us_city_and_state_to_metro(data: str) -> dict[tuple[str, str], str]:
     return {
         (row["city"], row["state"]): row["metro"]
         for row in csv.DictReader(StringIO(data))
     }
+
+
+def _read_compiled(source: Path, parse: Callable[[str], dict[K, str]]) -> dict[K, str]:
+    from cryptography.fernet import InvalidToken
+
+    encrypted_data = source.read_bytes()
+    digest = hashlib.sha256(encrypted_data).hexdigest()[:16]
+    compiled = COMPILED_DIR / f"{source.name}.{digest}.bin"
+    if compiled.exists():
+        try:
+            return _decode(encryption.cipher().decrypt(compiled.read_bytes()))
+        except (InvalidToken, ValueError, zlib.error):
+            pass
+
+    result = parse(encryption.cipher().decrypt(encrypted_data).decode("utf-8"))
+    for stale in COMPILED_DIR.glob(f"{source.name}.*.bin"):
+        stale.unlink()
+    encryption.write(compiled, _encode(result))
+    return result
+
+
+def _encode(mapping: dict[K, str]) -> bytes:
+    """Store keys in one array, and each value as an index into a table of the
+    distinct values, since many keys share the same metro."""
+    values = sorted(set(mapping.values()))
+    value_indexes = {value: i for i, value in enumerate(values)}
+    payload = {
+        "keys": list(mapping.keys()),
+        "values": values,
+        "value_indexes": [value_indexes[value] for value in mapping.values()],
+    }
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode(data: bytes) -> dict:
+    payload = json.loads(zlib.decompress(data))
+    values = payload["values"]
+    return {
+        tuple(key) if isinstance(key, list) else key: values[i]
+        for key, i in zip(payload["keys"], payload["value_indexes"])
+    }
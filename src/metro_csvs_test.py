@@ -0,0 +1,61 @@
+import os
+from pathlib import Path
+
+import pytest
+from cryptography.fernet import Fernet
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+
+import encryption  # noqa: E402
+import metro_csvs  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(metro_csvs, "COMPILED_DIR", tmp_path / "compiled")
+    zip_csv = tmp_path / "zip.encrypted.csv"
+    zip_csv.write_bytes(
+        encryption.cipher().encrypt(
+            b"Zip Code,Primary CBSA Name\n11370,New York\n11371,New York\n99999,\n"
+        )
+    )
+    monkeypatch.setattr(metro_csvs, "US_ZIP_TO_METRO_PATH", zip_csv)
+    city_csv = tmp_path / "city.encrypted.csv"
+    city_csv.write_bytes(
+        encryption.cipher().encrypt(
+            b"city,state,metro\nTempe,AZ,Phoenix\nMesa,AZ,Phoenix\n"
+        )
+    )
+    monkeypatch.setattr(metro_csvs, "US_CITY_TO_METRO_PATH", city_csv)
+    return tmp_path
+
+
+def test_compiled_cache_round_trips(
+    data_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    expected_zip = {"11370": "New York", "11371": "New York"}
+    expected_city = {("Tempe", "AZ"): "Phoenix", ("Mesa", "AZ"): "Phoenix"}
+    assert metro_csvs.read_us_zip_to_metro() == expected_zip
+    assert metro_csvs.read_us_city_and_state_to_metro() == expected_city
+    assert len(list((data_dir / "compiled").iterdir())) == 2
+
+    # Later reads use the compiled files rather than parsing the CSVs.
+    monkeypatch.setattr(metro_csvs, "_parse_us_zip_to_metro", None)
+    monkeypatch.setattr(metro_csvs, "_parse_us_city_and_state_to_metro", None)
+    assert metro_csvs.read_us_zip_to_metro() == expected_zip
+    assert metro_csvs.read_us_city_and_state_to_metro() == expected_city
+
+
+def test_compiled_cache_rebuilds_when_csv_changes(data_dir: Path) -> None:
+    metro_csvs.read_us_zip_to_metro()
+    metro_csvs.US_ZIP_TO_METRO_PATH.write_bytes(
+        encryption.cipher().encrypt(b"Zip Code,Primary CBSA Name\n85281,Phoenix\n")
+    )
+    assert metro_csvs.read_us_zip_to_metro() == {"85281": "Phoenix"}
+    assert len(list((data_dir / "compiled").iterdir())) == 1
+
+
+def test_compiled_cache_is_encrypted(data_dir: Path) -> None:
+    metro_csvs.read_us_zip_to_metro()
+    (compiled,) = (data_dir / "compiled").iterdir()
+    assert b"New York" not in compiled.read_bytes()
@@ -0,0 +1,179 @@
+import math
+from functools import cached_property
+from typing import Any, Callable, Iterable, NamedTuple, Sequence
+
+from geocode_cache import CachedLocation
+from mailchimp_coordinates import Coordinates
+from uszipcode_db import ZipcodeRow
+
+"""Reverse geocode US coordinates to the nearest zip code centroid, without any
+network calls. Points are indexed in a k-d tree over 3D unit vectors so that
+Euclidean nearest neighbors are also nearest by great-circle distance."""
+
+EARTH_RADIUS_KM = 6371.0
+DEFAULT_MAX_DISTANCE_KM = 10.0
+KM_PER_MILE = 1.609344
+
+Point = tuple[float, float, float]
+
+
+class _Node(NamedTuple):
+    point: int
+    axis: int
+    left: "_Node | None"
+    right: "_Node | None"
+
+
+def _to_unit_vector(latitude: float, longitude: float) -> Point:
+    lat, lng = math.radians(latitude), math.radians(longitude)
+    return (
+        math.cos(lat) * math.cos(lng),
+        math.cos(lat) * math.sin(lng),
+        math.sin(lat),
+    )
+
+
+def _squared_distance(a: Point, b: Point) -> float:
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+def _chord_to_km(squared_chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(squared_chord) / 2))
+
+
+class KDTree:
+    def __init__(self, points: list[Point]) -> None:
+        self.points = points
+        self.root = self._build(list(range(len(points))), depth=0)
+
+    def _build(self, indices: list[int], depth: int) -> _Node | None:
+        if not indices:
+            return None
+        axis = depth % 3
+        indices.sort(key=lambda i: self.points[i][axis])
+        median = len(indices) // 2
+        return _Node(
+            indices[median],
+            axis,
+            self._build(indices[:median], depth + 1),
+            self._build(indices[median + 1 :], depth + 1),
+        )
+
+    def nearest(self, target: Point) -> tuple[int, float]:
+        """Return the index of the closest point and its squared distance."""
+        best_index, best_distance = -1, math.inf
+        # Each node is stacked with the squared distance to the splitting plane that
+        # separates it from the target, so that it is skipped if an even closer
+        # point turns up before it is popped.
+        stack: list[tuple[_Node | None, float]] = [(self.root, 0.0)]
+        while stack:
+            node, plane_distance = stack.pop()
+            if node is None or plane_distance >= best_distance:
+                continue
+            point = self.points[node.point]
+            distance = _squared_distance(point, target)
+            if distance < best_distance:
+                best_index, best_distance = node.point, distance
+            diff = target[node.axis] - point[node.axis]
+            near, far = (node.left, node.right) if diff < 0 else (node.right, node.left)
+            stack.append((far, diff * diff))
+            stack.append((near, 0.0))
+        return best_index, best_distance
+
+
+class OfflineReverseGeocoder:
+    """A drop-in for `geopy`'s reverse geocoder that answers from zip code centroids
+    and calls `fallback` for points farther than `max_distance_km` from any US zip
+    code or outside its bounds, such as points outside the US.
+
+    Zip codes without bounds only match points within their radius, so that points
+    across a border aren't assigned to them."""
+
+    def __init__(
+        self,
+        zipcodes: Iterable[ZipcodeRow],
+        fallback: Callable,
+        *,
+        max_distance_km: float = DEFAULT_MAX_DISTANCE_KM,
+    ) -> None:
+        self.zipcodes = [
+            row
+            for row in zipcodes
+            if row.latitude is not None and row.longitude is not None
+        ]
+        self.fallback = fallback
+        self.max_distance_km = max_distance_km
+        self.hits = 0
+        self.fallbacks = 0
+        # The addresses of the coordinates passed to the last `prefetch`.
+        self.prefetched: dict[Coordinates, dict[str, Any] | None] = {}
+
+    @cached_property
+    def tree(self) -> KDTree:
+        # Built on first use, since many runs have no contacts to geocode.
+        return KDTree(
+            [_to_unit_vector(row.latitude, row.longitude) for row in self.zipcodes]  # type: ignore[arg-type]
+        )
+
+    def __call__(self, query: str) -> Any:
+        latitude, longitude = (float(part) for part in query.split(","))
+        coordinates = Coordinates(latitude, longitude)
+        if coordinates in self.prefetched:
+            address = self.prefetched[coordinates]
+        else:
+            address = self.lookup(coordinates)
+        if address is not None:
+            self.hits += 1
+            return CachedLocation({"address": address})
+        self.fallbacks += 1
+        return self.fallback(query)
+
+    def prefetch(self, coordinates: Sequence[Coordinates]) -> None:
+        """Look up a batch of coordinates at once, for the calls that follow."""
+        self.prefetched = dict(zip(coordinates, self.lookup_many(coordinates)))
+
+    def lookup(self, coordinates: Coordinates) -> dict[str, Any] | None:
+        """Return a Nominatim-style address for the nearest zip code, if close enough."""
+        return self.lookup_many([coordinates])[0]
+
+    def lookup_many(
+        self, coordinates: Sequence[Coordinates]
+    ) -> list[dict[str, Any] | None]:
+        """Like `lookup` for each coordinates, searching the tree once for each
+        distinct coordinates. Mailchimp estimates members' locations from their IP
+        addresses, so many members share the same coordinates."""
+        if not self.zipcodes:
+            return [None] * len(coordinates)
+        addresses = {c: self._lookup(c) for c in set(coordinates)}
+        return [addresses[c] for c in coordinates]
+
+    def _lookup(self, coordinates: Coordinates) -> dict[str, Any] | None:
+        index, squared_chord = self.tree.nearest(
+            _to_unit_vector(coordinates.latitude, coordinates.longitude)
+        )
+        row = self.zipcodes[index]
+        distance_km = _chord_to_km(squared_chord)
+        if distance_km > self.max_distance_km or not _within_bounds(
+            row, coordinates, distance_km
+        ):
+            return None
+        return {
+            "postcode": row.zipcode,
+            "country_code": "us",
+            "state": row.state,
+            "city": row.major_city,
+        }
+
+
+def _within_bounds(
+    row: ZipcodeRow, coordinates: Coordinates, distance_km: float
+) -> bool:
+    if None in (row.bounds_west, row.bounds_east, row.bounds_north, row.bounds_south):
+        return (
+            row.radius_in_miles is not None
+            and distance_km <= row.radius_in_miles * KM_PER_MILE
+        )
+    return (
+        row.bounds_south <= coordinates.latitude <= row.bounds_north  # type: ignore[operator]
+        and row.bounds_west <= coordinates.longitude <= row.bounds_east  # type: ignore[operator]
+    )
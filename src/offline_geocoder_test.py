@@ -0,0 +1,123 @@
+import random
+from unittest.mock import Mock
+
+import pytest
+
+from mailchimp_coordinates import Coordinates
+from offline_geocoder import KDTree, OfflineReverseGeocoder, Point, _squared_distance
+from uszipcode_db import ZipcodeRow
+
+
+def make_row(
+    zipcode: str,
+    latitude: float,
+    longitude: float,
+    bounds: bool = False,
+    radius_in_miles: float | None = 2.0,
+) -> ZipcodeRow:
+    row = ZipcodeRow(
+        zipcode, "NY", f"City {zipcode}", latitude, longitude, None, None, None, None
+    )
+    if bounds:
+        row = row._replace(
+            bounds_west=longitude - 0.01,
+            bounds_east=longitude + 0.01,
+            bounds_north=latitude + 0.01,
+            bounds_south=latitude - 0.01,
+        )
+    return row._replace(radius_in_miles=radius_in_miles)
+
+
+def test_kd_tree_matches_brute_force() -> None:
+    rng = random.Random(0)
+    points = [(rng.random(), rng.random(), rng.random()) for _ in range(500)]
+    tree = KDTree(points)
+    for _ in range(100):
+        target = (rng.random(), rng.random(), rng.random())
+        expected = min(
+            range(len(points)), key=lambda i: _squared_distance(points[i], target)
+        )
+        assert tree.nearest(target)[0] == expected
+
+
+def test_reverse_geocodes_nearest_zipcode() -> None:
+    fallback = Mock()
+    geocoder = OfflineReverseGeocoder(
+        [
+            make_row("11370", 40.765, -73.893),
+            make_row("85281", 33.427, -111.932),
+            make_row("99999", None, None),  # type: ignore[arg-type]
+        ],
+        fallback,
+    )
+    location = geocoder("40.77, -73.88")
+    assert location.raw["address"] == {
+        "postcode": "11370",
+        "country_code": "us",
+        "state": "NY",
+        "city": "City 11370",
+    }
+    assert geocoder.lookup(Coordinates(33.43, -111.93)) == {
+        "postcode": "85281",
+        "country_code": "us",
+        "state": "NY",
+        "city": "City 85281",
+    }
+    assert geocoder.lookup(Coordinates(51.5, -0.12)) is None
+    fallback.assert_not_called()
+    assert geocoder.hits == 1
+
+
+def test_falls_back_beyond_distance_or_bounds() -> None:
+    fallback = Mock()
+    geocoder = OfflineReverseGeocoder(
+        [make_row("11370", 40.765, -73.893, bounds=True)], fallback, max_distance_km=5
+    )
+    geocoder("41.5, -73.893")
+    geocoder("40.765, -73.85")
+    assert fallback.call_count == 2
+    assert geocoder.fallbacks == 2
+    assert geocoder("40.766, -73.892").raw["address"]["postcode"] == "11370"
+
+
+def test_zipcodes_without_bounds_only_match_within_radius() -> None:
+    fallback = Mock()
+    # Blaine, WA, on the Canadian border.
+    geocoder = OfflineReverseGeocoder(
+        [
+            make_row("98230", 48.98, -122.75, radius_in_miles=2),
+            make_row("99999", 40.0, -100.0, radius_in_miles=None),
+        ],
+        fallback,
+    )
+    # Surrey, BC is within 10 km of the centroid, but outside its radius.
+    assert geocoder.lookup(Coordinates(49.04, -122.75)) is None
+    assert geocoder.lookup(Coordinates(48.99, -122.75)) is not None
+    # Without bounds or a radius, nothing but the centroid is known.
+    assert geocoder.lookup(Coordinates(40.001, -100.0)) is None
+
+
+def test_prefetch_searches_each_distinct_coordinates_once(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    geocoder = OfflineReverseGeocoder([make_row("11370", 40.765, -73.893)], Mock())
+    searches: list[Point] = []
+    nearest = geocoder.tree.nearest
+
+    def counting_nearest(target: Point) -> tuple[int, float]:
+        searches.append(target)
+        return nearest(target)
+
+    monkeypatch.setattr(geocoder.tree, "nearest", counting_nearest)
+    near, far = Coordinates(40.77, -73.88), Coordinates(51.5, -0.12)
+    assert geocoder.lookup_many([near, far, near]) == [
+        geocoder.lookup(near),
+        None,
+        geocoder.lookup(near),
+    ]
+    searches.clear()
+
+    geocoder.prefetch([near, far, near])
+    assert len(searches) == 2
+    assert geocoder("40.77, -73.88").raw["address"]["postcode"] == "11370"
+    assert len(searches) == 2
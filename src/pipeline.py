@@ -0,0 +1,379 @@
+import logging
+import queue
+import threading
+from collections import Counter, OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    TypeVar,
+)
+
+from contact_store import ContactStore
+from fingerprints import FingerprintStore
+from geocode_cache import GeocodeCache
+from mailchimp_coordinates import Coordinates, CoordinatesLookup, CoordinatesSource
+from offline_geocoder import OfflineReverseGeocoder
+from salesforce_entry import EnrichableContact
+from zip_index import ZipIndex
+
+"""Contacts stream through a chain of generators so that memory stays constant
+regardless of the number of contacts, and so that enrichment starts while
+Salesforce is still returning pages."""
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# The enrichment steps that `ReferenceData.stages` can select, in the order they run.
+STAGES = ("coordinates", "normalize", "zipcode", "metro")
+
+
+class ReferenceData(NamedTuple):
+    coordinates_by_email: CoordinatesSource
+    # Only None when the "coordinates" stage is skipped.
+    reverse_geocode: Callable | None
+    zip_index: ZipIndex
+    us_zip_to_metro: dict[str, str]
+    us_city_and_state_to_metro: Mapping[tuple[str, str], str]
+    stages: frozenset[str] = frozenset(STAGES)
+
+
+# How many distinct addresses an `EnrichmentMemo` keeps by default.
+DEFAULT_ADDRESS_MEMO_SIZE = 100_000
+
+# The fields that normalization and the reference data lookups depend on.
+AddressKey = tuple[str | None, str | None, str | None, str | None]
+
+
+class EnrichedAddress(NamedTuple):
+    country: str | None
+    state: str | None
+    city: str | None
+    zipcode: str | None
+    # None if no metro area was found, which leaves the contact's metro alone.
+    metro: str | None
+    outcomes: Counter[str]
+
+
+class EnrichmentMemo:
+    """The enriched address of each distinct input address, so that contacts sharing
+    an address are only normalized and looked up once.
+
+    Only the `max_entries` most recently used addresses are kept.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.addresses: OrderedDict[AddressKey, EnrichedAddress] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: AddressKey) -> EnrichedAddress | None:
+        address = self.addresses.get(key)
+        if address is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.addresses.move_to_end(key)
+        return address
+
+    def put(self, key: AddressKey, address: EnrichedAddress) -> None:
+        self.addresses[key] = address
+        if len(self.addresses) > self.max_entries:
+            self.addresses.popitem(last=False)
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+
+class _Failure(NamedTuple):
+    error: BaseException
+
+
+_DONE = object()
+
+
+def prefetch(items: Iterable[T], maxsize: int) -> Generator[T, None, None]:
+    """Consume `items` on a background thread, buffering at most `maxsize` ahead.
+
+    The thread starts right away rather than on the first `next`, so that `items`
+    loads while the caller prepares everything else. Exceptions raised by `items`
+    are re-raised to the consumer.
+    """
+    buffer: queue.Queue[Any] = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def produce() -> None:
+        try:
+            for item in items:
+                buffer.put(item)
+                if stopped.is_set():
+                    return
+            buffer.put(_DONE)
+        except BaseException as e:
+            buffer.put(_Failure(e))
+
+    def consume() -> Generator[T, None, None]:
+        try:
+            while (item := buffer.get()) is not _DONE:
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            stopped.set()
+            # Unblock the producer if it is waiting on a full buffer.
+            while not buffer.empty():
+                buffer.get_nowait()
+
+    threading.Thread(target=produce, daemon=True).start()
+    return consume()
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed_geocode_cache(
+    diffs: Iterable[tuple[EnrichableContact, dict[str, Any]]],
+    cache: GeocodeCache,
+    batch_size: int = 1000,
+) -> Iterator[tuple[EnrichableContact, dict[str, Any]]]:
+    """Seed the cache with each batch of enriched contacts before passing them along.
+
+    Seeding only once contacts are enriched means their addresses are normalized.
+    """
+    for batch in chunked(diffs, batch_size):
+        cache.seed(entry for entry, _ in batch)
+        yield from batch
+
+
+def emails_needing_coordinates(entries: Iterable[EnrichableContact]) -> list[str]:
+    return [
+        entry.email for entry in entries if entry.email and entry.needs_coordinates()
+    ]
+
+
+def prefetch_coordinates(
+    entries: Iterable[EnrichableContact],
+    reference: ReferenceData,
+    lookup: CoordinatesLookup | None = None,
+    batch_size: int = 200,
+) -> Iterator[EnrichableContact]:
+    """Look up the Mailchimp members of each batch of contacts concurrently, and
+    reverse geocode their coordinates in one batch, before passing the contacts
+    along."""
+    for batch in chunked(entries, batch_size):
+        if lookup is not None:
+            lookup.prefetch(emails_needing_coordinates(batch))
+        prefetch_reverse_geocode(batch, reference)
+        yield from batch
+
+
+def prefetch_reverse_geocode(
+    entries: Iterable[EnrichableContact], reference: ReferenceData
+) -> None:
+    """Reverse geocode the coordinates of every contact that needs them at once, if
+    the geocoder answers batches."""
+    if not isinstance(reference.reverse_geocode, OfflineReverseGeocoder):
+        return
+    reference.reverse_geocode.prefetch(
+        [
+            coordinates
+            for entry in entries
+            if (coordinates := coordinates_for(entry, reference)) is not None
+        ]
+    )
+
+
+def enrich(
+    entry: EnrichableContact,
+    reference: ReferenceData,
+    outcomes: Counter[str] | None = None,
+    memo: EnrichmentMemo | None = None,
+) -> None:
+    # The order of operations matters.
+    populate_via_coordinates(entry, reference, outcomes)
+    enrich_address(entry, reference, outcomes, memo)
+
+
+def enrich_address(
+    entry: EnrichableContact,
+    reference: ReferenceData,
+    outcomes: Counter[str] | None = None,
+    memo: EnrichmentMemo | None = None,
+) -> None:
+    """Normalize the address and populate it from the reference data, reusing the
+    result for an identical address from `memo` if there is one."""
+    if memo is None:
+        normalize(entry, reference)
+        populate_via_reference_data(entry, reference, outcomes)
+        return
+    key = (entry.country, entry.state, entry.city, entry.zipcode)
+    address = memo.get(key)
+    if address is None:
+        address_outcomes: Counter[str] = Counter()
+        normalize(entry, reference)
+        populate_via_reference_data(entry, reference, address_outcomes)
+        address = EnrichedAddress(
+            entry.country,
+            entry.state,
+            entry.city,
+            entry.zipcode,
+            entry.metro if address_outcomes["metro_found"] else None,
+            address_outcomes,
+        )
+        memo.put(key, address)
+    else:
+        # Only assign what changed, so that unchanged fields aren't tracked.
+        for name, value in zip(("country", "state", "city", "zipcode"), address):
+            if getattr(entry, name) != value:
+                setattr(entry, name, value)
+        if address.metro is not None and entry.metro != address.metro:
+            entry.metro = address.metro
+    if outcomes is not None:
+        outcomes.update(address.outcomes)
+
+
+def normalize(entry: EnrichableContact, reference: ReferenceData) -> None:
+    if "normalize" in reference.stages:
+        entry.normalize()
+
+
+def count_outcome(
+    outcomes: Counter[str] | None, lookup: str, found: bool | None
+) -> None:
+    """Count whether a lookup found a value, if the contact needed it."""
+    if outcomes is not None and found is not None:
+        outcomes[f"{lookup}_{'found' if found else 'missing'}"] += 1
+
+
+def populate_via_coordinates(
+    entry: EnrichableContact,
+    reference: ReferenceData,
+    outcomes: Counter[str] | None = None,
+) -> None:
+    if "coordinates" not in reference.stages:
+        return
+    assert reference.reverse_geocode is not None
+    count_outcome(
+        outcomes,
+        "coordinates",
+        entry.populate_via_coordinates(
+            coordinates_for(entry, reference), reference.reverse_geocode
+        ),
+    )
+
+
+def coordinates_for(
+    entry: EnrichableContact, reference: ReferenceData
+) -> Coordinates | None:
+    """The contact's Mailchimp coordinates, only looked up if it needs them."""
+    if (
+        "coordinates" not in reference.stages
+        or not entry.email
+        or not entry.needs_coordinates()
+    ):
+        return None
+    return reference.coordinates_by_email.get(entry.email.lower())
+
+
+def skip_unchanged(
+    entries: Iterable[EnrichableContact],
+    reference: ReferenceData,
+    fingerprints: FingerprintStore,
+) -> Iterator[EnrichableContact]:
+    """Drop contacts that are the same as when they were last enriched, looking up
+    each batch of `fingerprints.batch_size` contacts at once."""
+    for batch in chunked(entries, fingerprints.batch_size):
+        unchanged = fingerprints.unchanged(
+            [(entry, coordinates_for(entry, reference)) for entry in batch]
+        )
+        for entry, entry_unchanged in zip(batch, unchanged):
+            if not entry_unchanged:
+                yield entry
+
+
+def populate_via_reference_data(
+    entry: EnrichableContact,
+    reference: ReferenceData,
+    outcomes: Counter[str] | None = None,
+) -> None:
+    if "zipcode" in reference.stages:
+        count_outcome(
+            outcomes, "zipcode", entry.populate_via_zipcode(reference.zip_index)
+        )
+    if "metro" in reference.stages:
+        count_outcome(
+            outcomes,
+            "metro",
+            entry.populate_metro_area(
+                reference.us_zip_to_metro, reference.us_city_and_state_to_metro
+            ),
+        )
+
+
+def compute_diffs(
+    entries: Iterable[EnrichableContact],
+    reference: ReferenceData,
+    outcomes: Counter[str] | None = None,
+    memo: EnrichmentMemo | None = None,
+) -> Iterator[tuple[EnrichableContact, dict[str, Any]]]:
+    """Enrich each contact and yield it with its changes, which may be empty.
+
+    If given, `outcomes` counts which lookups found values.
+    """
+    for entry in entries:
+        enrich(entry, reference, outcomes, memo)
+        yield entry, entry.compute_changes()
+
+
+def compute_store_diffs(
+    store: ContactStore,
+    reference: ReferenceData,
+    outcomes: Counter[str] | None = None,
+    fingerprints: FingerprintStore | None = None,
+) -> Iterator[tuple[EnrichableContact, dict[str, Any]]]:
+    """Like `compute_diffs`, but normalizes every row in one batch.
+
+    Rows that fail normalization are logged and skipped rather than stopping the run.
+    Rows that `fingerprints` finds unchanged are skipped too.
+    """
+    unchanged = (
+        fingerprints.unchanged(
+            [(row, coordinates_for(row, reference)) for row in store]
+        )
+        if fingerprints is not None
+        else [False] * len(store)
+    )
+    prefetch_reverse_geocode(
+        (row for row, row_unchanged in zip(store, unchanged) if not row_unchanged),
+        reference,
+    )
+    for row, row_unchanged in zip(store, unchanged):
+        if not row_unchanged:
+            populate_via_coordinates(row, reference, outcomes)
+    if "normalize" in reference.stages:
+        failed = store.normalize()
+    else:
+        failed = [False] * len(store)
+    for row, row_unchanged, row_failed in zip(store, unchanged, failed):
+        if row_unchanged:
+            continue
+        if row_failed:
+            logger.error(f"Skipping {row.uid}, which could not be normalized: {row}")
+            continue
+        populate_via_reference_data(row, reference, outcomes)
+        yield row, row.compute_changes()
@@ -0,0 +1,238 @@
+import time
+from pathlib import Path
+from collections import Counter
+from typing import Iterator
+from unittest.mock import Mock
+
+import pytest
+
+import pipeline
+from contact_store import ContactStore
+from fingerprints import FingerprintStore
+from mailchimp_coordinates import Coordinates
+from offline_geocoder import OfflineReverseGeocoder
+from salesforce_entry import SalesforceEntry
+
+
+def test_prefetch_preserves_order() -> None:
+    assert list(pipeline.prefetch(range(100), maxsize=3)) == list(range(100))
+
+
+def test_prefetch_is_bounded() -> None:
+    produced = []
+
+    def source() -> Iterator[int]:
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    items = pipeline.prefetch(source(), maxsize=5)
+    assert next(items) == 0
+    time.sleep(0.1)
+    assert len(produced) <= 7
+    items.close()
+
+
+def test_prefetch_reraises_errors() -> None:
+    def source() -> Iterator[int]:
+        yield 1
+        raise ValueError("page failed")
+
+    items = pipeline.prefetch(source(), maxsize=5)
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="page failed"):
+        next(items)
+
+
+def test_chunked() -> None:
+    assert list(pipeline.chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+@pytest.fixture
+def reference() -> pipeline.ReferenceData:
+    return pipeline.ReferenceData(
+        coordinates_by_email={},
+        reverse_geocode=Mock(),
+        zip_index=Mock(),
+        us_zip_to_metro={"11370": "My Metro"},
+        us_city_and_state_to_metro={},
+    )
+
+
+def make_entries() -> list[SalesforceEntry]:
+    return [
+        SalesforceEntry.mock(country="US", zipcode="11370-2314", state="NY", city="A"),
+        SalesforceEntry.mock(country="MEX", city="Tijuana"),
+    ]
+
+
+def test_compute_diffs(reference: pipeline.ReferenceData) -> None:
+    diffs = list(pipeline.compute_diffs(make_entries(), reference))
+    assert [changes for _, changes in diffs] == [
+        {
+            "MailingCountry": "USA",
+            "MailingPostalCode": "11370",
+            "Metro_Area__c": "My Metro",
+        },
+        {},
+    ]
+
+
+def test_compute_diffs_only_runs_selected_stages(
+    reference: pipeline.ReferenceData,
+) -> None:
+    reference = reference._replace(
+        reverse_geocode=None, stages=frozenset({"normalize", "metro"})
+    )
+    entries = [SalesforceEntry.mock(country="US", zipcode="11370", state="New York")]
+    diffs = list(pipeline.compute_diffs(entries, reference))
+    assert diffs[0][1] == {
+        "MailingCountry": "USA",
+        "MailingState": "NY",
+        "Metro_Area__c": "My Metro",
+    }
+    reference.zip_index.by_zipcode.assert_not_called()  # type: ignore[attr-defined]
+
+
+def test_skip_unchanged(reference: pipeline.ReferenceData, tmp_path: Path) -> None:
+    store = FingerprintStore("v1", tmp_path / "fingerprints.sqlite3")
+    enriched, *_ = make_entries()
+    pipeline.enrich(enriched, reference)
+    store.add(enriched, None)
+    store.close()
+
+    store = FingerprintStore("v1", tmp_path / "fingerprints.sqlite3")
+    unchanged = SalesforceEntry(**enriched.model_dump(by_alias=True))
+    changed = make_entries()[0]
+    assert list(pipeline.skip_unchanged([unchanged, changed], reference, store)) == [
+        changed
+    ]
+
+
+def test_compute_diffs_counts_outcomes(reference: pipeline.ReferenceData) -> None:
+    entries = [*make_entries(), SalesforceEntry.mock(country="US", state="NY")]
+    outcomes: Counter[str] = Counter()
+    list(pipeline.compute_diffs(entries, reference, outcomes))
+    assert outcomes == {"coordinates_missing": 1, "metro_found": 1, "metro_missing": 1}
+
+
+def test_compute_store_diffs(reference: pipeline.ReferenceData) -> None:
+    entries = [*make_entries(), SalesforceEntry.mock(country="Atlantis")]
+    store = ContactStore.from_records(e.model_dump(by_alias=True) for e in entries)
+    diffs = list(pipeline.compute_store_diffs(store, reference))
+    assert [changes for _, changes in diffs] == [
+        changes for _, changes in pipeline.compute_diffs(make_entries(), reference)
+    ]
+
+
+def test_prefetch_coordinates_only_needed_emails(
+    reference: pipeline.ReferenceData,
+) -> None:
+    entries = [
+        SalesforceEntry.mock(email="a@example.org"),
+        SalesforceEntry.mock(email="b@example.org", zipcode="11370"),
+        SalesforceEntry.mock(email="c@example.org", city="Tijuana", country="MEX"),
+        SalesforceEntry.mock(email="d@example.org"),
+    ]
+    lookup = Mock()
+    assert list(
+        pipeline.prefetch_coordinates(entries, reference, lookup, batch_size=2)
+    ) == (entries)
+    assert [call.args for call in lookup.prefetch.call_args_list] == [
+        (["a@example.org"],),
+        (["d@example.org"],),
+    ]
+
+
+def test_prefetch_coordinates_reverse_geocodes_batches(
+    reference: pipeline.ReferenceData,
+) -> None:
+    geocoder = OfflineReverseGeocoder([], Mock())
+    geocoder.prefetch = Mock()  # type: ignore[method-assign]
+    reference = reference._replace(
+        coordinates_by_email={
+            "a@example.org": Coordinates(1, 2),
+            "b@example.org": Coordinates(3, 4),
+        },
+        reverse_geocode=geocoder,
+    )
+    entries = [
+        SalesforceEntry.mock(email="a@example.org"),
+        SalesforceEntry.mock(email="b@example.org", zipcode="11370"),
+        SalesforceEntry.mock(email="missing@example.org"),
+    ]
+    assert list(pipeline.prefetch_coordinates(entries, reference)) == entries
+    geocoder.prefetch.assert_called_once_with([Coordinates(1, 2)])
+
+
+def test_coordinates_for_only_looks_up_contacts_that_need_them(
+    reference: pipeline.ReferenceData,
+) -> None:
+    lookup = Mock()
+    reference = reference._replace(coordinates_by_email=lookup)
+    assert (
+        pipeline.coordinates_for(SalesforceEntry.mock(zipcode="11370"), reference)
+        is None
+    )
+    lookup.get.assert_not_called()
+    pipeline.coordinates_for(SalesforceEntry.mock(email="A@Example.org"), reference)
+    lookup.get.assert_called_once_with("a@example.org")
+
+
+def make_shared_address_entries() -> list[SalesforceEntry]:
+    return [
+        *make_entries(),
+        SalesforceEntry.mock(country="US", zipcode="11370-2314", state="NY", city="A"),
+        SalesforceEntry.mock(
+            country="US", zipcode="11370-2314", state="NY", city="A", metro="Old"
+        ),
+        SalesforceEntry.mock(country="USA", zipcode="11370", state="NY", city="A"),
+        SalesforceEntry.mock(country="MEX", city="Tijuana"),
+        SalesforceEntry.mock(country="US", state="NY"),
+    ]
+
+
+def test_compute_diffs_with_memo(reference: pipeline.ReferenceData) -> None:
+    expected: Counter[str] = Counter()
+    expected_diffs = list(
+        pipeline.compute_diffs(make_shared_address_entries(), reference, expected)
+    )
+    memo = pipeline.EnrichmentMemo(max_entries=10)
+    outcomes: Counter[str] = Counter()
+    diffs = list(
+        pipeline.compute_diffs(make_shared_address_entries(), reference, outcomes, memo)
+    )
+    assert [changes for _, changes in diffs] == [
+        changes for _, changes in expected_diffs
+    ]
+    assert [entry.metro for entry, _ in diffs] == [
+        entry.metro for entry, _ in expected_diffs
+    ]
+    assert outcomes == expected
+    assert (memo.hits, memo.misses) == (3, 4)
+
+
+def test_enrichment_memo_evicts_least_recently_used() -> None:
+    memo = pipeline.EnrichmentMemo(max_entries=2)
+    address = pipeline.EnrichedAddress("USA", "NY", "A", "11370", None, Counter())
+    memo.put(("a", None, None, None), address)
+    memo.put(("b", None, None, None), address)
+    assert memo.get(("a", None, None, None)) is address
+    memo.put(("c", None, None, None), address)
+    assert memo.get(("b", None, None, None)) is None
+    assert memo.get(("a", None, None, None)) is address
+    assert memo.hit_ratio == 2 / 3
+
+
+def test_prefetch_starts_before_first_next() -> None:
+    produced = []
+
+    def source() -> Iterator[int]:
+        for i in range(3):
+            produced.append(i)
+            yield i
+
+    items = pipeline.prefetch(source(), maxsize=5)
+    time.sleep(0.1)
+    assert produced == [0, 1, 2]
+    assert list(items) == [0, 1, 2]
@@ -0,0 +1,45 @@
+import gzip
+import json
+from pathlib import Path
+from typing import IO, Any, Iterator, NamedTuple
+
+"""A plan is the changes that a run computed without writing them, saved so that
+they can be reviewed and then applied with `apply_plan.py` without reloading or
+re-enriching any contact.
+
+Plans are JSON lines, one per changed contact with its new and original values,
+and are gzipped if the file name ends with `.gz`."""
+
+
+class PlannedChange(NamedTuple):
+    uid: str
+    changes: dict[str, Any]
+    original: dict[str, Any]
+
+
+class PlanWriter:
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = _open(path, write=True)
+        self.changes = 0
+
+    def add(self, change: PlannedChange) -> None:
+        self.file.write(json.dumps(change._asdict(), separators=(",", ":")) + "\n")
+        self.changes += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_plan(path: Path) -> Iterator[PlannedChange]:
+    with _open(path) as file:
+        for line in file:
+            yield PlannedChange(**json.loads(line))
+
+
+def _open(path: Path, *, write: bool = False) -> IO[str]:
+    if path.suffix != ".gz":
+        return path.open("w" if write else "r", encoding="utf-8")
+    if write:
+        return gzip.open(path, "wt", encoding="utf-8")
+    return gzip.open(path, "rt", encoding="utf-8")
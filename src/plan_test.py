@@ -0,0 +1,21 @@
+from pathlib import Path
+
+import pytest
+
+from plan import PlannedChange, PlanWriter, read_plan
+
+CHANGES = [
+    PlannedChange("1", {"MailingCountry": "USA"}, {"MailingCountry": "US"}),
+    PlannedChange("2", {"Metro_Area__c": "Phoenix"}, {"Metro_Area__c": None}),
+]
+
+
+@pytest.mark.parametrize("name", ["plan.jsonl", "plan.jsonl.gz"])
+def test_round_trip(tmp_path: Path, name: str) -> None:
+    path = tmp_path / name
+    writer = PlanWriter(path)
+    for change in CHANGES:
+        writer.add(change)
+    writer.close()
+    assert writer.changes == 2
+    assert list(read_plan(path)) == CHANGES
@@ -0,0 +1,58 @@
+from country_codes import COUNTRY_CODES_TWO_LETTER_TO_THREE, COUNTRY_NAMES_TO_THREE
+
+"""Derive a SOQL condition from the enrichment rules that matches every contact
+whose enrichment might change it, so that contacts that are already enriched are
+neither transferred nor validated.
+
+SOQL compares text case-insensitively, so all-caps cities can't be matched.
+That's why the condition only narrows full syncs whose reference data is
+unchanged since the last run: contacts that were created or edited since then are
+loaded by the incremental runs regardless."""
+
+US_SPELLINGS = sorted(
+    {"USA"}
+    | {
+        code
+        for code, three in COUNTRY_CODES_TWO_LETTER_TO_THREE.items()
+        if three == "USA"
+    }
+    | {name for name, three in COUNTRY_NAMES_TO_THREE.items() if three == "USA"}
+)
+
+
+def soql_quote(value: str) -> str:
+    """Quote `value` as a SOQL string literal."""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+_IS_US = f"MailingCountry IN ({', '.join(soql_quote(s) for s in US_SPELLINGS)})"
+
+
+def eligibility_condition(stages: frozenset[str]) -> str:
+    """A condition that is true for every contact that `stages` might change."""
+    conditions = []
+    if "coordinates" in stages:
+        # Like `EnrichableContact.needs_coordinates`.
+        conditions.append(
+            "(Email != null AND MailingPostalCode = null "
+            "AND (MailingCity = null OR MailingCountry = null))"
+        )
+    if "normalize" in stages:
+        conditions.extend(
+            [
+                # Two letter codes and names, rather than three letter codes.
+                "(MailingCountry != null "
+                f"AND (NOT MailingCountry LIKE {soql_quote('___')}))",
+                f"({_IS_US} AND MailingState LIKE {soql_quote('___%')})",
+                # ZIP+4.
+                f"({_IS_US} AND MailingPostalCode LIKE {soql_quote('______%')})",
+            ]
+        )
+    if "zipcode" in stages:
+        conditions.append(
+            f"({_IS_US} AND MailingPostalCode != null "
+            "AND (MailingState = null OR MailingCity = null))"
+        )
+    if "metro" in stages:
+        conditions.append(f"({_IS_US} AND Metro_Area__c = null)")
+    return " OR ".join(conditions) or "Id = null"
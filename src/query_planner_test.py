@@ -0,0 +1,87 @@
+import re
+import sqlite3
+from typing import Any
+
+import benchmark
+import pipeline
+from query_planner import eligibility_condition, soql_quote
+from salesforce_entry import SalesforceEntry
+
+STAGES = frozenset({"normalize", "zipcode", "metro"})
+
+
+def query_eligible(records: list[dict[str, Any]], condition: str) -> set[str]:
+    """Evaluate the SOQL condition with SQLite, whose LIKE and NOCASE columns
+    compare text case-insensitively like SOQL does."""
+    connection = sqlite3.connect(":memory:")
+    fields = list(records[0])
+    connection.execute(
+        f"CREATE TABLE Contact ({', '.join(f'{f} COLLATE NOCASE' for f in fields)})"
+    )
+    connection.executemany(
+        f"INSERT INTO Contact VALUES ({', '.join('?' * len(fields))})",
+        [list(record.values()) for record in records],
+    )
+    condition = re.sub(r"(\w+) != null", r"\1 IS NOT NULL", condition)
+    condition = re.sub(r"(\w+) = null", r"\1 IS NULL", condition)
+    return {
+        uid
+        for (uid,) in connection.execute(f"SELECT Id FROM Contact WHERE {condition}")
+    }
+
+
+def enrich(
+    records: list[dict[str, Any]], reference: pipeline.ReferenceData
+) -> list[SalesforceEntry]:
+    entries = [SalesforceEntry(**record) for record in records]
+    for entry in entries:
+        pipeline.enrich(entry, reference)
+    return entries
+
+
+def test_eligibility_condition_matches_every_contact_that_changes() -> None:
+    data = benchmark.synthetic_reference(zipcodes=50)
+    reference = pipeline.ReferenceData(
+        coordinates_by_email={},
+        reverse_geocode=None,
+        zip_index=data.zip_index,
+        us_zip_to_metro=data.us_zip_to_metro,
+        us_city_and_state_to_metro=data.us_city_and_state_to_metro,
+        stages=STAGES,
+    )
+    records = benchmark.synthetic_records(2000, data)
+    eligible = query_eligible(records, eligibility_condition(STAGES))
+
+    for entry in enrich(records, reference):
+        changes = entry.compute_changes()
+        original = entry.compute_original_values()
+        # Title casing all-caps cities can't be expressed in SOQL.
+        if changes.get("MailingCity") == (original.get("MailingCity") or "").title():
+            del changes["MailingCity"]
+        if changes:
+            assert entry.uid in eligible, (changes, original)
+
+    # Once enriched, only contacts whose lookups found nothing stay eligible.
+    enriched = [entry.model_dump(by_alias=True) for entry in enrich(records, reference)]
+    still_eligible = query_eligible(enriched, eligibility_condition(STAGES))
+    assert len(still_eligible) < len(eligible) / 2
+
+
+def test_coordinates_condition() -> None:
+    records = [
+        SalesforceEntry.mock(email="a@example.org").model_dump(by_alias=True),
+        SalesforceEntry.mock(
+            email="b@example.org", city="Tempe", country="USA", metro="Phoenix"
+        ).model_dump(by_alias=True),
+    ]
+    for i, record in enumerate(records):
+        record["Id"] = str(i)
+    assert query_eligible(
+        records, eligibility_condition(frozenset({"coordinates"}))
+    ) == {"0"}
+
+
+def test_soql_quote() -> None:
+    assert soql_quote("USA") == "'USA'"
+    assert soql_quote("Cote d'Ivoire") == "'Cote d\\'Ivoire'"
+    assert soql_quote("a\\b") == "'a\\\\b'"
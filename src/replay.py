@@ -0,0 +1,164 @@
+import gzip
+import json
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Iterable, Iterator
+
+from geocode_cache import CachedLocation
+from mailchimp_coordinates import Coordinates, CoordinatesSource
+
+"""Record what Salesforce, Mailchimp and Nominatim return during a run, so that the
+run can be replayed later without network access or credentials.
+
+Each service is recorded where the pipeline consumes it: the raw Salesforce query
+results, the Mailchimp coordinates of each contact that needed them, and each
+reverse geocoding query that the offline geocoder could not answer. Records are
+stored as gzipped JSON lines, alongside the list of stages that the run enriched
+with. Mailchimp and Nominatim are only recorded by runs with the coordinates
+stage."""
+
+SALESFORCE_FILE = "salesforce-contacts.jsonl.gz"
+MAILCHIMP_FILE = "mailchimp-coordinates.jsonl.gz"
+NOMINATIM_FILE = "nominatim.jsonl.gz"
+STAGES_FILE = "stages.json"
+
+
+class Recorder:
+    def __init__(self, directory: Path, stages: Iterable[str]) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self._files: list[gzip.GzipFile] = []
+        (directory / STAGES_FILE).write_text(json.dumps(sorted(stages)))
+
+    def salesforce(self, client: Any) -> "RecordingSalesforce":
+        return RecordingSalesforce(client, self._open(SALESFORCE_FILE))
+
+    def coordinates(self, source: CoordinatesSource) -> CoordinatesSource:
+        file = self._open(MAILCHIMP_FILE)
+        recorded: set[str] = set()
+
+        class RecordingCoordinates:
+            def get(self, email: str) -> Coordinates | None:
+                coordinates = source.get(email)
+                if coordinates is not None and email not in recorded:
+                    recorded.add(email)
+                    _write_line(file, [email, *coordinates])
+                return coordinates
+
+        return RecordingCoordinates()
+
+    def reverse_geocode(self, reverse_geocode: Callable) -> Callable:
+        file = self._open(NOMINATIM_FILE)
+
+        def record(query: str) -> Any:
+            result = reverse_geocode(query)
+            _write_line(file, [query, None if result is None else result.raw])
+            return result
+
+        return record
+
+    def close(self) -> None:
+        for file in self._files:
+            file.close()
+
+    def _open(self, name: str) -> gzip.GzipFile:
+        file = gzip.open(self.directory / name, "wb")
+        self._files.append(file)
+        return file
+
+
+class RecordingSalesforce:
+    """Passes everything through to `client`, saving the query results.
+
+    Queries may run on several threads at once, for parallel extraction.
+    """
+
+    def __init__(self, client: Any, file: gzip.GzipFile) -> None:
+        self.client = client
+        self.file = file
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    def query_all_iter(self, query: str) -> Iterator[dict[str, Any]]:
+        for record in self.client.query_all_iter(query):
+            with self._lock:
+                _write_line(self.file, record)
+            yield record
+
+
+class Replayer:
+    def __init__(self, directory: Path) -> None:
+        """Check that `directory` holds a complete recording, raising
+        `FileNotFoundError` if not."""
+        self.directory = directory
+        if not directory.is_dir():
+            raise FileNotFoundError(f"Recording {directory} does not exist")
+        stages_path = directory / STAGES_FILE
+        # The stages that the recorded run enriched with.
+        self.stages: frozenset[str] = frozenset(
+            json.loads(stages_path.read_text()) if stages_path.exists() else []
+        )
+        required = [STAGES_FILE, SALESFORCE_FILE]
+        if "coordinates" in self.stages:
+            required += [MAILCHIMP_FILE, NOMINATIM_FILE]
+        if missing := [name for name in required if not (directory / name).exists()]:
+            raise FileNotFoundError(
+                f"Recording {directory} is missing {', '.join(missing)}"
+            )
+
+    def salesforce(self) -> "ReplaySalesforce":
+        return ReplaySalesforce(self.directory / SALESFORCE_FILE)
+
+    def coordinates(self) -> dict[str, Coordinates]:
+        return {
+            email.lower(): Coordinates(latitude, longitude)
+            for email, latitude, longitude in _read_lines(
+                self.directory / MAILCHIMP_FILE
+            )
+        }
+
+    def reverse_geocode(self) -> Callable[[str], CachedLocation | None]:
+        results = {
+            query: None if raw is None else CachedLocation(raw)
+            for query, raw in _read_lines(self.directory / NOMINATIM_FILE)
+        }
+        return lambda query: results.get(query)
+
+
+class ReplaySalesforce:
+    """Returns the recorded contacts for any query, and accepts every write."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.bulk2 = SimpleNamespace(Contact=_ReplayBulkContact())
+
+    def query_all_iter(self, query: str) -> Iterator[dict[str, Any]]:
+        return _read_lines(self.path)
+
+    def restful(self, path: str, method: str, json: dict[str, Any]) -> list[Any]:
+        return [{"success": True, "errors": []} for _ in json["records"]]
+
+
+class _ReplayBulkContact:
+    def update(self, records: list[dict[str, Any]], wait: int) -> list[dict[str, Any]]:
+        return [
+            {
+                "job_id": "replay",
+                "numberRecordsTotal": len(records),
+                "numberRecordsProcessed": len(records),
+                "numberRecordsFailed": 0,
+            }
+        ]
+
+
+def _write_line(file: gzip.GzipFile, value: Any) -> None:
+    file.write(json.dumps(value, separators=(",", ":")).encode("utf-8") + b"\n")
+
+
+def _read_lines(path: Path) -> Iterator[Any]:
+    with gzip.open(path, "rb") as file:
+        for line in file:
+            yield json.loads(line)
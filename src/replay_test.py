@@ -0,0 +1,86 @@
+from pathlib import Path
+from typing import Any
+
+import pytest
+from simple_salesforce import Salesforce
+
+from conftest import FakeSalesforce
+from geocode_cache import CachedLocation
+from mailchimp_coordinates import Coordinates
+from replay import (
+    MAILCHIMP_FILE,
+    NOMINATIM_FILE,
+    STAGES_FILE,
+    Recorder,
+    Replayer,
+)
+from salesforce_api import ContactWriter, load_data
+from salesforce_entry import SalesforceEntry
+
+
+def test_record_and_replay(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce, tmp_path: Path
+) -> None:
+    fake_salesforce.contacts = [
+        SalesforceEntry.mock(city=f"City {i}").model_dump(by_alias=True)
+        for i in range(5)
+    ]
+    fake_salesforce.page_size = 2
+    coordinates = {"a@example.org": Coordinates(1.5, 2.5)}
+    location = CachedLocation({"address": {"postcode": "11370"}})
+
+    recorder = Recorder(tmp_path, ["coordinates", "normalize"])
+    recorded_client: Any = recorder.salesforce(salesforce_client)
+    recorded_coordinates = recorder.coordinates(coordinates)
+    recorded_geocode = recorder.reverse_geocode(
+        lambda query: location if query == "1, 2" else None
+    )
+    recorded = [entry.city for entry in load_data(recorded_client)]
+    assert recorded_coordinates.get("a@example.org") == Coordinates(1.5, 2.5)
+    assert recorded_coordinates.get("b@example.org") is None
+    assert recorded_geocode("1, 2") == location
+    assert recorded_geocode("3, 4") is None
+    recorder.close()
+
+    replayer = Replayer(tmp_path)
+    assert replayer.stages == {"coordinates", "normalize"}
+    replayed_client: Any = replayer.salesforce()
+    assert [entry.city for entry in load_data(replayed_client)] == recorded
+    assert replayer.coordinates() == coordinates
+    reverse_geocode = replayer.reverse_geocode()
+    assert reverse_geocode("1, 2") == location
+    assert reverse_geocode("3, 4") is None
+
+
+def test_replay_requires_recorded_files(tmp_path: Path) -> None:
+    with pytest.raises(FileNotFoundError, match="does not exist"):
+        Replayer(tmp_path / "missing")
+    with pytest.raises(FileNotFoundError, match=f"missing {STAGES_FILE}"):
+        Replayer(tmp_path)
+
+    # Mailchimp and Nominatim are only needed if the coordinates stage was recorded.
+    recorder = Recorder(tmp_path, ["normalize"])
+    recorder.salesforce(None)
+    recorder.close()
+    assert Replayer(tmp_path).stages == {"normalize"}
+
+    Recorder(tmp_path, ["coordinates"])
+    with pytest.raises(
+        FileNotFoundError, match=f"missing {MAILCHIMP_FILE}, {NOMINATIM_FILE}"
+    ):
+        Replayer(tmp_path)
+
+
+def test_replay_accepts_writes(tmp_path: Path) -> None:
+    recorder = Recorder(tmp_path, ["normalize"])
+    recorder.salesforce(None)
+    recorder.close()
+    client: Any = Replayer(tmp_path).salesforce()
+    for bulk_threshold in (2, 100):
+        writer = ContactWriter(client, batch_size=2, bulk_threshold=bulk_threshold)
+        results = []
+        for i in range(3):
+            results.extend(writer.add(f"id{i}", {"MailingCity": "A"}))
+        results.extend(writer.flush())
+        assert [result.uid for result in results] == ["id0", "id1", "id2"]
+        assert all(result.success for result in results)
@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+
+"""Stage timings and counters for a run, so that a slow run can be attributed to
+Salesforce, Mailchimp, the reference data, geocoding, or writes."""
+
+T = TypeVar("T")
+
+PROMETHEUS_PREFIX = "salesforce_enrichment"
+
+
+class RunReport:
+    def __init__(self) -> None:
+        self.seconds: dict[str, float] = {}
+        self.counters: Counter[str] = Counter()
+        # Values that aren't totals, like hit ratios.
+        self.gauges: dict[str, float] = {}
+        # Counters are also incremented by request hooks on other threads.
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_seconds(name, time.perf_counter() - start)
+
+    def add_seconds(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0) + seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def update(self, counters: dict[str, int]) -> None:
+        with self._lock:
+            self.counters.update(counters)
+
+    def gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def timed(self, name: str, fn: Callable[..., T]) -> Callable[..., T]:
+        """Wrap `fn` to count its calls and add up the time spent in them."""
+
+        def wrapper(*args: Any, **kwargs: Any) -> T:
+            self.count(f"{name}_calls")
+            with self.stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    def timed_iter(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        """Add up the time spent waiting on `items`, e.g. for an upstream stage."""
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_seconds(name, time.perf_counter() - start)
+            yield item
+
+    def response_hook(self, service: str) -> Callable[..., None]:
+        """A `requests` response hook that counts API calls to `service`."""
+
+        def hook(response: Any, *args: Any, **kwargs: Any) -> None:
+            self.count(f"{service}_api_calls")
+
+        return hook
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "seconds": self.seconds,
+                "counters": dict(self.counters),
+                "gauges": self.gauges,
+            },
+            indent=2,
+        )
+
+    def to_prometheus(self) -> str:
+        lines = [f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds gauge"]
+        lines.extend(
+            f'{PROMETHEUS_PREFIX}_stage_seconds{{stage="{name}"}} {seconds}'
+            for name, seconds in sorted(self.seconds.items())
+        )
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_total gauge")
+        lines.extend(
+            f'{PROMETHEUS_PREFIX}_total{{counter="{name}"}} {value}'
+            for name, value in sorted(self.counters.items())
+        )
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_gauge gauge")
+        lines.extend(
+            f'{PROMETHEUS_PREFIX}_gauge{{gauge="{name}"}} {value}'
+            for name, value in sorted(self.gauges.items())
+        )
+        return "\n".join(lines) + "\n"
+
+    def write(
+        self, *, json_path: Path | None = None, prometheus_path: Path | None = None
+    ) -> None:
+        if json_path:
+            json_path.parent.mkdir(parents=True, exist_ok=True)
+            json_path.write_text(self.to_json())
+        if prometheus_path:
+            # The node exporter may read the textfile at any time, so replace it
+            # atomically.
+            prometheus_path.parent.mkdir(parents=True, exist_ok=True)
+            partial = prometheus_path.with_suffix(".tmp")
+            partial.write_text(self.to_prometheus())
+            partial.replace(prometheus_path)
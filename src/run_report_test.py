@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+
+from run_report import RunReport
+
+
+def test_stage_accumulates_seconds() -> None:
+    report = RunReport()
+    with report.stage("load"):
+        pass
+    with report.stage("load"):
+        pass
+    assert list(report.seconds) == ["load"]
+    assert report.seconds["load"] >= 0
+
+
+def test_timed_counts_calls() -> None:
+    report = RunReport()
+    double = report.timed("geocoder", lambda x: 2 * x)
+    assert double(2) == 4
+    assert double(3) == 6
+    assert report.counters["geocoder_calls"] == 2
+    assert "geocoder" in report.seconds
+
+
+def test_timed_iter() -> None:
+    report = RunReport()
+    assert list(report.timed_iter("source", range(3))) == [0, 1, 2]
+    assert "source" in report.seconds
+
+
+def test_write(tmp_path: Path) -> None:
+    report = RunReport()
+    report.add_seconds("load", 1.5)
+    report.count("zipcode_found", 3)
+    report.response_hook("salesforce")(None)
+    report.gauge("memo_hit_ratio", 0.75)
+    report.write(
+        json_path=tmp_path / "report.json",
+        prometheus_path=tmp_path / "metrics.prom",
+    )
+    assert json.loads((tmp_path / "report.json").read_text()) == {
+        "seconds": {"load": 1.5},
+        "counters": {"zipcode_found": 3, "salesforce_api_calls": 1},
+        "gauges": {"memo_hit_ratio": 0.75},
+    }
+    assert (tmp_path / "metrics.prom").read_text() == (
+        "# TYPE salesforce_enrichment_stage_seconds gauge\n"
+        'salesforce_enrichment_stage_seconds{stage="load"} 1.5\n'
+        "# TYPE salesforce_enrichment_total gauge\n"
+        'salesforce_enrichment_total{counter="salesforce_api_calls"} 1\n'
+        'salesforce_enrichment_total{counter="zipcode_found"} 3\n'
+        "# TYPE salesforce_enrichment_gauge gauge\n"
+        'salesforce_enrichment_gauge{gauge="memo_hit_ratio"} 0.75\n'
+    )
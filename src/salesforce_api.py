@@ -1,11 +1,43 @@
+import csv
+import json
+import logging
 import os
+import queue
+import re
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    TypeVar,
+)
 
-from simple_salesforce import Salesforce
-
+import backoff
+from contact_store import ContactStore
+from query_planner import soql_quote
 from salesforce_entry import SalesforceEntry
 
+if TYPE_CHECKING:
+    from simple_salesforce import Salesforce
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def init_client() -> "Salesforce":
+    from simple_salesforce import Salesforce
 
-def init_client() -> Salesforce:
     username = os.environ.pop("SALESFORCE_USERNAME")
     password = os.environ.pop("SALESFORCE_PASSWORD")
     token = os.environ.pop("SALESFORCE_TOKEN")
@@ -17,15 +49,509 @@ def init_client() -> Salesforce:
     )
 
 
-def load_data(client: Salesforce) -> list[SalesforceEntry]:
+def query_contacts(
+    client: "Salesforce",
+    *,
+    modified_since: datetime | None = None,
+    where: str | None = None,
+) -> Iterator[dict[str, Any]]:
+    """Lazily query every contact, or only those modified since `modified_since`
+    and matching the SOQL condition `where`.
+
+    Salesforce returns up to 2,000 records per page, and the next page is only
+    requested once the prior one is consumed.
+    """
     fields = ", ".join(
         info.alias or name for name, info in SalesforceEntry.model_fields.items()
     )
-    return [
+    return client.query_all_iter(
+        f"SELECT {fields} FROM Contact"
+        + where_clause(modified_since=modified_since, where=where)
+    )
+
+
+def query_contacts_parallel(
+    client: "Salesforce",
+    *,
+    modified_since: datetime | None = None,
+    where: str | None = None,
+    workers: int,
+    chunks_per_worker: int = 4,
+    buffer_size: int = 2000,
+) -> Generator[dict[str, Any], None, None]:
+    """Like `query_contacts`, but splits the contacts into Id ranges and queries
+    the ranges concurrently.
+
+    Each range is still paged serially, but the pages of different ranges overlap.
+    The threads share the client's pooled HTTP connections and pass records through
+    a buffer of at most `buffer_size`, so they wait on a slow consumer rather than
+    holding whole ranges in memory. Records are not in any particular order.
+    """
+    first, last = (
+        _edge_id(client, order, modified_since=modified_since, where=where)
+        for order in ("ASC", "DESC")
+    )
+    if first is None or last is None:
+        return
+    boundaries = id_boundaries(first, last, workers * chunks_per_worker)
+    ranges = []
+    for start, end in zip([None, *boundaries], [*boundaries, None]):
+        conditions = []
+        if start is not None:
+            conditions.append(f"Id >= {soql_quote(start)}")
+        if end is not None:
+            conditions.append(f"Id < {soql_quote(end)}")
+        ranges.append(" AND ".join(conditions))
+
+    # At least one slot per thread, so that draining it below unblocks them all.
+    buffer: queue.Queue[Any] = queue.Queue(max(buffer_size, workers))
+    stopped = threading.Event()
+
+    def query_range(id_range: str) -> None:
+        try:
+            for record in query_contacts(
+                client,
+                modified_since=modified_since,
+                where=f"({where}) AND {id_range}" if where else id_range or None,
+            ):
+                if stopped.is_set():
+                    return
+                buffer.put(record)
+            buffer.put(_RANGE_DONE)
+        except BaseException as e:
+            buffer.put(_RangeFailure(e))
+
+    executor = ThreadPoolExecutor(workers, thread_name_prefix="salesforce")
+    try:
+        for id_range in ranges:
+            executor.submit(query_range, id_range)
+        remaining = len(ranges)
+        while remaining:
+            item = buffer.get()
+            if item is _RANGE_DONE:
+                remaining -= 1
+            elif isinstance(item, _RangeFailure):
+                raise item.error
+            else:
+                yield item
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Unblock the threads that are waiting on a full buffer.
+        while not buffer.empty():
+            buffer.get_nowait()
+
+
+class _RangeFailure(NamedTuple):
+    error: BaseException
+
+
+_RANGE_DONE = object()
+
+
+# The characters of Salesforce Ids in the order that they compare, so that Ids are
+# base-62 numbers.
+_ID_DIGITS = string.digits + string.ascii_uppercase + string.ascii_lowercase
+_ID_LENGTH = 15
+
+
+def id_boundaries(first: str, last: str, chunks: int) -> list[str]:
+    """Split the Ids from `first` to `last` into up to `chunks` ranges of equal
+    width, returning the Ids between them in ascending order.
+
+    Compares the case-sensitive 15 character form of the Ids, since the 18
+    character form only adds a checksum.
+    """
+    low, high = (_id_number(uid[:_ID_LENGTH]) for uid in (first, last))
+    return sorted(
+        {_id_string(low + (high - low) * i // chunks) for i in range(1, chunks)}
+        - {_id_string(low)}
+    )
+
+
+def _id_number(uid: str) -> int:
+    number = 0
+    for char in uid:
+        number = number * len(_ID_DIGITS) + _ID_DIGITS.index(char)
+    return number
+
+
+def _id_string(number: int) -> str:
+    chars = []
+    for _ in range(_ID_LENGTH):
+        number, digit = divmod(number, len(_ID_DIGITS))
+        chars.append(_ID_DIGITS[digit])
+    return "".join(reversed(chars))
+
+
+def _edge_id(
+    client: "Salesforce",
+    order: str,
+    *,
+    modified_since: datetime | None,
+    where: str | None,
+) -> str | None:
+    """The first or last Id of the matching contacts, depending on `order`."""
+    result = client.query(
+        "SELECT Id FROM Contact"
+        + where_clause(modified_since=modified_since, where=where)
+        + f" ORDER BY Id {order} LIMIT 1"
+    )
+    return result["records"][0]["Id"] if result["records"] else None
+
+
+def count_contacts(
+    client: "Salesforce",
+    *,
+    modified_since: datetime | None = None,
+    where: str | None = None,
+) -> int:
+    query = "SELECT COUNT() FROM Contact" + where_clause(
+        modified_since=modified_since, where=where
+    )
+    return client.query(query)["totalSize"]
+
+
+def current_values(
+    client: "Salesforce", uids: Iterable[str], fields: Iterable[str]
+) -> dict[str, dict[str, Any]]:
+    """Return the current `fields` of each contact in `uids` that still exists."""
+    query = (
+        f"SELECT {', '.join(['Id', *sorted(set(fields) - {'Id'})])} FROM Contact "
+        f"WHERE Id IN ({', '.join(soql_quote(uid) for uid in uids)})"
+    )
+    return {record["Id"]: record for record in client.query_all_iter(query)}
+
+
+def where_clause(
+    *, modified_since: datetime | None = None, where: str | None = None
+) -> str:
+    conditions = []
+    if modified_since is not None:
+        conditions.append(f"SystemModstamp > {format_soql_datetime(modified_since)}")
+    if where:
+        conditions.append(f"({where})" if conditions else where)
+    return f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+def load_data(
+    client: "Salesforce",
+    *,
+    modified_since: datetime | None = None,
+    where: str | None = None,
+    workers: int = 1,
+) -> Iterator[SalesforceEntry]:
+    return (
         SalesforceEntry(**raw)
-        for raw in client.query_all_iter(f"SELECT {fields} FROM Contact")
-    ]
+        for raw in _query(
+            client, modified_since=modified_since, where=where, workers=workers
+        )
+    )
+
+
+def load_columnar(
+    client: "Salesforce",
+    *,
+    modified_since: datetime | None = None,
+    where: str | None = None,
+    workers: int = 1,
+) -> ContactStore:
+    return ContactStore.from_records(
+        _query(client, modified_since=modified_since, where=where, workers=workers)
+    )
+
+
+def _query(
+    client: "Salesforce",
+    *,
+    modified_since: datetime | None,
+    where: str | None,
+    workers: int,
+) -> Iterator[dict[str, Any]]:
+    if workers > 1:
+        return query_contacts_parallel(
+            client, modified_since=modified_since, where=where, workers=workers
+        )
+    return query_contacts(client, modified_since=modified_since, where=where)
+
+
+def format_soql_datetime(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+SYNC_STATE_PATH = Path(".cache/salesforce-sync.json")
+
+# Contacts saved while a run is in progress can be committed with a SystemModstamp
+# slightly before the run's recorded start, so we overlap consecutive runs.
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+
+class SyncState(NamedTuple):
+    """When the last successful run started, the last one that loaded every
+    contact, and the `fingerprints.reference_version` of the last run."""
+
+    last_sync: datetime | None = None
+    last_full_sync: datetime | None = None
+    reference_version: str | None = None
+
+    @classmethod
+    def read(cls, path: Path = SYNC_STATE_PATH) -> "SyncState":
+        if not path.exists():
+            return cls()
+        data = json.loads(path.read_text())
+        last_sync, last_full_sync = (
+            datetime.fromisoformat(data[field]) if data.get(field) else None
+            for field in ("last_sync", "last_full_sync")
+        )
+        return cls(last_sync, last_full_sync, data.get("reference_version"))
+
+    def write(self, path: Path = SYNC_STATE_PATH) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(
+            json.dumps(
+                {
+                    field: value.isoformat() if isinstance(value, datetime) else value
+                    for field, value in self._asdict().items()
+                }
+            )
+        )
+
+    def modified_since(
+        self,
+        now: datetime,
+        full_sync_interval: timedelta,
+        reference_version: str | None,
+    ) -> datetime | None:
+        """The watermark to load contacts from, or None if a full sync is due.
+
+        A full sync is also due once the reference data changes, since unmodified
+        contacts might then enrich differently.
+        """
+        if (
+            self.last_sync is None
+            or self.last_full_sync is None
+            or now - self.last_full_sync >= full_sync_interval
+            or self.reference_version != reference_version
+        ):
+            return None
+        return self.last_sync - WATERMARK_OVERLAP
+
+    def advance(
+        self,
+        started: datetime,
+        *,
+        full_sync: bool,
+        reference_version: str | None = None,
+    ) -> "SyncState":
+        return SyncState(
+            last_sync=started,
+            last_full_sync=started if full_sync else self.last_full_sync,
+            reference_version=reference_version,
+        )
+
+
+class ApiLimitReached(Exception):
+    pass
+
+
+class ApiUsage:
+    """The org's daily API usage, as reported by the `Sforce-Limit-Info` header of
+    each response."""
+
+    def __init__(self) -> None:
+        self.used: int | None = None
+        self.limit: int | None = None
+
+    def response_hook(self, response: Any, *args: Any, **kwargs: Any) -> None:
+        header = response.headers.get("Sforce-Limit-Info", "")
+        if match := re.search(r"api-usage=(\d+)/(\d+)", header):
+            self.used, self.limit = int(match[1]), int(match[2])
+
+    @property
+    def fraction(self) -> float:
+        return self.used / self.limit if self.used is not None and self.limit else 0
+
+
+def with_backoff(
+    call: Callable[[], T],
+    *,
+    retries: int = 5,
+    base_delay: float = 1.0,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    """Retry `call` on connection errors and server errors, doubling the delay
+    after each attempt.
+
+    Raises `ApiLimitReached` if Salesforce refuses the request because the org is
+    out of API requests, since retrying won't help until the usage window rolls.
+    """
+    from simple_salesforce.exceptions import SalesforceError, SalesforceRefusedRequest
+
+    try:
+        return backoff.with_backoff(
+            call,
+            service="Salesforce",
+            retryable=lambda e: (
+                isinstance(e, SalesforceError) and (e.status or 0) >= 500
+            ),
+            retries=retries,
+            base_delay=base_delay,
+            sleep=sleep,
+        )
+    except SalesforceRefusedRequest as e:
+        if "REQUEST_LIMIT_EXCEEDED" in str(e.content):
+            raise ApiLimitReached("Salesforce API request limit exceeded") from e
+        raise
+
+
+class WriteResult(NamedTuple):
+    uid: str
+    changes: dict[str, Any]
+    errors: list[str]
+
+    @property
+    def success(self) -> bool:
+        return not self.errors
+
+
+class ContactWriter:
+    """Buffer contact changes and write them in batches.
+
+    Each `batch_size` buffered changes are sent right away as an sObject
+    Collections update, so that an interrupted run only loses the last batch. Once
+    `bulk_threshold` changes have been sent that way, the run is large enough that
+    changes are instead buffered until there are `bulk_threshold` of them, then
+    sent as a single Bulk API 2.0 job, which does not count each record against the
+    API request limit.
+
+    Failed requests are retried with exponential backoff. If `api_usage` is
+    given, writes stop with `ApiLimitReached` once the org has used
+    `max_api_usage` of its daily API requests, leaving the rest for other
+    integrations.
+    """
+
+    def __init__(
+        self,
+        client: "Salesforce",
+        *,
+        batch_size: int = 200,
+        bulk_threshold: int = 10_000,
+        bulk_poll_seconds: int = 5,
+        api_usage: ApiUsage | None = None,
+        max_api_usage: float = 1.0,
+        retries: int = 5,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.client = client
+        self.batch_size = batch_size
+        self.bulk_threshold = bulk_threshold
+        self.bulk_poll_seconds = bulk_poll_seconds
+        self.api_usage = api_usage
+        self.max_api_usage = max_api_usage
+        self.retries = retries
+        self.sleep = sleep
+        self.pending: dict[str, dict[str, Any]] = {}
+        self.collection_records = 0
+
+    def add(self, uid: str, changes: dict[str, Any]) -> list[WriteResult]:
+        """Buffer the changes, returning the results of any writes this triggered."""
+        self.pending.setdefault(uid, {}).update(changes)
+        if len(self.pending) >= self.bulk_threshold:
+            return self._write_bulk(self._drain())
+        if (
+            len(self.pending) >= self.batch_size
+            and self.collection_records < self.bulk_threshold
+        ):
+            return self._write_collection(self._drain())
+        return []
+
+    def flush(self) -> list[WriteResult]:
+        pending = self._drain()
+        if len(pending) >= self.bulk_threshold:
+            return self._write_bulk(pending)
+        results = []
+        for start in range(0, len(pending), self.batch_size):
+            results.extend(
+                self._write_collection(pending[start : start + self.batch_size])
+            )
+        return results
+
+    def _call(self, call: Callable[[], T]) -> T:
+        if self.api_usage and self.api_usage.fraction >= self.max_api_usage:
+            raise ApiLimitReached(
+                f"Salesforce API usage is at {self.api_usage.used} of "
+                f"{self.api_usage.limit} requests"
+            )
+        return with_backoff(call, retries=self.retries, sleep=self.sleep)
+
+    def _drain(self) -> list[tuple[str, dict[str, Any]]]:
+        pending = list(self.pending.items())
+        self.pending = {}
+        return pending
+
+    def _write_collection(
+        self, batch: list[tuple[str, dict[str, Any]]]
+    ) -> list[WriteResult]:
+        self.collection_records += len(batch)
+        response = self._call(
+            lambda: self.client.restful(
+                "composite/sobjects",
+                method="PATCH",
+                json={
+                    "allOrNone": False,
+                    "records": [
+                        {"attributes": {"type": "Contact"}, "id": uid, **changes}
+                        for uid, changes in batch
+                    ],
+                },
+            )
+        )
+        response = response or []
+        if len(response) != len(batch):
+            logging.warning(
+                "Salesforce returned %d results for %d records",
+                len(response),
+                len(batch),
+            )
+        # Results are returned in the same order as the request's records.
+        results = [
+            WriteResult(
+                uid,
+                changes,
+                [] if result["success"] else [e["message"] for e in result["errors"]],
+            )
+            for (uid, changes), result in zip(batch, response)
+        ]
+        return results + [
+            WriteResult(uid, changes, ["No result was returned"])
+            for uid, changes in batch[len(results) :]
+        ]
 
+    def _write_bulk(self, batch: list[tuple[str, dict[str, Any]]]) -> list[WriteResult]:
+        # In Bulk API CSVs, an empty cell leaves the field unchanged and `#N/A`
+        # clears it.
+        records = [
+            {
+                "Id": uid,
+                **{k: "#N/A" if v is None else str(v) for k, v in changes.items()},
+            }
+            for uid, changes in batch
+        ]
+        bulk_contact: Any = self.client.bulk2.Contact  # type: ignore[union-attr]
+        jobs = self._call(
+            lambda: bulk_contact.update(records=records, wait=self.bulk_poll_seconds)
+        )
 
-def write_change(client: Salesforce, uid: str, changes: dict[str, str]) -> None:
-    client.Contact.update(uid, changes)  # type: ignore[operator]
+        errors: dict[str, list[str]] = {}
+        for job in jobs:
+            if job["numberRecordsProcessed"] < job["numberRecordsTotal"]:
+                unprocessed = bulk_contact.get_unprocessed_records(job["job_id"])
+                for row in csv.DictReader(StringIO(unprocessed)):
+                    errors[row["Id"]] = ["Record was not processed"]
+            if job["numberRecordsFailed"]:
+                failed = bulk_contact.get_failed_records(job["job_id"])
+                for row in csv.DictReader(StringIO(failed)):
+                    errors[row["Id"]] = [row["sf__Error"]]
+        return [
+            WriteResult(uid, changes, errors.get(uid, [])) for uid, changes in batch
+        ]
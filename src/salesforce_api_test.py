@@ -0,0 +1,244 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from simple_salesforce import Salesforce
+from simple_salesforce.exceptions import SalesforceGeneralError
+
+from conftest import FakeSalesforce
+from salesforce_api import (
+    ApiLimitReached,
+    ApiUsage,
+    ContactWriter,
+    SyncState,
+    WriteResult,
+    id_boundaries,
+    load_data,
+    query_contacts_parallel,
+)
+from salesforce_entry import SalesforceEntry
+
+
+def test_load_data(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    contacts = [
+        SalesforceEntry.mock(city=f"City {i}").model_dump(by_alias=True)
+        for i in range(5)
+    ]
+    fake_salesforce.contacts = contacts
+    fake_salesforce.page_size = 2
+
+    entries = load_data(salesforce_client)
+    assert [entry.city for entry in entries] == [f"City {i}" for i in range(5)]
+    assert fake_salesforce.queries[-1].endswith("FROM Contact")
+
+    since = datetime(2024, 5, 1, 8, 30, tzinfo=timezone(timedelta(hours=-7)))
+    list(load_data(salesforce_client, modified_since=since))
+    assert fake_salesforce.queries[-1].endswith(
+        "FROM Contact WHERE SystemModstamp > 2024-05-01T15:30:00Z"
+    )
+
+    list(load_data(salesforce_client, where="A = 1 OR B = 2"))
+    assert fake_salesforce.queries[-1].endswith("FROM Contact WHERE A = 1 OR B = 2")
+    list(load_data(salesforce_client, modified_since=since, where="A = 1 OR B = 2"))
+    assert fake_salesforce.queries[-1].endswith(
+        "WHERE SystemModstamp > 2024-05-01T15:30:00Z AND (A = 1 OR B = 2)"
+    )
+
+
+def test_sync_state(tmp_path: Path) -> None:
+    path = tmp_path / "sync.json"
+    interval = timedelta(days=7)
+    day1 = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+    state = SyncState.read(path)
+    assert state.modified_since(day1, interval, "v1") is None
+
+    state.advance(day1, full_sync=True, reference_version="v1").write(path)
+    state = SyncState.read(path)
+    assert state.reference_version == "v1"
+    day2 = day1 + timedelta(days=1)
+    assert state.modified_since(day2, interval, "v1") == day1 - timedelta(minutes=10)
+
+    state = state.advance(day2, full_sync=False, reference_version="v1")
+    assert state.last_full_sync == day1
+    assert state.modified_since(day1 + interval, interval, "v1") is None
+
+
+def test_sync_state_reference_version_change(tmp_path: Path) -> None:
+    interval = timedelta(days=7)
+    day1 = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    state = SyncState().advance(day1, full_sync=True, reference_version="v1")
+    assert state.modified_since(day1 + timedelta(days=1), interval, "v2") is None
+
+
+def test_writer_batches_collection_updates(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    fake_salesforce.invalid_ids.add("3")
+    writer = ContactWriter(salesforce_client, batch_size=2)
+    assert writer.add("1", {"MailingCity": "City 1"}) == []
+    writer.add("1", {"MailingState": None})
+    assert writer.add("2", {"MailingCity": "City 2"}) == [
+        WriteResult("1", {"MailingCity": "City 1", "MailingState": None}, []),
+        WriteResult("2", {"MailingCity": "City 2"}, []),
+    ]
+    assert writer.add("3", {"MailingCity": "City 3"}) == []
+
+    results = writer.flush()
+    assert [(r.uid, r.errors) for r in results] == [("3", ["Invalid record 3"])]
+    assert fake_salesforce.updates == {
+        "1": {"MailingCity": "City 1", "MailingState": None},
+        "2": {"MailingCity": "City 2"},
+    }
+    assert (
+        fake_salesforce.requests
+        == [("PATCH", "/services/data/v59.0/composite/sobjects")] * 2
+    )
+    assert writer.flush() == []
+
+
+def test_writer_fails_records_without_a_result(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    fake_salesforce.dropped_results = 1
+    writer = ContactWriter(salesforce_client, batch_size=2)
+    writer.add("1", {"MailingCity": "City 1"})
+    assert writer.add("2", {"MailingCity": "City 2"}) == [
+        WriteResult("1", {"MailingCity": "City 1"}, []),
+        WriteResult("2", {"MailingCity": "City 2"}, ["No result was returned"]),
+    ]
+
+
+def test_writer_buffers_for_bulk_once_run_is_large(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    writer = ContactWriter(
+        salesforce_client, batch_size=2, bulk_threshold=4, bulk_poll_seconds=0
+    )
+    written = []
+    for uid in range(10):
+        written.extend(writer.add(str(uid), {"MailingCity": "Tempe"}))
+    written.extend(writer.flush())
+    assert [r.uid for r in written] == [str(uid) for uid in range(10)]
+    # Two collections of two, then a bulk job of four, then the rest.
+    paths = [path.rsplit("/", 1)[-1] for method, path in fake_salesforce.requests]
+    assert paths.count("sobjects") == 3
+    assert len(fake_salesforce.updates) == 10
+
+
+def test_writer_uses_bulk_api_above_threshold(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    fake_salesforce.invalid_ids.add("2")
+    writer = ContactWriter(salesforce_client, bulk_threshold=3, bulk_poll_seconds=0)
+    assert writer.add("1", {"MailingCity": "Tempe", "MailingLatitude": 1.5}) == []
+    assert writer.add("2", {"MailingCity": "Mesa"}) == []
+    results = writer.add("3", {"MailingState": None})
+
+    assert [(r.uid, r.errors) for r in results] == [
+        ("1", []),
+        ("2", ["Invalid record 2"]),
+        ("3", []),
+    ]
+    assert fake_salesforce.updates == {
+        "1": {"MailingCity": "Tempe", "MailingLatitude": "1.5"},
+        "3": {"MailingState": None},
+    }
+    assert writer.flush() == []
+
+
+def test_writer_retries_with_backoff(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    fake_salesforce.unavailable = 2
+    delays: list[float] = []
+    writer = ContactWriter(salesforce_client, sleep=delays.append)
+    writer.add("1", {"MailingCity": "Tempe"})
+    assert [r.success for r in writer.flush()] == [True]
+    assert delays == [1, 2]
+    assert fake_salesforce.updates == {"1": {"MailingCity": "Tempe"}}
+
+
+def test_writer_gives_up_after_retries(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    fake_salesforce.unavailable = 3
+    writer = ContactWriter(salesforce_client, retries=2, sleep=lambda _: None)
+    writer.add("1", {"MailingCity": "Tempe"})
+    with pytest.raises(SalesforceGeneralError):
+        writer.flush()
+
+
+def test_writer_stops_at_api_usage_limit(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    fake_salesforce.api_limit = 4
+    api_usage = ApiUsage()
+    salesforce_client.session.hooks["response"].append(api_usage.response_hook)
+    writer = ContactWriter(
+        salesforce_client, batch_size=1, api_usage=api_usage, max_api_usage=0.5
+    )
+    with pytest.raises(ApiLimitReached, match="2 of 4"):
+        for uid in ("1", "2", "3"):
+            writer.add(uid, {"MailingCity": "Tempe"})
+    assert (api_usage.used, api_usage.limit) == (2, 4)
+    assert list(fake_salesforce.updates) == ["1", "2"]
+
+
+def test_id_boundaries() -> None:
+    boundaries = id_boundaries("003000000000000AAA", "003000000zzzzzzAAA", 4)
+    assert boundaries == ["003000000FUzzzz", "003000000Uzzzzz", "003000000kUzzzz"]
+    assert id_boundaries("003000000000001", "003000000000009", 4) == [
+        "003000000000003",
+        "003000000000005",
+        "003000000000007",
+    ]
+    assert id_boundaries("003000000000001", "003000000000001", 4) == []
+
+
+def test_load_data_parallel(
+    salesforce_client: Salesforce, fake_salesforce: FakeSalesforce
+) -> None:
+    contacts = [SalesforceEntry.mock().model_dump(by_alias=True) for _ in range(1000)]
+    for i, contact in enumerate(contacts):
+        contact["Id"] = f"003{i * 7919:012}AAA"
+    random.Random(0).shuffle(contacts)
+    fake_salesforce.contacts = contacts
+    fake_salesforce.page_size = 50
+    fake_salesforce.latency = 0.03
+
+    serial = [entry.uid for entry in load_data(salesforce_client)]
+    assert fake_salesforce.max_in_flight == 1
+
+    parallel = [entry.uid for entry in load_data(salesforce_client, workers=4)]
+    assert sorted(parallel) == sorted(serial)
+    assert len(set(parallel)) == len(contacts)
+    # The requests overlap, rather than waiting on each other's latency.
+    assert fake_salesforce.max_in_flight == 4
+
+    # A slow consumer holds back the threads, rather than every range loading.
+    requested = len(fake_salesforce.requests)
+    records = query_contacts_parallel(
+        salesforce_client, workers=2, chunks_per_worker=2, buffer_size=10
+    )
+    next(records)
+    time.sleep(0.5)
+    # The edge queries, then at most a page per thread beyond the buffer.
+    assert len(fake_salesforce.requests) - requested <= 2 + 2 * 2
+    records.close()
+
+    # The other conditions still apply to every range.
+    queried = len(fake_salesforce.queries)
+    list(load_data(salesforce_client, where="A = 1 OR B = 2", workers=2))
+    queries = fake_salesforce.queries[queried:]
+    assert len(queries) == 2 + 2 * 4
+    assert all("A = 1 OR B = 2" in query for query in queries)
+    assert all(
+        "WHERE (A = 1 OR B = 2) AND Id " in query
+        for query in queries
+        if "LIMIT 1" not in query
+    )
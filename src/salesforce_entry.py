@@ -1,54 +1,37 @@
-from typing import Callable
+from typing import TYPE_CHECKING, Any, Callable, Mapping
 
-from uszipcode import SearchEngine
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 from mailchimp_coordinates import Coordinates
 from country_codes import COUNTRY_CODES_TWO_LETTER_TO_THREE, COUNTRY_NAMES_TO_THREE
 from state_codes import US_STATES_TO_CODES
+from zip_index import ZipIndex
 
 
-class SalesforceEntry(BaseModel):
-    uid: str = Field(..., alias="Id", frozen=True)
-    email: str | None = Field(..., alias="Email", frozen=True)
-    city: str | None = Field(..., alias="MailingCity")
-    country: str | None = Field(..., alias="MailingCountry")
-    latitude: float | None = Field(..., alias="MailingLatitude")
-    longitude: float | None = Field(..., alias="MailingLongitude")
-    zipcode: str | None = Field(..., alias="MailingPostalCode")
-    state: str | None = Field(..., alias="MailingState")
-    street: str | None = Field(..., alias="MailingStreet")
-    metro: str | None = Field(..., alias="Metro_Area__c")
+class EnrichableContact:
+    """The enrichment logic, shared by `SalesforceEntry` and the rows of a
+    `contact_store.ContactStore`."""
 
-    @classmethod
-    def mock(
-        cls,
-        *,
-        city: str | None = None,
-        country: str | None = None,
-        latitude: float | None = None,
-        longitude: float | None = None,
-        zipcode: str | None = None,
-        state: str | None = None,
-        street: str | None = None,
-        metro: str | None = None,
-    ) -> "SalesforceEntry":
-        return cls(
-            Email="tech@parkingreform.org",
-            Id="12345",
-            MailingCity=city,
-            MailingCountry=country,
-            MailingLatitude=latitude,
-            MailingLongitude=longitude,
-            MailingPostalCode=zipcode,
-            MailingState=state,
-            MailingStreet=street,
-            Metro_Area__c=metro,
-        )
+    if TYPE_CHECKING:
+        uid: str
+        email: str | None
+        city: str | None
+        country: str | None
+        latitude: float | None
+        longitude: float | None
+        zipcode: str | None
+        state: str | None
+        street: str | None
+        metro: str | None
+
+        def compute_changes(self) -> dict[str, str]: ...
+
+        def compute_original_values(self) -> dict[str, Any]: ...
 
-    def compute_changes(self, original_model_dump: dict[str, str]) -> dict[str, str]:
-        new_model_dump = self.model_dump(by_alias=True)
-        return {k: v for k, v in new_model_dump.items() if v != original_model_dump[k]}
+    else:
+        # Hidden from mypy, which would otherwise reject assigning the attributes
+        # above. This lets `ContactRow` avoid a per-instance `__dict__`.
+        __slots__ = ()
 
     def normalize(self) -> None:
         """Normalize the country code, state, city, and zip.
@@ -84,21 +67,26 @@ class SalesforceEntry(BaseModel):
                 raise AssertionError(f"Unexpected zipcode for {self}")
             self.zipcode = self.zipcode[:5]
 
+    def needs_coordinates(self) -> bool:
+        """Whether the metro area can only be computed from Mailchimp coordinates."""
+        metro_area_can_be_computed = self.zipcode or (self.city and self.country)
+        return not metro_area_can_be_computed
+
     def populate_via_coordinates(
         self, coordinates: Coordinates | None, reverse_geocode: Callable
-    ) -> None:
+    ) -> bool | None:
+        """Returns whether the coordinates gave a zip code, or None if the contact
+        didn't need them."""
+        if not self.needs_coordinates():
+            return None
         if coordinates is None:
-            return
-
-        metro_area_can_be_computed = self.zipcode or (self.city and self.country)
-        if metro_area_can_be_computed:
-            return
+            return False
 
         addr = reverse_geocode(f"{coordinates.latitude}, {coordinates.longitude}").raw[
             "address"
         ]
         if "postcode" not in addr:
-            return
+            return False
 
         self.latitude = coordinates.latitude
         self.longitude = coordinates.longitude
@@ -110,23 +98,29 @@ class SalesforceEntry(BaseModel):
         self.country = addr.get("country_code", "").upper() or None
         self.state = addr.get("state")
         self.city = addr.get("city")
+        return True
+
+    def populate_via_zipcode(self, zip_index: ZipIndex) -> bool | None:
+        """Look up city and state for US zip codes.
 
-    def populate_via_zipcode(self, zipcode_search_engine: SearchEngine) -> None:
-        """Look up city and state for US zip codes."""
+        Returns whether the zip code was found, or None if no lookup was needed.
+        """
         if self.country != "USA" or not self.zipcode or (self.state and self.city):
-            return
-        zipcode_info = zipcode_search_engine.by_zipcode(self.zipcode)
+            return None
+        zipcode_info = zip_index.by_zipcode(self.zipcode)
         if zipcode_info:
             self.state = zipcode_info.state
             self.city = zipcode_info.major_city
+        return zipcode_info is not None
 
     def populate_metro_area(
         self,
         us_zip_to_metro: dict[str, str],
-        us_city_and_state_to_metro: dict[tuple[str, str], str],
-    ) -> None:
+        us_city_and_state_to_metro: Mapping[tuple[str, str], str],
+    ) -> bool | None:
+        """Returns whether a metro area was found, or None for non-US contacts."""
         if self.country != "USA":
-            return
+            return None
 
         new_metro = None
         if self.zipcode:
@@ -136,3 +130,93 @@ class SalesforceEntry(BaseModel):
 
         if new_metro is not None:
             self.metro = new_metro
+        return new_metro is not None
+
+
+class SalesforceEntry(EnrichableContact, BaseModel):
+    uid: str = Field(..., alias="Id", frozen=True)
+    email: str | None = Field(..., alias="Email", frozen=True)
+    city: str | None = Field(..., alias="MailingCity")
+    country: str | None = Field(..., alias="MailingCountry")
+    latitude: float | None = Field(..., alias="MailingLatitude")
+    longitude: float | None = Field(..., alias="MailingLongitude")
+    zipcode: str | None = Field(..., alias="MailingPostalCode")
+    state: str | None = Field(..., alias="MailingState")
+    street: str | None = Field(..., alias="MailingStreet")
+    metro: str | None = Field(..., alias="Metro_Area__c")
+
+    # The value of each field before it was first assigned, so that we can compute
+    # changes without snapshotting every record.
+    _original_values: dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def mock(
+        cls,
+        *,
+        email: str = "tech@parkingreform.org",
+        city: str | None = None,
+        country: str | None = None,
+        latitude: float | None = None,
+        longitude: float | None = None,
+        zipcode: str | None = None,
+        state: str | None = None,
+        street: str | None = None,
+        metro: str | None = None,
+    ) -> "SalesforceEntry":
+        return cls(
+            Email=email,
+            Id="12345",
+            MailingCity=city,
+            MailingCountry=country,
+            MailingLatitude=latitude,
+            MailingLongitude=longitude,
+            MailingPostalCode=zipcode,
+            MailingState=state,
+            MailingStreet=street,
+            Metro_Area__c=metro,
+        )
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # This runs for every assignment during enrichment, so it avoids pydantic's
+        # `__setattr__` and `__getattr__` for the fields that enrichment assigns.
+        if name not in _TRACKED_FIELDS:
+            super().__setattr__(name, value)
+            return
+        original_values = self._tracked_originals()
+        if name not in original_values:
+            original_values[name] = self.__dict__[name]
+        # What pydantic does for fields without validation on assignment.
+        self.__dict__[name] = value
+        self.__pydantic_fields_set__.add(name)
+
+    def compute_changes(self) -> dict[str, str]:
+        """Return the fields whose values changed, keyed by their Salesforce names."""
+        values = self.__dict__
+        return {
+            _ALIASES[name]: value
+            for name, original in self._tracked_originals().items()
+            if (value := values[name]) != original
+        }
+
+    def compute_original_values(self) -> dict[str, Any]:
+        """Return the values that `compute_changes` replaces, keyed the same way."""
+        values = self.__dict__
+        return {
+            _ALIASES[name]: original
+            for name, original in self._tracked_originals().items()
+            if values[name] != original
+        }
+
+    def _tracked_originals(self) -> dict[str, Any]:
+        # Never None, since the model has a private attribute.
+        return self.__pydantic_private__["_original_values"]  # type: ignore[index]
+
+
+# The fields whose assignments `SalesforceEntry` tracks. Frozen fields are left to
+# pydantic, which rejects assigning them.
+_TRACKED_FIELDS = frozenset(
+    name for name, field in SalesforceEntry.model_fields.items() if not field.frozen
+)
+_ALIASES = {
+    name: field.alias or name for name, field in SalesforceEntry.model_fields.items()
+}
@@ -1,10 +1,12 @@
+from typing import Callable
 from unittest.mock import Mock
 
 import pytest
-from uszipcode import SearchEngine
 
+from contact_store import ContactStore
 from mailchimp_coordinates import Coordinates
-from salesforce_entry import SalesforceEntry
+from salesforce_entry import EnrichableContact, SalesforceEntry
+from zip_index import ZipIndex, ZipInfo
 
 
 @pytest.fixture
@@ -23,6 +25,23 @@ def geocode_reverse_mock():
     return reverse_fn
 
 
+@pytest.fixture(params=["per_record", "batch"])
+def normalized(request) -> Callable[..., EnrichableContact]:
+    """Normalize a mock entry with `SalesforceEntry.normalize` or with
+    `ContactStore.normalize`, which must give identical results."""
+
+    def normalize(**kwargs) -> EnrichableContact:
+        entry = SalesforceEntry.mock(**kwargs)
+        if request.param == "per_record":
+            entry.normalize()
+            return entry
+        store = ContactStore.from_records([entry.model_dump(by_alias=True)])
+        assert store.normalize() == [False]
+        return store[0]
+
+    return normalize
+
+
 @pytest.mark.parametrize(
     "arg,expected",
     [
@@ -34,9 +53,8 @@ def geocode_reverse_mock():
         ("MEX", "MEX"),
     ],
 )
-def test_normalize_country(arg: str, expected: str) -> None:
-    entry = SalesforceEntry.mock(country=arg)
-    entry.normalize()
+def test_normalize_country(normalized, arg: str, expected: str) -> None:
+    entry = normalized(country=arg)
     assert entry.country == expected
 
 
@@ -48,9 +66,8 @@ def test_normalize_country(arg: str, expected: str) -> None:
         ("MEX", "Arizona", "Arizona"),
     ],
 )
-def test_normalize_state(country: str, state: str, expected: str) -> None:
-    entry = SalesforceEntry.mock(country=country, state=state)
-    entry.normalize()
+def test_normalize_state(normalized, country: str, state: str, expected: str) -> None:
+    entry = normalized(country=country, state=state)
     assert entry.state == expected
 
 
@@ -58,9 +75,8 @@ def test_normalize_state(country: str, state: str, expected: str) -> None:
     "arg,expected",
     [("ST. PAUL", "St. Paul"), ("St. Paul", "St. Paul")],
 )
-def test_normalize_city_capitalization(arg: str, expected: str) -> None:
-    entry = SalesforceEntry.mock(city=arg)
-    entry.normalize()
+def test_normalize_city_capitalization(normalized, arg: str, expected: str) -> None:
+    entry = normalized(city=arg)
     assert entry.city == expected
 
 
@@ -73,12 +89,36 @@ def test_normalize_city_capitalization(arg: str, expected: str) -> None:
         ("MEX", "11370-54", "11370-54"),
     ],
 )
-def test_normalize_zip_code_length(country: str, zip: str, expected: str) -> None:
-    entry = SalesforceEntry.mock(country=country, zipcode=zip)
-    entry.normalize()
+def test_normalize_zip_code_length(
+    normalized, country: str, zip: str, expected: str
+) -> None:
+    entry = normalized(country=country, zipcode=zip)
     assert entry.zipcode == expected
 
 
+@pytest.mark.parametrize(
+    "country,state,zip",
+    [
+        ("XX", None, None),
+        ("Atlantis", None, None),
+        ("USA", "Narnia", None),
+        ("USA", None, "113702314"),
+    ],
+)
+def test_normalize_invalid(country: str, state: str, zip: str) -> None:
+    entry = SalesforceEntry.mock(country=country, state=state, zipcode=zip, city="MESA")
+    valid = SalesforceEntry.mock(city="MESA")
+    store = ContactStore.from_records(
+        [entry.model_dump(by_alias=True), valid.model_dump(by_alias=True)]
+    )
+
+    with pytest.raises((ValueError, AssertionError)):
+        entry.normalize()
+    assert store.normalize() == [True, False]
+    assert store[0].compute_changes() == {}
+    assert store[1].compute_changes() == {"MailingCity": "Mesa"}
+
+
 @pytest.mark.parametrize(
     "country,zip,expected_state,expected_city",
     [
@@ -90,11 +130,23 @@ def test_populate_via_zipcode(
     country: str, zip: str, expected_state: str, expected_city: str
 ) -> None:
     entry = SalesforceEntry.mock(country=country, zipcode=zip)
-    entry.populate_via_zipcode(SearchEngine())
+    entry.populate_via_zipcode(ZipIndex.load())
     assert entry.state == expected_state
     assert entry.city == expected_city
 
 
+def test_populate_via_zipcode_index() -> None:
+    zip_index = ZipIndex({"00501": ZipInfo("NY", "Holtsville")})
+    entry = SalesforceEntry.mock(country="USA", zipcode="501", city="Holtsville")
+    entry.populate_via_zipcode(zip_index)
+    assert entry.state == "NY"
+
+    entry = SalesforceEntry.mock(country="USA", zipcode="99999")
+    entry.populate_via_zipcode(zip_index)
+    assert entry.state is None
+    assert entry.city is None
+
+
 def test_populate_via_coordinates(geocode_reverse_mock) -> None:
     coordinates = Coordinates(latitude=1.1, longitude=4.2)
     entry = SalesforceEntry.mock()
@@ -126,18 +178,19 @@ def test_populate_metro_area(
 
 
 def test_compute_changes() -> None:
-    entry = SalesforceEntry.mock()
-    original_model_dump = entry.model_dump(by_alias=True)
-
-    assert not entry.compute_changes(original_model_dump)
+    entry = SalesforceEntry.mock(city="Tempe")
+    assert not entry.compute_changes()
 
     entry.city = "My City"
     entry.zipcode = "11370"
     updates = {"MailingCity": "My City", "MailingPostalCode": "11370"}
-    assert entry.compute_changes(original_model_dump) == updates
-    updated_model_dump = entry.model_dump(by_alias=True)
+    assert entry.compute_changes() == updates
 
     entry.country = "USA"
     country_update = {"MailingCountry": "USA"}
-    assert entry.compute_changes(original_model_dump) == {**updates, **country_update}
-    assert entry.compute_changes(updated_model_dump) == country_update
+    assert entry.compute_changes() == {**updates, **country_update}
+
+    # Assigning the original value back is not a change.
+    entry.city = "Tempe"
+    entry.zipcode = None
+    assert entry.compute_changes() == country_update
@@ -0,0 +1,86 @@
+import multiprocessing
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from types import TracebackType
+from typing import Any, Callable, TypeVar
+
+from run_report import RunReport
+
+"""Run the independent loads at the start of a run concurrently, so that the time
+until the first contact is enriched approaches the slowest load rather than the sum
+of all of them.
+
+Network-bound loads run on threads. CPU-bound loads run in a forked process, so
+they don't compete with the threads for the GIL; submit those first, since forking
+once threads are running can copy locks that other threads hold."""
+
+T = TypeVar("T")
+
+
+class Startup:
+    def __init__(self, report: RunReport) -> None:
+        self.report = report
+        self._threads = ThreadPoolExecutor(thread_name_prefix="startup")
+        self._processes: ProcessPoolExecutor | None = None
+        self._futures: list[Future[Any]] = []
+
+    def in_thread(self, name: str, fn: Callable[..., T], *args: Any) -> Future[T]:
+        return self._submit(self._threads, name, fn, *args)
+
+    def in_process(self, name: str, fn: Callable[..., T], *args: Any) -> Future[T]:
+        """Run `fn` in a forked process, which returns its result pickled."""
+        if self._processes is None:
+            # One process is plenty for the few CPU-bound loads, and forking a
+            # process per CPU would copy the whole interpreter each time.
+            self._processes = ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context("fork")
+            )
+        return self._submit(self._processes, name, fn, *args)
+
+    def result(self, future: Future[T]) -> T:
+        """Wait for `future`, but raise as soon as any task fails, rather than only
+        once the tasks before it finish."""
+        pending = set(self._futures)
+        while True:
+            for f in self._futures:
+                if f.done() and not f.cancelled() and (error := f.exception()):
+                    raise error
+            if future.done():
+                return future.result()
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    def close(self, cancel: bool = False) -> None:
+        self._threads.shutdown(wait=not cancel, cancel_futures=cancel)
+        if self._processes:
+            self._processes.shutdown(wait=not cancel, cancel_futures=cancel)
+
+    def __enter__(self) -> "Startup":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        # Don't wait on the other loads when one of them failed.
+        self.close(cancel=exc is not None)
+
+    def _submit(
+        self, executor: Executor, name: str, fn: Callable[..., T], *args: Any
+    ) -> Future[T]:
+        start = time.perf_counter()
+        future = executor.submit(fn, *args)
+        # The time until each load is ready, including any time spent queued.
+        future.add_done_callback(
+            lambda _: self.report.add_seconds(name, time.perf_counter() - start)
+        )
+        self._futures.append(future)
+        return future
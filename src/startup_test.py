@@ -0,0 +1,44 @@
+import os
+import time
+
+import pytest
+
+from run_report import RunReport
+from startup import Startup
+
+
+def sleep_then(seconds: float, value: int) -> int:
+    time.sleep(seconds)
+    return value
+
+
+def fail() -> None:
+    raise ValueError("load failed")
+
+
+def test_tasks_overlap() -> None:
+    report = RunReport()
+    start = time.perf_counter()
+    with Startup(report) as tasks:
+        slow = tasks.in_process("slow", sleep_then, 0.3, 1)
+        fast = tasks.in_thread("fast", sleep_then, 0.1, 2)
+        other = tasks.in_thread("other", sleep_then, 0.3, 3)
+        assert [tasks.result(f) for f in (fast, slow, other)] == [2, 1, 3]
+    assert time.perf_counter() - start < 0.6
+    assert set(report.seconds) == {"slow", "fast", "other"}
+    assert report.seconds["fast"] < report.seconds["slow"]
+
+
+def test_in_process_runs_in_another_process() -> None:
+    with Startup(RunReport()) as tasks:
+        assert tasks.result(tasks.in_process("pid", os.getpid)) != os.getpid()
+
+
+def test_result_raises_as_soon_as_any_task_fails() -> None:
+    start = time.perf_counter()
+    with pytest.raises(ValueError, match="load failed"):
+        with Startup(RunReport()) as tasks:
+            slow = tasks.in_thread("slow", sleep_then, 2, 1)
+            tasks.in_thread("broken", fail)
+            tasks.result(slow)
+    assert time.perf_counter() - start < 1
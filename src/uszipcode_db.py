@@ -0,0 +1,59 @@
+import sqlite3
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+"""Read the SQLite database that `uszipcode` ships directly, which avoids the cost
+of its SQLAlchemy engine and ORM objects when we need every row."""
+
+
+class ZipcodeRow(NamedTuple):
+    zipcode: str
+    state: str | None
+    major_city: str | None
+    latitude: float | None
+    longitude: float | None
+    bounds_west: float | None
+    bounds_east: float | None
+    bounds_north: float | None
+    bounds_south: float | None
+    radius_in_miles: float | None = None
+
+
+def db_path() -> Path:
+    """Return the path to the simple zipcode database, downloading it if missing."""
+    from uszipcode.db import (
+        DEFAULT_SIMPLE_DB_FILE_PATH,
+        SIMPLE_DB_FILE_DOWNLOAD_URL,
+        download_db_file,
+    )
+
+    path = Path(str(DEFAULT_SIMPLE_DB_FILE_PATH))
+    if not path.exists():
+        download_db_file(
+            db_file_path=str(path),
+            download_url=SIMPLE_DB_FILE_DOWNLOAD_URL,
+            chunk_size=1024 * 1024,
+            progress_size=50 * 1024 * 1024,
+        )
+    return path
+
+
+def version(path: Path | None = None) -> str:
+    """Identify the database's contents without reading the whole file."""
+    stat = (path or db_path()).stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def read_zipcodes(path: Path | None = None) -> Iterator[ZipcodeRow]:
+    connection = sqlite3.connect(f"file:{path or db_path()}?mode=ro", uri=True)
+    try:
+        yield from map(
+            ZipcodeRow._make,
+            connection.execute(
+                "SELECT zipcode, state, major_city, lat, lng, bounds_west, "
+                "bounds_east, bounds_north, bounds_south, radius_in_miles "
+                "FROM simple_zipcode"
+            ),
+        )
+    finally:
+        connection.close()
@@ -0,0 +1,44 @@
+import sys
+from typing import Iterable, NamedTuple
+
+import uszipcode_db
+from uszipcode_db import ZipcodeRow
+
+"""An in-memory index of the city and state of every US zip code.
+
+`uszipcode.SearchEngine.by_zipcode` runs a SQL query and builds an ORM object per
+call, whereas this loads the database once into a dict."""
+
+
+class ZipInfo(NamedTuple):
+    state: str | None
+    major_city: str | None
+
+
+class ZipIndex:
+    def __init__(self, zipcodes: dict[str, ZipInfo]) -> None:
+        self.zipcodes = zipcodes
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[ZipcodeRow]) -> "ZipIndex":
+        # Many zip codes share a city, so share their `ZipInfo` tuples too.
+        infos: dict[ZipInfo, ZipInfo] = {}
+        zipcodes = {}
+        for row in rows:
+            info = ZipInfo(
+                row.state and sys.intern(row.state),
+                row.major_city and sys.intern(row.major_city),
+            )
+            zipcodes[row.zipcode] = infos.setdefault(info, info)
+        return cls(zipcodes)
+
+    @classmethod
+    def load(cls) -> "ZipIndex":
+        return cls.from_rows(uszipcode_db.read_zipcodes())
+
+    def by_zipcode(self, zipcode: str) -> ZipInfo | None:
+        # Like `SearchEngine.by_zipcode`, zero pad zip codes such as "501".
+        return self.zipcodes.get(zipcode.zfill(5))
+
+    def lookup_many(self, zipcodes: Iterable[str]) -> list[ZipInfo | None]:
+        return [self.by_zipcode(zipcode) for zipcode in zipcodes]